@@ -13,7 +13,7 @@
 # This library can be used in RaspberryPi to communicate with BrickPi
 # Major Changes from C code:
 # - The timeout parameter for BrickPiRx is in seconds expressed as a floating value
-# - Instead of Call by Reference in BrickPiRx, multiple values are returned and then copied to the main Array appropriately
+# - Instead of Call by Reference in BrickPiRx, multiple values are returned; the received message is left in the reusable Rx_Buffer
 # - BrickPiStruct Variables are assigned to None and then modified to avoid appending which may lead to errors
 
 # Python 3 Setup Notes:
@@ -41,28 +41,64 @@
 # Function BrickPiRx() (background function that receives UART messages from the BrickPi) can return 0 (success), -1 (undefined error that shouldn't have happened, e.g. a filesystem error), -2 (timeout: the RPi didn't receive any UART communication from the BrickPi within the specified time), -4 (the message was too short to even contain a valid header), -5 (communication checksum error), or -6 (the number of bytes received was less than specified by the length byte).
 
 import time
-import serial
+import math
+import select
 import sys
-import ir_receiver_check
+import os
+import struct
+import threading
+import logging
+from array import array
+from bisect import bisect_right
+from collections import deque
+from itertools import islice
 
 def debugprint(in_str):
     print(in_str)
     pass
 
-if ir_receiver_check.check_ir():
-    print "Disable IR receiver before continuing"
-    exit() 
-    
 if sys.version_info<(3,0):
     p_version=2
 else:
     p_version=3
 
-ser = serial.Serial()
-ser.port='/dev/ttyAMA0'
-ser.baudrate = 500000
-# ser.writeTimeout = 0.0005
-# ser.timeout = 0.0001
+# Deadlines are taken from a monotonic clock where Python provides one
+monotonic = getattr(time, 'monotonic', time.time)
+
+log = logging.getLogger("BrickPi")
+
+def SerialPort(name):
+    """
+    Returns an (unopened) serial port set up for the BrickPi on device name
+    """
+    import serial   # imported on first use, so importing this module stays cheap
+    port = serial.Serial()
+    port.port = name
+    port.baudrate = 500000
+    port.timeout = 0    # reads never block inside pyserial, BrickPiRx waits with select()
+    # port.writeTimeout = 0.0005
+    return port
+
+IR_Receiver = None  # whether the IR receiver holds the serial port's pins, once BrickPiPreflight() has checked
+
+def BrickPiPreflight():
+    """
+    Check that the Raspberry Pi is set up to talk to the BrickPi
+
+    The LIRC IR receiver uses the pins of the serial port; its configuration
+    files are only read the first time, the result holds for the whole process.
+
+    Returns 0 if the BrickPi can be used, -1 if the IR receiver must be disabled first
+    """
+    global IR_Receiver
+    if IR_Receiver is None:
+        import ir_receiver_check
+        IR_Receiver = ir_receiver_check.check_ir()
+    if IR_Receiver:
+        print("Disable IR receiver before continuing")
+        return -1
+    return 0
+
 
 # DEBUG = 1  # Remove to hide errors
 
@@ -200,35 +236,38 @@ INDEX_GREEN = 1
 INDEX_BLUE  = 2
 INDEX_BLANK = 3
 
-Array = [0] * 256
-BytesReceived = None
-Bit_Offset    = 0
-Retried = 0
 
 class BrickPiStruct:
-    Address = [ 1, 2 ]
-    MotorSpeed  = [0] * 4
-
-    MotorEnable = [0] * 4
-
-    EncoderOffset = [None] * 4
-    Encoder       = [None] * 4
-
-    Sensor         = [None] * 4
-    SensorArray    = [ [None] * 4 for i in range(4) ]
-    SensorType     = [0] * 4
-    SensorSettings = [ [None] * 8 for i in range(4) ]
-
-    SensorI2CDevices = [None] * 4
-    SensorI2CSpeed   = [None] * 4
-    SensorI2CAddr    = [ [None] * 8 for i in range(4) ]
-    SensorI2CWrite   = [ [None] * 8 for i in range(4) ]
-    SensorI2CRead    = [ [None] * 8 for i in range(4) ]
-    SensorI2COut     = [ [ [None] * 16 for i in range(8) ] for i in range(4) ]
-    SensorI2CIn      = [ [ [None] * 16 for i in range(8) ] for i in range(4) ]
-    Timeout = 0
-    
-BrickPi = BrickPiStruct()
+    """
+    The motor and sensor settings and readings of one BrickPi
+    """
+    def __init__(self):
+        self.Address = [ 1, 2 ]
+        self.MotorSpeed  = [0] * 4
+
+        self.MotorEnable = [0] * 4
+
+        self.MotorType        = [TYPE_MOTOR_PWM] * 4
+        self.MotorTargetSpeed = [0] * 4  # degrees per second, for TYPE_MOTOR_SPEED
+
+        self.EncoderOffset = [None] * 4
+        self.Encoder       = [None] * 4
+        self.EncoderVelocity     = [None] * 4  # degrees per second
+        self.EncoderAcceleration = [None] * 4  # degrees per second squared
+
+        self.Sensor         = [None] * 4
+        self.SensorArray    = [ [None] * 4 for i in range(4) ]
+        self.SensorType     = [0] * 4
+        self.SensorSettings = [ [None] * 8 for i in range(4) ]
+
+        self.SensorI2CDevices = [None] * 4
+        self.SensorI2CSpeed   = [None] * 4
+        self.SensorI2CAddr    = [ [None] * 8 for i in range(4) ]
+        self.SensorI2CWrite   = [ [None] * 8 for i in range(4) ]
+        self.SensorI2CRead    = [ [None] * 8 for i in range(4) ]
+        self.SensorI2COut     = [ [ [None] * 16 for i in range(8) ] for i in range(4) ]
+        self.SensorI2CIn      = [ [ [None] * 16 for i in range(8) ] for i in range(4) ]
+        self.Timeout = 0
 
 #PSP Mindsensors class
 class button:
@@ -295,232 +334,1350 @@ class button:
       print ("")
 
 
-def BrickPiChangeAddress(OldAddr, NewAddr):
-    Array[BYTE_MSG_TYPE] = MSG_TYPE_CHANGE_ADDR;
-    Array[BYTE_NEW_ADDRESS] = NewAddr;
-    BrickPiTx(OldAddr, 2, Array)
-    res, BytesReceived, InArray = BrickPiRx(0.005000)
-    if res :
-        return -1
-    for i in range(len(InArray)):
-        Array[i] = InArray[i]
-    if not (BytesReceived == 1 and Array[BYTE_MSG_TYPE] == MSG_TYPE_CHANGE_ADDR):
-        return -1
-    return 0
 
-def BrickPiSetTimeout():
-    for i in range(2):
-        Array[BYTE_MSG_TYPE] = MSG_TYPE_TIMEOUT_SETTINGS
-        Array[BYTE_TIMEOUT] = BrickPi.Timeout&0xFF
-        Array[BYTE_TIMEOUT + 1] = (BrickPi.Timeout / 256     ) & 0xFF
-        Array[BYTE_TIMEOUT + 2] = (BrickPi.Timeout / 65536   ) & 0xFF
-        Array[BYTE_TIMEOUT + 3] = (BrickPi.Timeout / 16777216) & 0xFF
-        BrickPiTx(BrickPi.Address[i], 5, Array)
-        res, BytesReceived, InArray = BrickPiRx(0.002500)
-        if res :
-            return -1
-        for j in range(len(InArray)):
-            Array[j] = InArray[j]
-        if not (BytesReceived == 1 and Array[BYTE_MSG_TYPE] == MSG_TYPE_TIMEOUT_SETTINGS):
-            return -1
-    return 0
+#######################
+# Bit packing
+#######################
+# The BrickPi protocol packs its fields LSB first, back to back, with no regard
+# for byte boundaries.  Rather than walking every field one bit at a time, the
+# whole frame is held in a single integer (Bit_Buffer) indexed by absolute bit
+# position in Array: AddBits ORs a complete field in with one shift, BitsFlush
+# copies the finished integer into Array a byte at a time before transmitting,
+# and after a reply BitsLoad turns the received message back into one integer
+# so that GetBits is a single shift and mask.
+# Bit_Buffer and Bit_Offset belong to the BrickPiDevice, see its bit packing methods.
 
-def motorRotateDegree(power,deg,port,sampling_time=.1,delay_when_stopping=.05):
-    """Rotate the selected motors by specified degree
+def BitsNeeded(value):
+    value = int(value)
+    if value >> 31:
+        return 31
+    return value.bit_length()
 
-    Args:
-      power    : an array of the power values at which to rotate the motors (0-255)
-      deg      : an array of the angle's (in degrees) by which to rotate each of the motor
-      port     : an array of the port's on which the motor is connected
-      sampling_time  : (optional) the rate(in seconds) at which to read the data in the encoders
-      delay_when_stopping:  (optional) the delay (in seconds) for which the motors are run in the opposite direction before stopping
 
-    Returns:
-      0 on success
+#######################
+# Sensor decode plan
+#######################
+# The width and post-processing of each sensor value in a MSG_TYPE_VALUES reply
+# only depends on the sensor type.  BrickPiSetupSensors compiles the configured
+# types into one decoder per port (DecodePlan[chip]) so that BrickPiUpdateValues
+# decodes a reply in a single pass instead of re-checking BrickPi.SensorType on
+# every cycle.  A decoder is called with the BrickPiDevice and the port.
+
+def DecodeValue(bits):
+    def decode(brickpi, port):
+        brickpi.Sensor[port] = brickpi.GetBits(1,0,bits)
+    decode.bits = bits
+    return decode
+
+
+def DecodeColorFull(brickpi, port):
+    brickpi.Sensor[port] = brickpi.GetBits(1,0,3)
+    brickpi.SensorArray[port][INDEX_BLANK] = brickpi.GetBits(1,0,10)
+    brickpi.SensorArray[port][INDEX_RED] = brickpi.GetBits(1,0,10)
+    brickpi.SensorArray[port][INDEX_GREEN] = brickpi.GetBits(1,0,10)
+    brickpi.SensorArray[port][INDEX_BLUE] = brickpi.GetBits(1,0,10)
+
+
+def DecodeI2C(brickpi, port):
+    brickpi.Sensor[port] = brickpi.GetBits(1,0, brickpi.SensorI2CDevices[port])
+    for device in range(brickpi.SensorI2CDevices[port]):
+        if (brickpi.Sensor[port] & ( 0x01 << device)) :
+            for in_byte in range(brickpi.SensorI2CRead[port][device]):
+                brickpi.SensorI2CIn[port][device][in_byte] = brickpi.GetBits(1,0,8)
+
+
+def DecodeUltrasonicI2C(brickpi, port):
+    #Jan's US fix##########
+    DecodeI2C(brickpi, port)
+    if(brickpi.Sensor[port] & ( 0x01 << US_I2C_IDX)) :
+        brickpi.Sensor[port] = brickpi.SensorI2CIn[port][US_I2C_IDX][0]
+    else:
+        brickpi.Sensor[port] = -1
 
-    Usage:
-      Pass the arguments in a list. if a single motor has to be controlled then the arguments should be
-      passed like elements of an array,e.g, motorRotateDegree([255],[360],[PORT_A]) or
-      motorRotateDegree([255,255],[360,360],[PORT_A,PORT_B])
+
+def DecodeInfraredRemote(brickpi, port):
+    brickpi.Sensor[port] = brickpi.GetBits(1,0,32)
+    if 'DEBUG' in globals():
+        if brickpi.Sensor[port] > 4278190080:
+            print ("IR SENSOR RETURNED ERROR")
+
+
+def DecodeGyro(brickpi, port):
+    # EV3 Gyro Mode 0 and 1, Adjust sign
+    value = brickpi.GetBits(1,0,16)
+    if value >= 32767:       # Negative number.  This seems to return a 2 byte number.
+        value = value - 65535
+    brickpi.Sensor[port] = value
+
+
+def SensorDecoder(sensor_type):
+    """
+    Returns the function that decodes the reply value of a sensor of type sensor_type
+    """
+    if sensor_type == TYPE_SENSOR_TOUCH :
+        return DecodeValue(1)
+    elif sensor_type == TYPE_SENSOR_ULTRASONIC_SS :
+        return DecodeValue(8)
+    elif sensor_type == TYPE_SENSOR_COLOR_FULL:
+        return DecodeColorFull
+    elif sensor_type == TYPE_SENSOR_I2C or sensor_type == TYPE_SENSOR_I2C_9V :
+        return DecodeI2C
+    elif sensor_type == TYPE_SENSOR_ULTRASONIC_CONT :
+        return DecodeUltrasonicI2C
+    elif sensor_type in [ TYPE_SENSOR_EV3_COLOR_M2, TYPE_SENSOR_EV3_GYRO_M3 ]:
+        return DecodeValue(32)
+    elif sensor_type in [ TYPE_SENSOR_EV3_INFRARED_M2 ]:
+        return DecodeInfraredRemote
+    elif sensor_type in [ TYPE_SENSOR_EV3_GYRO_M0, TYPE_SENSOR_EV3_GYRO_M1 ]:
+        return DecodeGyro
+    elif sensor_type in range(TYPE_SENSOR_EV3_US_M0,TYPE_SENSOR_EV3_INFRARED_M5+1):
+        return DecodeValue(16)
+    else:   #For all the light, color and raw sensors
+        return DecodeValue(10)
+
+#######################
+# Sample history
+#######################
+# BrickPi.Sensor and friends only hold the latest values.  Once
+# BrickPiEnableHistory() has been called, every decoded reply is also appended
+# to fixed size ring buffers, one per port, in the device's History.  Each sample is
+# tagged with the monotonic() time it was decoded at and with UpdateCycle.
+# Values are stored as floats in array.array buffers; a value the driver hasn't
+# set (None) is stored as NaN.
+
+NAN = float('nan')
+
+
+class BrickPiSampleRing:
+    """
+    Fixed capacity ring buffer of timestamped samples of width values each
+    """
+    def __init__(self, capacity, width=1, lock=None):
+        self.capacity = capacity
+        self.width = width
+        self.count = 0      # number of samples ever appended
+        self.lock = lock if lock is not None else threading.Lock()
+        self._time = array('d', [0.0]) * capacity
+        self._cycle = array('L', [0]) * capacity
+        self._values = array('d', [0.0]) * (capacity * width)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, cycle, values):
+        """
+        Add one sample. Call with self.lock held
+        """
+        index = self.count % self.capacity
+        self._time[index] = timestamp
+        self._cycle[index] = cycle
+        base = index * self.width
+        for value in values:
+            self._values[base] = NAN if value is None else value
+            base += 1
+        self.count += 1
+
+    def last(self, n):
+        """
+        Returns the last n samples (fewer if there aren't that many yet), oldest first,
+        as three arrays: timestamps, cycle numbers and values (width values per sample)
+        """
+        with self.lock:
+            return self._last(n)
+
+    def since(self, timestamp):
+        """
+        Returns the samples taken after timestamp (a monotonic() time), like last()
+        """
+        with self.lock:
+            n = len(self)
+            end = self.count % self.capacity
+            if self.count > self.capacity:
+                # search both sorted halves of the ring
+                older = len(self._time) - bisect_right(self._time, timestamp, end)
+                newer = end - bisect_right(self._time, timestamp, 0, end)
+                found = newer + (older if newer == end else 0)
+            else:
+                found = n - bisect_right(self._time, timestamp, 0, n)
+            return self._last(found)
+
+    def _last(self, n):
+        n = max(0, min(n, len(self)))
+        end = self.count % self.capacity
+        start = (end - n) % self.capacity
+        if n and start >= end:      # wraps around the end of the buffers
+            return (self._time[start:] + self._time[:end],
+                    self._cycle[start:] + self._cycle[:end],
+                    self._values[start * self.width:] + self._values[:end * self.width])
+        return (self._time[start:start + n],
+                self._cycle[start:start + n],
+                self._values[start * self.width:(start + n) * self.width])
+
+
+class BrickPiHistoryStruct:
+    """
+    Sample rings mirroring BrickPi.Encoder, Sensor, SensorArray and SensorI2CIn
+    """
+    def __init__(self, capacity, i2c=False):
+        self.lock = threading.Lock()
+        self.Encoder = [BrickPiSampleRing(capacity, 1, self.lock) for port in range(4)]
+        self.Sensor = [BrickPiSampleRing(capacity, 1, self.lock) for port in range(4)]
+        self.SensorArray = [BrickPiSampleRing(capacity, 4, self.lock) for port in range(4)]
+        self.SensorI2CIn = None
+        if i2c:
+            # all 16 bytes of all 8 devices, device after device
+            self.SensorI2CIn = [BrickPiSampleRing(capacity, 8 * 16, self.lock) for port in range(4)]
+
+
+#######################
+# Sensor events
+#######################
+# Instead of polling BrickPi.Sensor, a program can subscribe to a change on a
+# port.  Subscriptions are checked right after each reply is decoded, so a
+# waiting thread wakes (or a callback runs) within the update that saw the
+# change.  Something has to keep the updates going, usually a
+# BrickPiUpdateThread.  Callbacks run on the updating thread and should return
+# quickly.
+
+def WaitUntil(condition, ready, timeout=None, expires=None):
+    """
+    Wait on condition (taking its lock) until ready() is true
+
+    expires is the monotonic time at which ready() turns true without condition
+    being notified, if there is one.
+    Returns False if ready() still isn't true after timeout seconds
+    """
+    with condition:
+        deadline = None if timeout is None else monotonic() + timeout
+        while not ready():
+            now = monotonic()
+            wait = 1    # wake now and then, so Ctrl+C gets through on Python 2
+            if deadline is not None:
+                if now >= deadline:
+                    return False
+                wait = deadline - now
+            if expires is not None:
+                wait = min(wait, max(0, expires - now))
+            condition.wait(wait)
+        return True
+
+
+class BrickPiSubscription:
+    """
+    A trigger on one port's sensor value (or encoder, with source="Encoder")
+
+    test(previous, value) is called with the value of the previous and of the
+    current update and decides whether the subscription fires.  When it fires
+    callback(value) is called, and threads blocked in wait() are woken.
+    A subscription made with once=True cancels itself after firing.
+    """
+    def __init__(self, brickpi, port, test, callback=None, source="Sensor", once=False):
+        self.brickpi = brickpi
+        self.port = port
+        self.test = test
+        self.callback = callback
+        self.values = getattr(brickpi, source)
+        self.once = once
+        self.fired = 0      # number of times the subscription fired
+        self.value = None   # the value it last fired on
+        self.previous = self.values[port]
+        self._condition = threading.Condition()
+
+    def check(self):
+        value = self.values[self.port]
+        if value is None:
+            return
+        previous, self.previous = self.previous, value
+        if not self.test(previous, value):
+            return
+        with self._condition:
+            self.value = value
+            self.fired += 1
+            self._condition.notify_all()
+        if self.once:
+            self.cancel()
+        if self.callback is not None:
+            try:
+                self.callback(value)
+            except Exception:
+                log.exception("BrickPi event callback raised an exception")
+
+    def wait(self, timeout=None):
+        """
+        Block until the subscription fires again (or has fired, for a once subscription)
+
+        Returns True when it fired, the value is in self.value, or False after timeout seconds
+        """
+        with self._condition:
+            if self.once and self.fired:
+                return True
+            fired = self.fired
+        return WaitUntil(self._condition, lambda: self.fired != fired, timeout)
+
+    def cancel(self):
+        brickpi = self.brickpi
+        with brickpi.Subscriptions_Lock:
+            brickpi.Subscriptions[self.port] = [s for s in brickpi.Subscriptions[self.port] if s is not self]
+
+
+def BrickPiEdge(predicate):
+    """
+    Returns a test for BrickPiSubscribe that passes when predicate(value) becomes true
+    """
+    def test(previous, value):
+        return predicate(value) and (previous is None or not predicate(previous))
+    return test
+
+
+#######################
+# Motor speed
+#######################
+# One BrickPiEncoderEstimator per motor turns the encoder counts of every
+# decoded reply into BrickPi.EncoderVelocity and BrickPi.EncoderAcceleration.
+# Both are smoothed with an exponential filter whose time constant is the
+# estimator's smoothing (in seconds), so the result doesn't depend on the
+# update rate.
+#
+# A motor whose BrickPi.MotorType is TYPE_MOTOR_SPEED is run in closed loop:
+# after every update its power (BrickPi.MotorSpeed) is set from
+# BrickPi.MotorTargetSpeed (degrees per second) and the estimated velocity.
+
+MOTOR_MAX_SPEED = 900   # degrees per second a motor is assumed to turn at power 255
+VELOCITY_SMOOTHING = 0.05   # seconds
+SPEED_KP = 0.2      # power per degree per second of error
+SPEED_KI = 1.0      # power per degree of error
+
+
+class BrickPiEncoderEstimator:
+    """
+    Velocity and acceleration of one motor, from timestamped encoder counts
+    """
+    def __init__(self, brickpi, port, smoothing=VELOCITY_SMOOTHING):
+        self.brickpi = brickpi
+        self.port = port
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the history, for example after the encoder was offset
+        """
+        self.position = None
+        self.time = None
+        self.velocity = 0.0
+        self.acceleration = 0.0
+        self.speed_integral = 0.0
+
+    def update(self, position, now):
+        """
+        Add the encoder reading (in counts) taken at now
+
+        Returns the time since the previous reading, or 0 for the first one
+        """
+        if self.time is None or now <= self.time:
+            self.position = position
+            self.time = now
+            return 0.0
+        dt = now - self.time
+        if self.smoothing > 0:
+            alpha = 1.0 - math.exp(-dt / self.smoothing)
+        else:
+            alpha = 1.0
+        velocity = self.velocity + alpha * ((position - self.position) / (2.0 * dt) - self.velocity)
+        self.acceleration += alpha * ((velocity - self.velocity) / dt - self.acceleration)
+        self.velocity = velocity
+        self.position = position
+        self.time = now
+        self.brickpi.EncoderVelocity[self.port] = velocity
+        self.brickpi.EncoderAcceleration[self.port] = self.acceleration
+        return dt
+
+
+#######################
+# Position control
+#######################
+# BrickPiRotate and BrickPiRotateTo start a move and return a BrickPiMove
+# handle straight away.  The move is run by one PID controller per motor,
+# which is stepped every time a reply with that motor's encoder is decoded,
+# so its sample rate is the update rate.  All motors of a move follow a
+# straight line setpoint from their start to their target over the same
+# time, so they finish together.  A move is done once every motor has been
+# within the tolerance of its target for settle_time seconds.
+# Positions are in degrees; the encoders count half degrees.
+
+POSITION_KP = 2.0       # power per half degree of error
+POSITION_KI = 4.0       # power per half degree second
+POSITION_KD = 0.02      # power per half degree per second
+
+
+class BrickPiMove:
     """
+    Handle on a move started by BrickPiRotate or BrickPiRotateTo
 
-    num_motor=len(power)    #Number of motors being used
-    init_val=[0]*num_motor
-    final_val=[0]*num_motor
-    BrickPiUpdateValues()
-    for i in range(num_motor):
-        BrickPi.MotorEnable[port[i]] = 1        #Enable the Motors
-        power[i]=abs(power[i])
-        # Updated for compatibility with Python3
-        # BrickPi.MotorSpeed[port[i]] = power[i] if deg[i]>0 else -power[i]  #For running clockwise and anticlockwise
-        # init_val[i]=BrickPi.Encoder[port[i]]        #Initial reading of the encoder
-        #For running clockwise and anticlockwise
-        if deg[i]>0:
-           BrickPi.MotorSpeed[port[i]] = power[i]
-        elif deg[i]<0:
-           BrickPi.MotorSpeed[port[i]] = -power[i]
+    status is "moving" until the move ends as "done", "stalled" (timed out
+    before settling) or "cancelled".  The move stalls at deadline (on the
+    monotonic clock) even if no update reaches its controllers any more.
+    """
+    def __init__(self, brickpi, ports, deadline):
+        self.brickpi = brickpi
+        self.ports = list(ports)
+        self.deadline = deadline
+        self.status = "moving"
+        self._moving = set(self.ports)
+        self._callbacks = []
+        self._condition = threading.Condition()
+
+    def done(self):
+        if self.status == "moving" and monotonic() > self.deadline:
+            self._finish("stalled")     # the updates stopped reaching the controllers
+        return self.status != "moving"
+
+    def wait(self, timeout=None):
+        """
+        Block until the move ends. Returns False if it is still moving after timeout seconds
+        """
+        ended = WaitUntil(self._condition, lambda: self.status != "moving" or monotonic() > self.deadline,
+                          timeout, self.deadline)
+        return ended and self.done()
+
+    def result(self, timeout=None):
+        """
+        Wait for the move and return the positions (in degrees) the motors ended at
+        """
+        self.wait(timeout)
+        return [self.brickpi.Encoder[port] / 2.0 for port in self.ports]
+
+    def add_done_callback(self, callback):
+        """
+        Call callback(move) once the move ends (right away if it has). Runs on the updating thread
+        """
+        with self._condition:
+            if self.status == "moving":
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def cancel(self):
+        """
+        Stop the motors of the move where they are
+        """
+        self._finish("cancelled")
+
+    def _settled(self, port):
+        self._moving.discard(port)
+        if not self._moving:
+            self._finish("done")
+
+    def _finish(self, status):
+        brickpi = self.brickpi
+        with self._condition:
+            if self.status != "moving":
+                return
+            self.status = status
+            for port in self.ports:
+                controller = brickpi.PositionControl[port]
+                if controller is not None and controller.move is self:
+                    brickpi.PositionControl[port] = None
+                    brickpi.MotorSpeed[port] = 0
+            self._condition.notify_all()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                log.exception("BrickPi move callback raised an exception")
+
+
+class BrickPiPositionController:
+    """
+    PID controller moving the motor on port from start to target (in encoder counts) in duration seconds
+    """
+    def __init__(self, move, port, start, target, duration, max_power,
+                 tolerance, settle_time, timeout, kp, ki, kd):
+        self.brickpi = move.brickpi
+        self.move = move
+        self.port = port
+        self.start = start
+        self.target = target
+        self.duration = duration
+        self.max_power = max_power
+        self.tolerance = tolerance
+        self.settle_time = settle_time
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.started = monotonic()
+        self.end = self.started + duration
+        self.deadline = self.end + timeout
+        self.settled_since = None
+        self.integral = 0.0
+        self.last_error = None
+        self.last_time = None
+
+    def step(self, now):
+        position = self.brickpi.Encoder[self.port]
+        if now >= self.end:
+            setpoint = self.target
+            feedforward = 0.0
         else:
-           BrickPi.MotorSpeed[port[i]] = 0
-           init_val[i]=BrickPi.Encoder[port[i]]        #Initial reading of the encoder     
-        final_val[i]=init_val[i]+(deg[i]*2)        #Final value when the motor has to be stopped;One encoder value counts for 0.5 degrees
-    run_stat=[0]*num_motor
-    while True:
-        result = BrickPiUpdateValues()          #Ask BrickPi to update values for sensors/motors
-        if not result :
-            for i in range(num_motor):        #Do for each of the motors
-                if run_stat[i]==1:
-                    continue
-                # Check if final value reached for each of the motors
-                if(deg[i]>0 and final_val[i]>init_val[i]) or (deg[i]<0 and final_val[i]<init_val[i]) :
-                    # Read the encoder degrees
-                    init_val[i]=BrickPi.Encoder[port[i]]
-                else:
-                    run_stat[i]=1
-                    
-                    # Updated for compatibility with Python3
-                    # BrickPi.MotorSpeed[port[i]]=-power[i] if deg[i]>0 else power[i]  #Run the motors in reverse direction to stop instantly
-                    
-                    if deg[i]>0:
-                        BrickPi.MotorSpeed[port[i]] = -power[i]
-                    elif deg[i]<0:
-                        BrickPi.MotorSpeed[port[i]] = power[i]
-                    else:
-                        BrickPi.MotorSpeed[port[i]] = 0            
-                    BrickPiUpdateValues()
-                    time.sleep(delay_when_stopping)
-                    BrickPi.MotorEnable[port[i]] = 0
-                    BrickPiUpdateValues()
-        time.sleep(sampling_time)          #sleep for the sampling time given (default:100 ms)
-        if(all(e==1 for e in run_stat)):        #If all the motors have already completed their rotation, then stop
-          break
-    return 0
+            setpoint = self.start + (self.target - self.start) * (now - self.started) / self.duration
+            # the power the planned speed should take, PID only has to correct for the difference
+            feedforward = (self.target - self.start) / self.duration * 255 / (2.0 * MOTOR_MAX_SPEED)
+        error = setpoint - position
+
+        if now >= self.end and abs(self.target - position) <= self.tolerance:
+            if self.settled_since is None:
+                self.settled_since = now
+            if now - self.settled_since >= self.settle_time:
+                self.move._settled(self.port)
+                return
+        else:
+            self.settled_since = None
+        if now > self.deadline:
+            self.move._finish("stalled")
+            return
+
+        derivative = 0.0
+        integral = self.integral
+        if self.last_time is not None and now > self.last_time:
+            dt = now - self.last_time
+            integral += error * dt
+            derivative = (error - self.last_error) / dt
+        self.last_error = error
+        self.last_time = now
+
+        power = feedforward + self.kp * error + self.ki * integral + self.kd * derivative
+        if abs(power) < self.max_power:
+            self.integral = integral    # stop integrating while the output is saturated
+        self.brickpi.MotorSpeed[self.port] = int(max(-self.max_power, min(self.max_power, power)))
+        self.brickpi.MotorEnable[self.port] = 1
 
-def GetBits( byte_offset, bit_offset, bits):
-    global Bit_Offset
-    result = 0
-    i = bits
-    while i:
-        result *= 2
-        
-        if p_version==2:
-            result |= ((Array[(byte_offset + ((bit_offset + Bit_Offset + (i-1)) / 8))] >> ((bit_offset + Bit_Offset + (i-1)) % 8)) & 0x01)
+
+#######################
+# Protocol statistics
+#######################
+# Every BrickPiDevice counts, per chip, the messages it sends, the replies
+# that come back (or don't) and the time between the two.  The counters are
+# plain integers updated by the thread doing the exchange; ProtocolStats()
+# copies them into a dict, so reading them never gets in the way of an update.
+# The error codes are the ones BrickPiRx returns, see the top of this file.
+
+RX_ERRORS = (-1, -2, -4, -5, -6)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.02, 0.05)  # upper bounds in seconds
+
+
+class BrickPiChipStats:
+    """
+    Protocol counters and reply latency histogram of one chip
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0   # messages sent
+        self.retries = 0
+        self.failures = 0       # updates given up after the retries
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.errors = dict((code, 0) for code in RX_ERRORS)
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)     # the last bucket is everything slower
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.sent = None        # monotonic() time of the last message
+
+    def record_reply(self, result, now):
+        if result:
+            self.errors[result] += 1
+            return
+        latency = now - self.sent
+        self.latency[bisect_right(LATENCY_BUCKETS, latency)] += 1
+        self.latency_sum += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+
+    def snapshot(self):
+        latency = list(self.latency)
+        return {
+            "transactions": self.transactions,
+            "retries": self.retries,
+            "failures": self.failures,
+            "timeouts": self.errors[-2],
+            "errors": dict(self.errors),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "latency": {
+                "buckets": list(zip(LATENCY_BUCKETS + (float('inf'),), latency)),
+                "count": sum(latency),
+                "sum": self.latency_sum,
+                "max": self.latency_max,
+            },
+        }
+
+
+#######################
+# Frame capture
+#######################
+# Once BrickPiEnableCapture() has been called, every frame sent to or received
+# from the BrickPi is appended to a binary trace file.  Recording a frame only
+# copies it into a memory buffer; a background thread writes the buffer out
+# every flush_interval seconds, so the update loop never waits for the disk.
+# If the disk can't keep up, frames are dropped (and counted) rather than
+# letting the buffer grow without bound.  When the file grows past max_bytes
+# it is renamed to name.1 (name.1 to name.2 and so on, up to backups files)
+# and a new one is started.  A trace already at name when the capture starts,
+# say from before a crash, is kept the same way rather than overwritten (or
+# appended to, with no backups).
+#
+# Every file starts with the last MSG_TYPE_SENSOR_TYPE message sent to each
+# chip, recorded as sent when the file was opened, so each one can be decoded
+# on its own: after a rotation, or when the capture was enabled after
+# BrickPiSetupSensors().
+#
+# A trace file starts with TRACE_MAGIC and the time.time() and monotonic()
+# times it was opened at (two little endian doubles), followed by records:
+# a TRACE_RECORD header (monotonic timestamp, TRACE_TX or TRACE_RX, chip
+# address, result code, frame length) and the frame itself.  A sent frame is
+# [dest, checksum, length, message], a received one [checksum, length,
+# message], cut short if the reply was.  The result of a received frame is the
+# BrickPiRx result code.
+
+TRACE_MAGIC = b"BPTRACE1"
+TRACE_START = struct.Struct('<dd')
+TRACE_RECORD = struct.Struct('<dBBbH')
+TRACE_TX = 0
+TRACE_RX = 1
+
+
+class BrickPiCapture:
+    """
+    Buffered, rotating writer of a frame trace file
+
+    setup maps chip addresses to the sent frame of the MSG_TYPE_SENSOR_TYPE
+    message they were last set up with; the ones recorded are added to it.
+    """
+    def __init__(self, path, max_bytes=16*1024*1024, backups=3, flush_interval=0.5, max_buffer=4*1024*1024,
+                 setup=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.frames = 0     # frames recorded
+        self.dropped = 0    # frames dropped because the buffer was full or the file couldn't be written
+        self.rotations = 0
+        self.setup = dict(setup or {})
+        self._buffer = bytearray()
+        self._buffer_setup = dict(self.setup)   # setup as of the first frame in the buffer, for a file opened before it
+        self._buffer_frames = 0
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()     # one flush at a time, from the thread or a caller
+        self._stopping = False
+        self._file = None
+        self._size = 0
+        self._header_size = 0
+        if backups > 0 and os.path.exists(path) and os.path.getsize(path) > 0:
+            self._shift()
+        self._open(self._buffer_setup)
+        self._thread = threading.Thread(target=self._run, name="BrickPiCapture")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, timestamp, kind, address, result, frame):
+        """
+        Add one frame to the buffer. Never blocks on the disk
+        """
+        with self._condition:
+            if kind == TRACE_TX and len(frame) > 3 and frame[3] == MSG_TYPE_SENSOR_TYPE:
+                self.setup[address] = frame
+            if len(self._buffer) + TRACE_RECORD.size + len(frame) > self.max_buffer:
+                self.dropped += 1
+                return
+            self._buffer += TRACE_RECORD.pack(timestamp, kind, address, result, len(frame))
+            self._buffer += frame
+            self._buffer_frames += 1
+            self.frames += 1
+
+    def flush(self):
+        """
+        Write the buffered frames to the file now
+        """
+        with self._write_lock:
+            with self._condition:
+                data, self._buffer = self._buffer, bytearray()
+                frames, self._buffer_frames = self._buffer_frames, 0
+                setup, self._buffer_setup = self._buffer_setup, dict(self.setup)
+            if not data:
+                return
+            try:
+                if self._size + len(data) > self.max_bytes and self._size > self._header_size:
+                    self._rotate(setup)
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data)
+            except (IOError, OSError, ValueError):
+                self.dropped += frames
+                log.exception("BrickPi capture couldn't write to %s", self.path)
+
+    def close(self):
+        """
+        Write what is left in the buffer and close the file
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+        with self._write_lock:
+            self._file.close()
+
+    def _open(self, setup):
+        self._file = open(self.path, 'ab')
+        self._size = os.fstat(self._file.fileno()).st_size
+        now = monotonic()
+        header = bytearray()
+        if self._size == 0:
+            header += TRACE_MAGIC + TRACE_START.pack(time.time(), now)
+        for address, frame in sorted(setup.items()):
+            header += TRACE_RECORD.pack(now, TRACE_TX, address, 0, len(frame))
+            header += frame
+        self._file.write(header)
+        self._size += len(header)
+        self._header_size = self._size
+
+    def _shift(self):
+        if self.backups > 0:
+            for n in range(self.backups - 1, 0, -1):
+                older = "{}.{}".format(self.path, n)
+                if os.path.exists(older):
+                    os.rename(older, "{}.{}".format(self.path, n + 1))
+            os.rename(self.path, self.path + ".1")
         else:
-            result |= ((Array[int((byte_offset + ((bit_offset + Bit_Offset + (i-1)) / 8)))] >> ((bit_offset + Bit_Offset + (i-1)) % 8)) & 0x01)
-        i -= 1
-    Bit_Offset += bits
-    return result
+            os.remove(self.path)
 
+    def _rotate(self, setup):
+        self._file.close()
+        self._shift()
+        self.rotations += 1
+        self._open(setup)
 
-def BitsNeeded(value):
-    for i in range(32):
-        if not value:
-            return i
-        value /= 2
-    return 31
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopping:
+                    self._condition.wait(self.flush_interval)
+                if self._stopping:
+                    return
+            self.flush()
 
 
-def AddBits(byte_offset, bit_offset, bits, value):
-    global Bit_Offset
-    for i in range(bits):
+def BrickPiReadTrace(path):
+    """
+    Read a trace file written by BrickPiEnableCapture()
+
+    Yields (timestamp, kind, address, result, frame) for each record, kind
+    being TRACE_TX or TRACE_RX. A record cut short at the end of the file
+    (the capture was still running) is left out.
+    """
+    with open(path, 'rb') as trace:
+        if trace.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError("{} is not a BrickPi trace file".format(path))
+        trace.read(TRACE_START.size)
+        while True:
+            header = trace.read(TRACE_RECORD.size)
+            if len(header) < TRACE_RECORD.size:
+                return
+            timestamp, kind, address, result, length = TRACE_RECORD.unpack(header)
+            frame = bytearray(trace.read(length))
+            if len(frame) < length:
+                return
+            yield timestamp, kind, address, result, frame
+
+
+#######################
+# I2C transactions
+#######################
+# Instead of changing SensorI2COut and SensorI2CRead and calling
+# BrickPiSetupSensors() before every register read, a program can queue I2C
+# transactions on a port with BrickPiI2CTransfer, BrickPiI2CRead and
+# BrickPiI2CWrite.  Each returns a BrickPiI2CTransaction handle straight away.
+#
+# The port has to be set up once as TYPE_SENSOR_I2C (or _9V) with device
+# slots for the address, without BIT_I2C_SAME: the bytes to write and the
+# number to read of such a slot are sent with every update (BrickPiSetupI2C
+# does this).  Giving an address several of the 8 slots of a port lets one
+# update carry several transactions to it.
+#
+# Each update takes queued transactions into free slots for their address,
+# in the order they were queued, until the slots or I2C_UPDATE_BYTES run
+# out.  The firmware runs the slots of a port in order, so transactions to
+# the same device still happen in the order they were queued.  The success
+# bit of each slot in BrickPi.Sensor[port] and its bytes in SensorI2CIn are
+# then handed back to the transaction's handle.  A slot that has no
+# transaction writes and reads nothing.
+
+I2C_MAX_BYTES = 15      # the most bytes a slot can write or read in one update (4 bit counts)
+I2C_UPDATE_BYTES = 64   # bytes on the I2C buses of a chip per update, at full bus speed about 6 ms of the 7.5 ms its reply may take
+
+
+class BrickPiI2CTransaction:
+    """
+    Handle on an I2C transaction queued by BrickPiI2CTransfer, BrickPiI2CRead or BrickPiI2CWrite
+
+    status is "queued", then "sent" once an update carries it, and ends as
+    "done", "failed" (no acknowledge, or the update failed) or "cancelled".
+    """
+    def __init__(self, port, address, out, read):
+        self.port = port
+        self.address = address
+        self.out = bytearray(out)
+        self.read = read
+        self.data = None
+        self.status = "queued"
+        self._callbacks = []
+        self._condition = threading.Condition()
+
+    def done(self):
+        return self.status not in ("queued", "sent")
+
+    def wait(self, timeout=None):
+        """
+        Block until the transaction ends. Returns False if it still hasn't after timeout seconds
+        """
+        return WaitUntil(self._condition, self.done, timeout)
+
+    def result(self, timeout=None):
+        """
+        Wait for the transaction and return the bytes read, as a bytearray, or None if it didn't succeed
+        """
+        self.wait(timeout)
+        return self.data if self.status == "done" else None
+
+    def add_done_callback(self, callback):
+        """
+        Call callback(transaction) once the transaction ends (right away if it has). Runs on the updating thread
+        """
+        with self._condition:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def cancel(self):
+        """
+        Take the transaction off the queue. Returns False if an update has already sent it
+        """
+        return self._finish("cancelled", only_queued=True)
+
+    def _send(self):
+        with self._condition:
+            if self.status != "queued":
+                return False
+            self.status = "sent"
+            return True
+
+    def _finish(self, status, data=None, only_queued=False):
+        with self._condition:
+            if self.done() or (only_queued and self.status != "queued"):
+                return False
+            self.data = data
+            self.status = status
+            self._condition.notify_all()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                log.exception("BrickPi I2C callback raised an exception")
+        return True
+
+
+#######################
+# BrickPi device
+#######################
+
+class BrickPiDevice(BrickPiStruct):
+    """
+    One BrickPi board on one serial port
+
+    Holds the motor and sensor values (see BrickPiStruct) along with
+    everything needed to talk to the board: its serial port, frame buffers,
+    bit packing and decoding state, history, event subscriptions and motor
+    controllers.  Nothing is shared between devices, so several boards can be
+    driven from one program, each from its own BrickPiUpdateThread.
+
+    The methods are named after the BrickPi* functions, without the prefix.
+    Those functions work on the default device, BrickPi.
+
+    Usage:
+      second = BrickPiDevice('/dev/ttyUSB0')
+      second.Setup()
+      second.SensorType[PORT_1] = TYPE_SENSOR_TOUCH
+      second.SetupSensors()
+      BrickPiUpdateThread(rate=50, brickpi=second).start()
+    """
+    def __init__(self, port='/dev/ttyAMA0'):
+        BrickPiStruct.__init__(self)
+        self.Port = port
+        self.ser = None     # the serial port is only created by Setup() or UseTransport()
+
+        # Frame buffers are allocated once and reused for every message.
+        # Array holds the outgoing message, Tx_Buffer the complete outgoing frame
+        # (destination, checksum, length, message) and Rx_Buffer the last received message.
+        # UpdateValues encodes both chips' messages up front, into Values_Array.
+        self.Array = bytearray(256)
+        self.Tx_Buffer = bytearray(259)
+        self.Rx_Header = bytearray(2)
+        self.Rx_Buffer = bytearray(256)
+        self.Values_Array = [bytearray(256), bytearray(256)]     # MSG_TYPE_VALUES messages, one per chip
+        self.Tx_Bytes = [0, 0]          # length of each chip's message in Values_Array
+        self.Temp_BitsUsed = [0, 0]     # encoder widths of the reply being decoded
+        self.BytesReceived = None
+        self.Bit_Offset = 0
+        self.Bit_Buffer = 0
+        self.Retried = 0
+        self.UpdateCycle = 0     # number of UpdateValues() calls, tags the samples in History
+
+        self.DecodePlan = [None, None]
+        self.CompileDecodePlan(0)
+        self.CompileDecodePlan(1)
+
+        self.History = None
+        self.Subscriptions = [[] for port in range(4)]  # replaced, never modified in place, so updates can iterate without a lock
+        self.Subscriptions_Lock = threading.Lock()
+        self.MotorEstimators = [BrickPiEncoderEstimator(self, port) for port in range(4)]
+        self.PositionControl = [None] * 4    # the BrickPiPositionController running on each motor
+        self.Stats = [BrickPiChipStats(), BrickPiChipStats()]
+        self.PendingStats = None    # the stats of the chip the last message went to, until its reply is in
+        self.PendingDest = 0        # the address the last message went to
+        self.Received = 0           # bytes of its reply read so far
+        self.Capture = None
+        self.SensorConfig = [None, None]    # (SensorConfigOf, MSG_TYPE_SENSOR_TYPE message) last applied to each chip
+        self.I2CQueue = [deque() for port in range(4)]      # BrickPiI2CTransactions waiting for an update
+        self.I2CSlots = [[None] * 8 for port in range(4)]   # the transaction in each device slot of the update
+        self.I2CSent = [0, 0]       # transactions in the update of each chip
+
+    #######################
+    # Serial port
+    #######################
+
+    def UseTransport(self, transport):
+        """
+        Talk to the BrickPi through transport instead of /dev/ttyAMA0
+
+        transport is either the name of a serial device (for example the pseudo
+        terminal of a BrickPiEmulator) or an object with the pyserial interface:
+        open(), isOpen(), write(), read(), inWaiting(), flushInput() and fileno().
+        A serial port opened elsewhere should have its timeout set to 0.
+
+        Call before Setup()
+        """
+        if isinstance(transport, str):
+            transport = SerialPort(transport)
+        self.ser = transport
+        self.SensorConfig = [None, None]    # it may lead to another BrickPi
+
+    def Setup(self):
+        """
+        Open Serial port for communication
+
+        Returns either 0 upon completion or -1
+        -1 could either mean
+        a) port is already open
+        b) port cannot be opened
+        c) the IR receiver is enabled, see BrickPiPreflight
+        """
+
+        debugprint("BrickPiSetup")
+        if self.ser is None:
+            self.ser = SerialPort(self.Port)
+        if self.ser.isOpen():
+            return -1
+        if BrickPiPreflight():
+            return -1
+        self.ser.open()
+        if not self.ser.isOpen():
+            return -1
+        self.SensorConfig = [None, None]
+        return 0
+
+    def Tx(self, dest, ByteCount, OutArray):
+        """
+        Transmits a message on the serial comms
+
+        The frame is assembled in the reusable Tx_Buffer and written in one go.
+
+        Inputs:
+        ByteCount *must* be castable to an int; code will fail otherwise
+        """
+        ser = self.ser
+        Tx_Buffer = self.Tx_Buffer
+        if ser.inWaiting():
+            ser.flushInput()    # drop what is left of a late reply so it isn't taken for this one
+        ByteCount = int(ByteCount)
+        Tx_Buffer[0] = dest
+        Tx_Buffer[1] = (dest + ByteCount + sum(islice(OutArray, ByteCount))) % 256
+        Tx_Buffer[2] = ByteCount
+        Tx_Buffer[3:ByteCount + 3] = memoryview(OutArray)[:ByteCount]
+        ser.write(memoryview(Tx_Buffer)[:ByteCount + 3])
+
+        now = monotonic()
+        stats = None
+        if dest in self.Address:
+            stats = self.Stats[self.Address.index(dest)]
+            stats.transactions += 1
+            stats.bytes_sent += ByteCount + 3
+            stats.sent = now
+        self.PendingStats = stats
+        self.PendingDest = dest
+        self.Received = 0
+        if self.Capture is not None:
+            self.Capture.record(now, TRACE_TX, dest, 0, Tx_Buffer[:ByteCount + 3])
+
+    def RxWait(self, deadline):
+        """
+        Block until the serial port has data to read or deadline (monotonic()) passes
+
+        Returns True if data is waiting
+        """
+        ser = self.ser
+        while ser.inWaiting() <= 0:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            select.select([ser.fileno()], [], [], remaining)
+        return True
+
+    def RxRead(self, InArray, ByteCount, deadline):
+        """
+        Read exactly ByteCount bytes into the start of InArray, unless deadline passes first
+
+        Returns the number of bytes read
+        """
+        count = 0
+        while count < ByteCount and self.RxWait(deadline):
+            data = self.ser.read(min(self.ser.inWaiting(), ByteCount - count))
+            InArray[count:count + len(data)] = data
+            count += len(data)
+        self.CountReceived(count)
+        return count
+
+    def CountReceived(self, count):
+        """
+        Count count more bytes of the reply to the last message
+        """
+        self.Received += count
+        if self.PendingStats is not None:
+            self.PendingStats.bytes_received += count
+
+    def Rx(self, timeout):
+        """
+        Receives a message from the serial comms
+
+        Waits (without spinning) for the two header bytes (checksum, length), then
+        reads exactly the number of bytes given by the length byte. The whole frame
+        has to arrive within timeout seconds.
+
+        The header is kept in Rx_Header and the message itself in the reusable
+        Rx_Buffer, which is returned as InArray. Its contents are only valid until
+        the next call.
+
+        Returns (result, BytesReceived, InArray)
+        """
+        deadline = monotonic() + timeout
+
+        if self.ser is None or not self.ser.isOpen():
+            return self.RecordReply((-1, 0 , []))
+
+        try:
+            RxBytes = self.RxRead(self.Rx_Header, 2, deadline)
+            if RxBytes == 0 :
+                return self.RecordReply((-2, 0 , []))
+            if RxBytes < 2 :
+                return self.RecordReply((-4, 0 , []))
+            InBytes = self.RxRead(self.Rx_Buffer, self.Rx_Header[1], deadline)
+        except:
+            # print ("Unexpected error: ", sys.exc_info()[0])
+            return self.RecordReply((-1, 0 , []))
+
+        return self.RecordReply(self.RxCheck(InBytes))
+
+    def RecordReply(self, reply):
+        """
+        Count the reply (result, BytesReceived, InArray) to the last message in
+        Stats, and add the frame in Rx_Header and Rx_Buffer to the capture
+
+        Returns reply
+        """
+        now = monotonic()
+        stats = self.PendingStats
+        if stats is not None:
+            self.PendingStats = None
+            stats.record_reply(reply[0], now)
+        if self.Capture is not None:
+            received = self.Received
+            self.Capture.record(now, TRACE_RX, self.PendingDest, reply[0],
+                                self.Rx_Header[:min(received, 2)] + self.Rx_Buffer[:max(received - 2, 0)])
+        self.Received = 0
+        return reply
+
+    def ProtocolStats(self):
+        """
+        Returns a snapshot of the protocol counters: the number of updates and,
+        for each chip, the messages sent, retries, failed updates, the count of
+        each BrickPiRx error code (timeouts are -2), the bytes sent and received
+        and a histogram of the time between sending a message and its reply
+
+        Usage:
+          stats = BrickPi.ProtocolStats()
+          print(stats["chips"][0]["errors"][-5])   # checksum errors on chip 1
+        """
+        return {
+            "updates": self.UpdateCycle,
+            "chips": [stats.snapshot() for stats in self.Stats],
+        }
+
+    def ResetProtocolStats(self):
+        for stats in self.Stats:
+            stats.reset()
+
+    def RxCheck(self, InBytes):
+        """
+        Check the InBytes long message in Rx_Buffer against the header in Rx_Header
+
+        Returns (result, BytesReceived, InArray) like Rx
+        """
+        if InBytes < self.Rx_Header[1] :
+            return -6, 0 , []
+
+        CheckSum = self.Rx_Header[1] + sum(islice(self.Rx_Buffer, InBytes))
+        if (CheckSum % 256) != self.Rx_Header[0] : #Checksum equals sum(InArray)+len(InArray)
+            return -5, 0 , []
+
+        return 0, InBytes, self.Rx_Buffer
+
+    #######################
+    # Bit packing
+    #######################
+
+    def BitsReset(self):
+        self.Bit_Offset = 0
+        self.Bit_Buffer = 0
+
+    def BitsLoad(self, InArray, byte_count):
+        """
+        Load the first byte_count bytes of InArray into Bit_Buffer so GetBits can read them
+        """
         if p_version==2:
-            if(value & 0x01):
-                Array[(byte_offset + ((bit_offset + Bit_Offset + i)/ 8))] |= (0x01 << ((bit_offset + Bit_Offset + i) % 8));
+            value = 0
+            for i in range(byte_count - 1, -1, -1):
+                value = (value << 8) | InArray[i]
         else:
-            if(int(value) & 0x01):
-                # Python3 Change: Cast to integer type right after "Array["
-                Array[int((byte_offset + ((bit_offset + Bit_Offset + i)/ 8)))] |= (0x01 << ((bit_offset + Bit_Offset + i) % 8));
-        value /=2
-    Bit_Offset += bits
-
-
-def BrickPiSetupSensors():
-    global Array
-    global Bit_Offset
-    global BytesReceived
-    Bit_Offset = 0
-    Array = [0] * 256
-    debugprint("BrickPiSetupSensors")
-    result=[0]*2
-    for i in range(2): # for each chip
-      result[i] = BrickPiSetupSensorsOneChip(i)
-
-    if result[0] == 0 and result[1] == 0:
-      return 0
-    else:
-      return -1
-
-def BrickPiSetupSensorsOneChip(i):
-    global Array
-    global Bit_Offset
-    global BytesReceived
-    Array[BYTE_MSG_TYPE] = MSG_TYPE_SENSOR_TYPE
-    Array[BYTE_SENSOR_1_TYPE] = BrickPi.SensorType[PORT_1 + i*2 ]
-    Array[BYTE_SENSOR_2_TYPE] = BrickPi.SensorType[PORT_2 + i*2 ]
-    for ii in range(2):
-        port = i*2 + ii
-        print("Now handling {}".format(port))
-        #Jan's US fix###########
-        if(Array[BYTE_SENSOR_1_TYPE + ii] == TYPE_SENSOR_ULTRASONIC_CONT):
-            Array[BYTE_SENSOR_1_TYPE + ii] = TYPE_SENSOR_I2C
-            BrickPi.SensorI2CSpeed[port] = US_I2C_SPEED
-            BrickPi.SensorI2CAddr[port][US_I2C_IDX] = LEGO_US_I2C_ADDR
-            BrickPi.SensorI2CWrite [port][US_I2C_IDX]    = 1
-            BrickPi.SensorI2CRead  [port][US_I2C_IDX]    = 1
-            BrickPi.SensorI2COut   [port][US_I2C_IDX][0] = LEGO_US_I2C_DATA_REG
-        ########################
-        if(Array[BYTE_SENSOR_1_TYPE + ii] == TYPE_SENSOR_I2C or Array[BYTE_SENSOR_1_TYPE + ii] == TYPE_SENSOR_I2C_9V ):
-            AddBits(3,0,8,BrickPi.SensorI2CSpeed[port])
-
-            if(BrickPi.SensorI2CDevices[port] > 8):
-                BrickPi.SensorI2CDevices[port] = 8
-
-            if(BrickPi.SensorI2CDevices[port] == 0):
-                BrickPi.SensorI2CDevices[port] = 1
-
-            AddBits(3,0,3, (BrickPi.SensorI2CDevices[port] - 1))
-
-            for device in range(BrickPi.SensorI2CDevices[port]):
-                AddBits(3,0,7, (BrickPi.SensorI2CAddr[port][device] >> 1))
-                AddBits(3,0,2, BrickPi.SensorSettings[port][device])
-                if(BrickPi.SensorSettings[port][device] & BIT_I2C_SAME):
-                    AddBits(3,0,4, BrickPi.SensorI2CWrite[port][device])
-                    AddBits(3,0,4, BrickPi.SensorI2CRead[port][device])
-
-                    for out_byte in range(BrickPi.SensorI2CWrite[port][device]):
-                        AddBits(3,0,8, BrickPi.SensorI2COut[port][device][out_byte])
-
-    tx_bytes = (((Bit_Offset + 7) / 8) + 3) #eq to UART_TX_BYTES
-    BrickPiTx(BrickPi.Address[i], tx_bytes , Array)
-    res, BytesReceived, InArray = BrickPiRx(5) # Timeout set to 5 seconds to setup EV3 sensors successfully
-    if res :
-        return -1
-    for i in range(len(InArray)):
-        Array[i]=InArray[i]
-    if not (BytesReceived ==1 and Array[BYTE_MSG_TYPE] == MSG_TYPE_SENSOR_TYPE) :
-        return -1
-    return 0
+            value = int.from_bytes(memoryview(InArray)[:byte_count], 'little')
+        self.Bit_Buffer = value
+        self.Bit_Offset = 0
+
+    def BitsFlush(self, byte_offset, OutArray=None):
+        """
+        Copy the fields added since the last BitsReset into OutArray (Array by default), starting at byte_offset
+
+        Returns the number of bytes used after byte_offset
+        """
+        if OutArray is None:
+            OutArray = self.Array
+        byte_count = (self.Bit_Offset + 7) // 8
+        value = self.Bit_Buffer >> (byte_offset * 8)
+        for i in range(byte_offset, byte_offset + byte_count):
+            OutArray[i] = value & 0xFF
+            value >>= 8
+        return byte_count
+
+    def GetBits(self, byte_offset, bit_offset, bits):
+        result = (self.Bit_Buffer >> ((byte_offset * 8) + bit_offset + self.Bit_Offset)) & ((1 << bits) - 1)
+        self.Bit_Offset += bits
+        return result
+
+    def AddBits(self, byte_offset, bit_offset, bits, value):
+        self.Bit_Buffer |= (int(value) & ((1 << bits) - 1)) << ((byte_offset * 8) + bit_offset + self.Bit_Offset)
+        self.Bit_Offset += bits
+
+    #######################
+    # Messages
+    #######################
+
+    def ChangeAddress(self, OldAddr, NewAddr):
+        Array = self.Array
+        Array[BYTE_MSG_TYPE] = MSG_TYPE_CHANGE_ADDR;
+        Array[BYTE_NEW_ADDRESS] = NewAddr;
+        self.Tx(OldAddr, 2, Array)
+        res, BytesReceived, InArray = self.Rx(0.005000)
+        if res :
+            return -1
+        if not (BytesReceived == 1 and InArray[BYTE_MSG_TYPE] == MSG_TYPE_CHANGE_ADDR):
+            return -1
+        return 0
+
+    def SetTimeout(self):
+        Array = self.Array
+        for i in range(2):
+            Array[BYTE_MSG_TYPE] = MSG_TYPE_TIMEOUT_SETTINGS
+            Array[BYTE_TIMEOUT] = self.Timeout&0xFF
+            Array[BYTE_TIMEOUT + 1] = (self.Timeout >> 8 ) & 0xFF
+            Array[BYTE_TIMEOUT + 2] = (self.Timeout >> 16) & 0xFF
+            Array[BYTE_TIMEOUT + 3] = (self.Timeout >> 24) & 0xFF
+            self.Tx(self.Address[i], 5, Array)
+            res, BytesReceived, InArray = self.Rx(0.002500)
+            if res :
+                return -1
+            if not (BytesReceived == 1 and InArray[BYTE_MSG_TYPE] == MSG_TYPE_TIMEOUT_SETTINGS):
+                return -1
+        return 0
 
+    def CompileDecodePlan(self, i):
+        """
+        Build DecodePlan[i] from the sensor types currently configured on chip i
+        """
+        self.DecodePlan[i] = [(port, SensorDecoder(self.SensorType[port])) for port in (i*2, i*2 + 1)]
 
-def BrickPiUpdateValues():
-    global Array
-    global Bit_Offset
-    global Retried
+    def SetupSensors(self, force=False):
+        """
+        Send both chips their sensor types and I2C settings
+
+        Only chips whose configuration differs from the last one they accepted
+        are sent a message; force sends it to both regardless.
 
-    ret = False
-    i = 0
-    while i < 2 :
-        if not ret:
-            Retried = 0
-        #Retry Communication from here, if failed
+        Returns 0 on success, -1 if a chip did not accept its configuration
+        """
+        result=[0]*2
+        for i in range(2): # for each chip
+          result[i] = self.SetupSensorsOneChip(i, force)
 
-        Array = [0] * 256
-        Array[BYTE_MSG_TYPE] = MSG_TYPE_VALUES
-        Bit_Offset = 0
+        if result[0] == 0 and result[1] == 0:
+          return 0
+        else:
+          return -1
+
+    def SetupSensorsOneChip(self, i, force=False):
+        config = self.SendSensorSetup(i, force)
+        if config is None:
+            return 0
+        res, self.BytesReceived, InArray = self.Rx(5) # Timeout set to 5 seconds to setup EV3 sensors successfully
+        return self.SensorSetupDone(i, config, res, self.BytesReceived, InArray)
+
+    def SendSensorSetup(self, i, force=False):
+        """
+        Send chip i its MSG_TYPE_SENSOR_TYPE message, unless it already has that configuration and force isn't set
+
+        Returns the configuration sent, for SensorSetupDone, or None if nothing was sent
+        """
+        applied = self.SensorConfig[i]
+        if applied is not None and applied[0] == self.SensorConfigOf(i) and not force:
+            return None
+        debugprint("BrickPiSetupSensors")
+        self.SensorConfig[i] = None
+        tx_bytes = self.EncodeSensorTypes(i)
+        self.Tx(self.Address[i], tx_bytes , self.Array)
+        # taken after encoding, which fills in the I2C setup of an ultrasonic sensor
+        return (self.SensorConfigOf(i), bytes(self.Array[:tx_bytes]))
+
+    def SensorSetupDone(self, i, config, result, BytesReceived, InArray):
+        """
+        Check the reply of chip i to SendSensorSetup. Returns 0 if the chip took config, -1 if not
+        """
+        if result or not (BytesReceived == 1 and InArray[BYTE_MSG_TYPE] == MSG_TYPE_SENSOR_TYPE):
+            return -1
+        self.SensorConfig[i] = config
+        return 0
+
+    def SensorConfigOf(self, i):
+        """
+        The configuration of chip i: its address and every setting EncodeSensorTypes puts in its message
+
+        Comparing it tells whether the chip needs a new message without encoding one.
+        """
+        config = [self.Address[i]]
+        for port in (i*2, i*2 + 1):
+            sensor_type = self.SensorType[port]
+            config.append(sensor_type)
+            if sensor_type in (TYPE_SENSOR_I2C, TYPE_SENSOR_I2C_9V, TYPE_SENSOR_ULTRASONIC_CONT):
+                devices = self.SensorI2CDevices[port]
+                config.append(self.SensorI2CSpeed[port])
+                config.append(devices)
+                for device in range(min(devices or 1, 8)):
+                    settings = self.SensorSettings[port][device]
+                    config.append(self.SensorI2CAddr[port][device])
+                    config.append(settings)
+                    if settings is not None and settings & BIT_I2C_SAME:
+                        write = self.SensorI2CWrite[port][device]
+                        config.append(write)
+                        config.append(self.SensorI2CRead[port][device])
+                        config.extend(self.SensorI2COut[port][device][:write])
+        return tuple(config)
+
+    def EncodeSensorTypes(self, i):
+        """
+        Encode the MSG_TYPE_SENSOR_TYPE message for chip i into Array
+
+        Returns the number of bytes in the message
+        """
+        Array = self.Array
+        AddBits = self.AddBits
+        Array[BYTE_MSG_TYPE] = MSG_TYPE_SENSOR_TYPE
+        Array[BYTE_SENSOR_1_TYPE] = self.SensorType[PORT_1 + i*2 ]
+        Array[BYTE_SENSOR_2_TYPE] = self.SensorType[PORT_2 + i*2 ]
+        self.CompileDecodePlan(i)
+        self.BitsReset()
+        for ii in range(2):
+            port = i*2 + ii
+            if 'DEBUG' in globals():
+                if DEBUG == 1:
+                    print("Now handling {}".format(port))
+            #Jan's US fix###########
+            if(Array[BYTE_SENSOR_1_TYPE + ii] == TYPE_SENSOR_ULTRASONIC_CONT):
+                Array[BYTE_SENSOR_1_TYPE + ii] = TYPE_SENSOR_I2C
+                self.SensorI2CSpeed[port] = US_I2C_SPEED
+                self.SensorI2CAddr[port][US_I2C_IDX] = LEGO_US_I2C_ADDR
+                self.SensorI2CWrite [port][US_I2C_IDX]    = 1
+                self.SensorI2CRead  [port][US_I2C_IDX]    = 1
+                self.SensorI2COut   [port][US_I2C_IDX][0] = LEGO_US_I2C_DATA_REG
+            ########################
+            if(Array[BYTE_SENSOR_1_TYPE + ii] == TYPE_SENSOR_I2C or Array[BYTE_SENSOR_1_TYPE + ii] == TYPE_SENSOR_I2C_9V ):
+                AddBits(3,0,8,self.SensorI2CSpeed[port])
+
+                if(self.SensorI2CDevices[port] > 8):
+                    self.SensorI2CDevices[port] = 8
+
+                if(self.SensorI2CDevices[port] == 0):
+                    self.SensorI2CDevices[port] = 1
+
+                AddBits(3,0,3, (self.SensorI2CDevices[port] - 1))
+
+                for device in range(self.SensorI2CDevices[port]):
+                    AddBits(3,0,7, (self.SensorI2CAddr[port][device] >> 1))
+                    AddBits(3,0,2, self.SensorSettings[port][device])
+                    if(self.SensorSettings[port][device] & BIT_I2C_SAME):
+                        AddBits(3,0,4, self.SensorI2CWrite[port][device])
+                        AddBits(3,0,4, self.SensorI2CRead[port][device])
+
+                        for out_byte in range(self.SensorI2CWrite[port][device]):
+                            AddBits(3,0,8, self.SensorI2COut[port][device][out_byte])
+
+        return self.BitsFlush(3) + 3 #eq to UART_TX_BYTES
+
+    def EncodeValues(self, i, OutArray):
+        """
+        Encode the MSG_TYPE_VALUES message for chip i into OutArray
+
+        Returns the number of bytes in the message
+        """
+        AddBits = self.AddBits
+        OutArray[BYTE_MSG_TYPE] = MSG_TYPE_VALUES
+        self.BitsReset()
 
         for ii in range(2):
             port = (i * 2) + ii
-            if(BrickPi.EncoderOffset[port]):
-                Temp_Value = BrickPi.EncoderOffset[port]
+            if(self.EncoderOffset[port]):
+                Temp_Value = self.EncoderOffset[port]
                 AddBits(1,0,1,1)
                 Temp_ENC_DIR = 0
                 if Temp_Value < 0 :
@@ -537,14 +1694,14 @@ def BrickPiUpdateValues():
 
         for ii in range(2):
             port = (i *2) + ii
-            speed = BrickPi.MotorSpeed[port]
+            speed = self.MotorSpeed[port]
             direc = 0
             if speed<0 :
                 direc = 1
                 speed *= -1
             if speed>255:
                 speed = 255
-            AddBits(1,0,10,((((speed & 0xFF) << 2) | (direc << 1) | (BrickPi.MotorEnable[port] & 0x01)) & 0x3FF))
+            AddBits(1,0,10,((((speed & 0xFF) << 2) | (direc << 1) | (self.MotorEnable[port] & 0x01)) & 0x3FF))
 
 
         for ii in range(2):
@@ -552,240 +1709,959 @@ def BrickPiUpdateValues():
             #if(BrickPi.SensorType[port] == TYPE_SENSOR_I2C or BrickPi.SensorType[port] == TYPE_SENSOR_I2C_9V):
             #Jan's US Fix##########
             #old# if(BrickPi.SensorType[port] == TYPE_SENSOR_I2C or BrickPi.SensorType[port] == TYPE_SENSOR_I2C_9V):
-            if(BrickPi.SensorType[port] == TYPE_SENSOR_I2C or BrickPi.SensorType[port] == TYPE_SENSOR_I2C_9V or BrickPi.SensorType[port] == TYPE_SENSOR_ULTRASONIC_CONT):
+            if(self.SensorType[port] == TYPE_SENSOR_I2C or self.SensorType[port] == TYPE_SENSOR_I2C_9V or self.SensorType[port] == TYPE_SENSOR_ULTRASONIC_CONT):
             #######################
-                for device in range(BrickPi.SensorI2CDevices[port]):
-                    if not (BrickPi.SensorSettings[port][device] & BIT_I2C_SAME):
-                        AddBits(1,0,4, BrickPi.SensorI2CWrite[port][device])
-                        AddBits(1,0,4, BrickPi.SensorI2CRead[port][device])
-                        for out_byte in range(BrickPi.SensorI2CWrite[port][device]):
-                            AddBits(1,0,8, BrickPi.SensorI2COut[port][device][out_byte])
-                    device += 1
+                for device in range(self.SensorI2CDevices[port]):
+                    if not (self.SensorSettings[port][device] & BIT_I2C_SAME):
+                        AddBits(1,0,4, self.SensorI2CWrite[port][device])
+                        AddBits(1,0,4, self.SensorI2CRead[port][device])
+                        for out_byte in range(self.SensorI2CWrite[port][device]):
+                            AddBits(1,0,8, self.SensorI2COut[port][device][out_byte])
+
+        return self.BitsFlush(1, OutArray) + 1 #eq to UART_TX_BYTES
+
+    def DecodeValues(self, i, InArray, BytesReceived, now=None):
+        """
+        Decode the MSG_TYPE_VALUES reply of chip i into Encoder and the sensor values,
+        then run what follows every reply: the motor estimators and controllers, the
+        history and the event subscriptions
+
+        now is the monotonic() time the reply came in, when it isn't now (in a replay)
+        """
+        GetBits = self.GetBits
+        self.BitsLoad(InArray, BytesReceived)
+
+        Temp_BitsUsed = self.Temp_BitsUsed
+        Temp_BitsUsed[0] = GetBits(1,0,5)
+        Temp_BitsUsed[1] = GetBits(1,0,5)
 
-        if p_version==2:
-            tx_bytes = (((Bit_Offset + 7) / 8 ) + 1) #eq to UART_TX_BYTES
-        else:
-            tx_bytes = int(((Bit_Offset + 7) / 8 ) + 1) #eq to UART_TX_BYTES
-        BrickPiTx(BrickPi.Address[i], tx_bytes, Array)
+        for ii in range(2):
+            Temp_EncoderVal = GetBits(1,0, Temp_BitsUsed[ii])
+            if Temp_EncoderVal & 0x01 :
+                Temp_EncoderVal //= 2
+                self.Encoder[ii + i*2] = Temp_EncoderVal*(-1)
+            else:
+                self.Encoder[ii + i*2] = Temp_EncoderVal // 2
+
+
+        for port, decode in self.DecodePlan[i]:
+            decode(self, port)
+
+        if now is None:
+            now = monotonic()
+        self.RunMotorEstimators(i, now)
+
+        if self.History is not None:
+            self.RecordSamples(i, now)
+
+        if self.Subscriptions[i*2] or self.Subscriptions[i*2 + 1]:
+            self.CheckSubscriptions(i)
+
+        if self.PositionControl[i*2] or self.PositionControl[i*2 + 1]:
+            self.RunPositionControl(i, now)
+
+    def ClearEncoderOffsets(self, i):
+        """
+        Forget the encoder offsets of chip i once they have been sent
+        """
+        for port in (i*2 + PORT_A, i*2 + PORT_B):
+            if self.EncoderOffset[port]:
+                self.MotorEstimators[port].reset()
+            self.EncoderOffset[port] = 0
+
+    def UpdateValues(self):
+        """
+        Send the motor settings to both chips and read back the encoders and sensors
+
+        The two chips share the serial line and their replies carry no address, so
+        they are still talked to one at a time, chip 1 first.  The CPU work is moved
+        out of the way of the wire though: chip 2's message is encoded while chip 1
+        is working on its own, and chip 1's reply is decoded after chip 2's message
+        has gone out.  A failed exchange is retried up to twice per chip.
+        The steps are StartUpdate, CheckUpdateReply and FinishUpdateReply, which
+        BrickPiAsync runs around its own waiting for the replies.
+
+        Returns 0 on success, -1 if a chip could not be reached
+        """
+        self.StartUpdate()
+        i = 0
+        while i < 2 :
+            result, BytesReceived, InArray = self.Rx(0.007500) #check timeout
+            status = self.CheckUpdateReply(i, result, InArray)
+            if status > 0:
+                continue
+            if status < 0:
+                return -1
+            self.FinishUpdateReply(i, InArray, BytesReceived)
+            i += 1
+        return 0
+
+    def StartUpdate(self):
+        """
+        First step of UpdateValues: encode both chips' messages and send chip 1 its own
+        """
+        Values_Array = self.Values_Array
+        tx_bytes = self.Tx_Bytes
+        self.UpdateCycle += 1
+        self.StartI2CTransactions(0)
+        tx_bytes[0] = self.EncodeValues(0, Values_Array[0])
+        self.Tx(self.Address[0], tx_bytes[0], Values_Array[0])
+        self.StartI2CTransactions(1)
+        tx_bytes[1] = self.EncodeValues(1, Values_Array[1])
+        self.Retried = 0
+
+    def CheckUpdateReply(self, i, result, InArray):
+        """
+        Check what BrickPiRx returned for chip i during an update
+
+        A failed exchange is retried up to twice per chip, after that the whole
+        update gives up.  Returns 0 if the reply is good, 1 if the message was
+        sent again, -1 if the update failed
+        """
+        if result != -2 :
+            self.ClearEncoderOffsets(i)
+
+        if not (result or (InArray[BYTE_MSG_TYPE] != MSG_TYPE_VALUES)):
+            return 0
+        if 'DEBUG' in globals():
+            if DEBUG == 1:
+                print ("BrickPiRx Error :", result)
+
+        if self.Retried < 2 :
+            self.Retried += 1
+            self.Stats[i].retries += 1
+            #print "Retry", Retried
+            #Retry Communication from here, if failed
+            self.Tx_Bytes[i] = self.EncodeValues(i, self.Values_Array[i])
+            self.Tx(self.Address[i], self.Tx_Bytes[i], self.Values_Array[i])
+            return 1
+
+        if 'DEBUG' in globals():
+            if DEBUG == 1:
+                print ("Retry Failed")
+        self.Stats[i].failures += 1
+        self.SensorConfig[i] = None     # the chip may have reset, so set it up again next time
+        for chip in range(2):
+            self.FinishI2CTransactions(chip, failed=True)
+        return -1
 
-        result, BytesReceived, InArray = BrickPiRx(0.007500) #check timeout
-        for j in range(len(InArray)):
-            Array[j]=InArray[j]
+    def FinishUpdateReply(self, i, InArray, BytesReceived):
+        """
+        Decode the good reply of chip i during an update, once chip 2 has been sent its message
+        """
+        if i == 0:
+            # Let chip 2 start on its message while chip 1's reply is decoded
+            self.Retried = 0
+            self.Tx(self.Address[1], self.Tx_Bytes[1], self.Values_Array[1])
+
+        self.DecodeValues(i, InArray, BytesReceived)
+        self.FinishI2CTransactions(i)
+
+    #######################
+    # Frame capture
+    #######################
+
+    def EnableCapture(self, path, max_bytes=16*1024*1024, backups=3, flush_interval=0.5):
+        """
+        Start appending every frame sent and received to the trace file path, see BrickPiCapture
+
+        A trace already at path is moved to path.1 (or, with no backups, appended to), never overwritten
+
+        Usage:
+          BrickPi.EnableCapture("/home/pi/brickpi.trace")
+          ...
+          for timestamp, kind, address, result, frame in BrickPiReadTrace("/home/pi/brickpi.trace"):
+              ...
+        """
+        self.DisableCapture()
+        setup = {}
+        for config in self.SensorConfig:
+            if config is not None:
+                address, message = config[0][0], bytearray(config[1])
+                setup[address] = bytearray([address, (address + len(message) + sum(message)) % 256, len(message)]) + message
+        self.Capture = BrickPiCapture(path, max_bytes, backups, flush_interval, setup=setup)
+        return self.Capture
+
+    def DisableCapture(self):
+        """
+        Stop capturing and write the rest of the trace out
+        """
+        capture, self.Capture = self.Capture, None
+        if capture is not None:
+            capture.close()
+
+    #######################
+    # Sample history
+    #######################
+
+    def EnableHistory(self, capacity=1000, i2c=False):
+        """
+        Start keeping the last capacity samples of every port in History
+
+        The I2C input bytes are only kept if i2c is True, as they take 128 values per sample.
+
+        Usage:
+          history = BrickPi.EnableHistory(500)
+          ...
+          times, cycles, values = history.Encoder[PORT_A].last(10)
+          times, cycles, values = history.Sensor[PORT_1].since(monotonic() - 0.5)
+        """
+        self.History = BrickPiHistoryStruct(capacity, i2c)
+        return self.History
+
+    def DisableHistory(self):
+        """
+        Stop keeping samples and free History
+        """
+        self.History = None
+
+    def RecordSamples(self, i, timestamp):
+        """
+        Append the values just decoded for chip i to History
+        """
+        history = self.History
+        cycle = self.UpdateCycle
+        with history.lock:
+            for port in (i*2, i*2 + 1):
+                history.Encoder[port].append(timestamp, cycle, (self.Encoder[port],))
+                history.Sensor[port].append(timestamp, cycle, (self.Sensor[port],))
+                history.SensorArray[port].append(timestamp, cycle, self.SensorArray[port])
+                if history.SensorI2CIn is not None:
+                    history.SensorI2CIn[port].append(timestamp, cycle,
+                                                     [value for device in self.SensorI2CIn[port] for value in device])
+
+    #######################
+    # Sensor events
+    #######################
+
+    def Subscribe(self, port, test, callback=None, source="Sensor", once=False):
+        """
+        Subscribe to the values of port, see BrickPiSubscription
+
+        Returns the subscription
+        """
+        subscription = BrickPiSubscription(self, port, test, callback, source, once)
+        with self.Subscriptions_Lock:
+            self.Subscriptions[port] = self.Subscriptions[port] + [subscription]
+        return subscription
+
+    def OnChange(self, port, callback=None, source="Sensor", once=False):
+        """
+        Fires whenever the value on port changes, for example the color a color sensor sees
+        """
+        return self.Subscribe(port, lambda previous, value: value != previous, callback, source, once)
+
+    def TouchPressed(self, port):
+        """
+        Returns the predicate that tells if the touch sensor on port is pressed
+        """
+        if self.SensorType[port] in (TYPE_SENSOR_EV3_TOUCH_0, TYPE_SENSOR_EV3_TOUCH_DEBOUNCE):
+            return lambda value: value > 1000   # EV3 touch sensors read about 1020 when pressed
+        return lambda value: value > 0
+
+    def OnPress(self, port, callback=None, once=False):
+        """
+        Fires when the touch sensor on port gets pressed
+        """
+        return self.Subscribe(port, BrickPiEdge(self.TouchPressed(port)), callback, "Sensor", once)
+
+    def OnRelease(self, port, callback=None, once=False):
+        """
+        Fires when the touch sensor on port gets released
+        """
+        pressed = self.TouchPressed(port)
+        return self.Subscribe(port, BrickPiEdge(lambda value: not pressed(value)), callback, "Sensor", once)
+
+    def OnBelow(self, port, threshold, callback=None, once=False):
+        """
+        Fires when the sensor value on port drops below threshold, for example an ultrasonic distance
+        """
+        return self.Subscribe(port, BrickPiEdge(lambda value: 0 <= value < threshold), callback, "Sensor", once)
+
+    def OnEncoderCrossing(self, port, position, callback=None, once=False):
+        """
+        Fires when the encoder of the motor on port passes position, in either direction
+        """
+        def test(previous, value):
+            return previous is not None and (previous < position) != (value < position)
+        return self.Subscribe(port, test, callback, "Encoder", once)
+
+    def WaitFor(self, port, predicate, timeout=None, source="Sensor"):
+        """
+        Block until predicate(value) is true for the value on port, which may be right away
+
+        Returns the value, or None after timeout seconds
+        """
+        subscription = self.Subscribe(port, lambda previous, value: predicate(value), None, source, True)
+        try:
+            value = subscription.values[port]
+            if value is not None and predicate(value):
+                return value
+            if subscription.wait(timeout):
+                return subscription.value
+            return None
+        finally:
+            subscription.cancel()
+
+    def CheckSubscriptions(self, i):
+        """
+        Check the subscriptions on the ports of chip i
+        """
+        for port in (i*2, i*2 + 1):
+            for subscription in self.Subscriptions[port]:
+                subscription.check()
+
+    #######################
+    # I2C transactions
+    #######################
+
+    def I2CTransfer(self, port, address, out, read=0):
+        """
+        Queue an I2C transaction on port: write the bytes out to the device at (8 bit) address, then read read bytes
+
+        Returns a BrickPiI2CTransaction, see the I2C transactions section
+        """
+        transaction = self._I2CTransaction(port, address, out, read)
+        self.I2CQueue[port].append(transaction)
+        return transaction
+
+    def I2CTransfers(self, port, transfers):
+        """
+        Queue several I2C transactions on port at once, given as (address, out, read) tuples
+
+        They go with the same update as long as the port's slots and I2C_UPDATE_BYTES allow.
+        Returns the list of BrickPiI2CTransactions
+        """
+        transactions = [self._I2CTransaction(port, address, out, read) for address, out, read in transfers]
+        self.I2CQueue[port].extend(transactions)
+        return transactions
+
+    def _I2CTransaction(self, port, address, out, read):
+        if len(out) > I2C_MAX_BYTES or not 0 <= read <= I2C_MAX_BYTES:
+            raise ValueError("An I2C transaction writes and reads at most {} bytes".format(I2C_MAX_BYTES))
+        if not self.I2CSlotsFor(port, address):
+            raise ValueError("Port {} has no I2C device slot for address {:#04x} without BIT_I2C_SAME".format(port, address))
+        return BrickPiI2CTransaction(port, address, out, read)
+
+    def I2CRead(self, port, address, register, count):
+        """
+        Queue a read of count bytes from register on, returns a BrickPiI2CTransaction
+        """
+        return self.I2CTransfer(port, address, [register], count)
+
+    def I2CWrite(self, port, address, register, data):
+        """
+        Queue a write of the bytes data from register on, returns a BrickPiI2CTransaction
+        """
+        return self.I2CTransfer(port, address, [register] + list(data))
+
+    def I2CSlotsFor(self, port, address):
+        """
+        The device slots of port at address whose transfers are sent with every update
+        """
+        if self.SensorType[port] not in (TYPE_SENSOR_I2C, TYPE_SENSOR_I2C_9V) or not self.SensorI2CDevices[port]:
+            return []
+        return [slot for slot in range(min(self.SensorI2CDevices[port], 8))
+                if self.SensorI2CAddr[port][slot] == address and not ((self.SensorSettings[port][slot] or 0) & BIT_I2C_SAME)]
+
+    def SetupI2C(self, port, addresses, speed=0, settings=0, sensor_type=TYPE_SENSOR_I2C):
+        """
+        Set port up for I2C transactions, with one device slot for each (8 bit) address in addresses
+
+        An address given n times gets n slots, so up to n transactions to it
+        can go with one update.  settings (BIT_I2C_MID, not BIT_I2C_SAME) is
+        either one value for all slots or a list with one for each.
+        Call SetupSensors() afterwards to send the setup to the chip
+        """
+        if not 0 < len(addresses) <= 8:
+            raise ValueError("An I2C port has 1 to 8 device slots")
+        if not isinstance(settings, (list, tuple)):
+            settings = [settings] * len(addresses)
+        self.SensorType[port] = sensor_type
+        self.SensorI2CSpeed[port] = speed
+        self.SensorI2CDevices[port] = len(addresses)
+        for slot in range(len(addresses)):
+            self.SensorI2CAddr[port][slot] = addresses[slot]
+            self.SensorSettings[port][slot] = settings[slot] & ~BIT_I2C_SAME
+            self.SensorI2CWrite[port][slot] = 0
+            self.SensorI2CRead[port][slot] = 0
+
+    def StartI2CTransactions(self, i):
+        """
+        Load queued I2C transactions on the ports of chip i into free device slots for their address
+        """
+        budget = I2C_UPDATE_BYTES
+        for port in (i*2, i*2 + 1):
+            queue = self.I2CQueue[port]
+            if not queue:
+                continue
+            slots = self.I2CSlots[port]
+            free = {}       # address -> its slots still free in this update, in the order the firmware runs them
+            waiting = []    # transactions left for a later update
+            for n in range(len(queue)):
+                transaction = queue.popleft()
+                address = transaction.address
+                if address not in free:
+                    usable = self.I2CSlotsFor(port, address)
+                    free[address] = [slot for slot in usable if slots[slot] is None] if usable else None
+                if free[address] is None:   # the port has been set up again without the device
+                    transaction._finish("failed")
+                    continue
+                size = len(transaction.out) + transaction.read + 2  # with the address bytes
+                if not free[address] or (size > budget and budget < I2C_UPDATE_BYTES):
+                    free[address] = []      # so later ones to the same device can't overtake it
+                    waiting.append(transaction)
+                    continue
+                if not transaction._send():
+                    continue        # cancelled
+                slot = free[address].pop(0)
+                budget -= size
+                slots[slot] = transaction
+                self.SensorI2CWrite[port][slot] = len(transaction.out)
+                self.SensorI2CRead[port][slot] = transaction.read
+                self.SensorI2COut[port][slot][:len(transaction.out)] = transaction.out
+                self.I2CSent[i] += 1
+            queue.extendleft(reversed(waiting))
+
+    def FinishI2CTransactions(self, i, failed=False):
+        """
+        Hand the replies of chip i to the I2C transactions that went with the update, or fail them
+        """
+        if not self.I2CSent[i]:
+            return
+        self.I2CSent[i] = 0
+        for port in (i*2, i*2 + 1):
+            slots = self.I2CSlots[port]
+            for slot in range(8):
+                transaction = slots[slot]
+                if transaction is None:
+                    continue
+                slots[slot] = None
+                self.SensorI2CWrite[port][slot] = 0
+                self.SensorI2CRead[port][slot] = 0
+                if failed or not (self.Sensor[port] & (0x01 << slot)):
+                    transaction._finish("failed")
+                else:
+                    transaction._finish("done", bytearray(self.SensorI2CIn[port][slot][:transaction.read]))
+
+    #######################
+    # Motor control
+    #######################
+
+    def RunMotorEstimators(self, i, now):
+        """
+        Update the estimators of the motors on chip i, then the motors in speed mode
+        """
+        for port in (i*2, i*2 + 1):
+            dt = self.MotorEstimators[port].update(self.Encoder[port], now)
+            if self.MotorType[port] == TYPE_MOTOR_SPEED and dt and self.PositionControl[port] is None:
+                self.RunSpeedControl(port, dt)
+
+    def RunSpeedControl(self, port, dt):
+        """
+        Set the power of the motor on port to hold MotorTargetSpeed
+        """
+        estimator = self.MotorEstimators[port]
+        target = self.MotorTargetSpeed[port]
+        error = target - estimator.velocity
+        integral = estimator.speed_integral + error * dt
+        power = target * 255.0 / MOTOR_MAX_SPEED + SPEED_KP * error + SPEED_KI * integral
+        if abs(power) < 255:
+            estimator.speed_integral = integral     # stop integrating while the output is saturated
+        self.MotorSpeed[port] = int(max(-255, min(255, power)))
+
+    def RotateTo(self, ports, positions, power=255, tolerance=1, settle_time=0.1, timeout=2.0,
+                 kp=POSITION_KP, ki=POSITION_KI, kd=POSITION_KD):
+        """
+        Start turning the motors on ports to the encoder positions given in degrees
+
+        Args:
+          ports     : a port, or a list of ports
+          positions : the position for each port
+          power     : the highest power to use (0-255), or a list with one for each port
+          tolerance : how close (in degrees) a motor has to get to its position
+          settle_time : how long (in seconds) the motors have to stay that close for the move to be done
+          timeout   : how long (in seconds) after the planned end of the move to give up
+          kp, ki, kd : PID gains, see POSITION_KP, POSITION_KI and POSITION_KD
+
+        The move is planned so that every motor arrives at the same time, with the
+        motor that has the furthest to go (for its power) turning at full speed.
+        It starts with the next update, an update thread must be running (or
+        UpdateValues() be called) to carry it out.
+
+        Returns a BrickPiMove
+        """
+        if not isinstance(ports, (list, tuple)):
+            ports, positions = [ports], [positions]
+        if not isinstance(power, (list, tuple)):
+            power = [power] * len(ports)
+        starts = []
+        for port in ports:
+            if self.Encoder[port] is None:
+                raise ValueError("No encoder reading for port {} yet, call BrickPiUpdateValues() first".format(port))
+            starts.append(self.Encoder[port])
+        targets = [int(round(position * 2)) for position in positions]
+
+        duration = 0.0
+        for start, target, max_power in zip(starts, targets, power):
+            if max_power <= 0:
+                raise ValueError("Power must be positive: {}".format(max_power))
+            speed = 2.0 * MOTOR_MAX_SPEED * min(max_power, 255) / 255
+            duration = max(duration, abs(target - start) / speed)
+
+        move = BrickPiMove(self, ports, monotonic() + duration + timeout)
+        for port, start, target, max_power in zip(ports, starts, targets, power):
+            previous = self.PositionControl[port]
+            if previous is not None:
+                previous.move.cancel()
+            self.PositionControl[port] = BrickPiPositionController(
+                move, port, start, target, duration, min(max_power, 255),
+                tolerance * 2, settle_time, timeout, kp, ki, kd)
+        return move
+
+    def Rotate(self, ports, degrees, power=255, **options):
+        """
+        Start turning the motors on ports by degrees from where they are, like RotateTo
+
+        Usage:
+          move = BrickPi.Rotate([PORT_A, PORT_D], [360, -360])
+          ...
+          move.wait()
+        """
+        if not isinstance(ports, (list, tuple)):
+            ports, degrees = [ports], [degrees]
+        positions = []
+        for port, angle in zip(ports, degrees):
+            if self.Encoder[port] is None:
+                raise ValueError("No encoder reading for port {} yet, call BrickPiUpdateValues() first".format(port))
+            positions.append(self.Encoder[port] / 2.0 + angle)
+        return self.RotateTo(ports, positions, power, **options)
+
+    def RunPositionControl(self, i, now):
+        """
+        Step the position controllers of the motors on chip i
+        """
+        for port in (i*2, i*2 + 1):
+            controller = self.PositionControl[port]
+            if controller is not None:
+                controller.step(now)
+
+    def MotorRotateDegree(self, power, deg, port, sampling_time=.01, delay_when_stopping=.05):
+        """
+        Rotate the selected motors by specified degree, see motorRotateDegree
+        """
+        self.UpdateValues()
+        move = self.Rotate(port, deg, [abs(p) for p in power])
+        deadline = monotonic()
+        while not move.done():
+            deadline += sampling_time
+            self.UpdateValues()          #Ask BrickPi to update values for sensors/motors, this runs the controllers
+            time.sleep(max(0, deadline - monotonic()))
+        for i in range(len(port)):
+            self.MotorEnable[port[i]] = 0
+        self.UpdateValues()
+        return 0 if move.status == "done" else -1
+
+
+BrickPi = BrickPiDevice('/dev/ttyAMA0')   # the default device, which the BrickPi* functions below work on
+ser = None              # BrickPi.ser, once BrickPiSetup() or BrickPiUseTransport() has created it
+BrickPiHistory = None   # BrickPi.History, once BrickPiEnableHistory() has been called
 
-        if result != -2 :
-            BrickPi.EncoderOffset[(i * 2) + PORT_A] = 0
-            BrickPi.EncoderOffset[(i * 2) + PORT_B] = 0
 
-        if (result or (Array[BYTE_MSG_TYPE] != MSG_TYPE_VALUES)):
-            if 'DEBUG' in globals():
-                if DEBUG == 1:
-                    print ("BrickPiRx Error :", result)
+#######################
+# Default device
+#######################
+# The functions below are the original, module level interface of this
+# library.  Each one calls the BrickPiDevice method of the same name (without
+# the BrickPi prefix) on the default device, BrickPi.
 
-            if Retried < 2 :
-                ret = True
-                Retried += 1
-                #print "Retry", Retried
-                continue
-            else:
-                if 'DEBUG' in globals():
-                    if DEBUG == 1:
-                        print ("Retry Failed")
-                return -1
+def BrickPiUseTransport(transport):
+    global ser
+    BrickPi.UseTransport(transport)
+    ser = BrickPi.ser
 
+def BrickPiSetup():
+    global ser
+    result = BrickPi.Setup()
+    ser = BrickPi.ser
+    return result
 
-        ret = False
-        Bit_Offset = 0
+def BrickPiTx(dest, ByteCount, OutArray):
+    return BrickPi.Tx(dest, ByteCount, OutArray)
 
-        Temp_BitsUsed = []
-        Temp_BitsUsed.append(GetBits(1,0,5))
-        Temp_BitsUsed.append(GetBits(1,0,5))
+def BrickPiRxWait(deadline):
+    return BrickPi.RxWait(deadline)
 
-        for ii in range(2):
-            Temp_EncoderVal = GetBits(1,0, Temp_BitsUsed[ii])
-            if Temp_EncoderVal & 0x01 :
-                Temp_EncoderVal /= 2
-                BrickPi.Encoder[ii + i*2] = Temp_EncoderVal*(-1)
-            else:
-                BrickPi.Encoder[ii + i*2] = Temp_EncoderVal / 2
+def BrickPiRxRead(InArray, ByteCount, deadline):
+    return BrickPi.RxRead(InArray, ByteCount, deadline)
 
+def BrickPiRx(timeout):
+    return BrickPi.Rx(timeout)
 
-        for ii in range(2):
-            port = ii + (i * 2)
-            if BrickPi.SensorType[port] == TYPE_SENSOR_TOUCH :
-                BrickPi.Sensor[port] = GetBits(1,0,1)
-            #elif BrickPi.SensorType[port] == TYPE_SENSOR_ULTRASONIC_CONT or BrickPi.SensorType[port] == TYPE_SENSOR_ULTRASONIC_SS :
-            #Jan's US fix##########
-                #old# elif BrickPi.SensorType[port] == TYPE_SENSOR_ULTRASONIC_CONT or BrickPi.SensorType[port] == TYPE_SENSOR_ULTRASONIC_SS :
-            elif BrickPi.SensorType[port] == TYPE_SENSOR_ULTRASONIC_SS :
-            #######################
-                BrickPi.Sensor[port] = GetBits(1,0,8)
-            elif BrickPi.SensorType[port] == TYPE_SENSOR_COLOR_FULL:
-                print "COLOR FULL"
-                BrickPi.Sensor[port] = GetBits(1,0,3)
-                BrickPi.SensorArray[port][INDEX_BLANK] = GetBits(1,0,10)
-                BrickPi.SensorArray[port][INDEX_RED] = GetBits(1,0,10)
-                BrickPi.SensorArray[port][INDEX_GREEN] = GetBits(1,0,10)
-                BrickPi.SensorArray[port][INDEX_BLUE] = GetBits(1,0,10)
-            #elif BrickPi.SensorType[port] == TYPE_SENSOR_I2C or BrickPi.SensorType[port] == TYPE_SENSOR_I2C_9V :
-            #Jan's US fix##########
-            #old# elif BrickPi.SensorType[port] == TYPE_SENSOR_I2C or BrickPi.SensorType[port] == TYPE_SENSOR_I2C_9V :
-            elif BrickPi.SensorType[port] == TYPE_SENSOR_I2C or BrickPi.SensorType[port] == TYPE_SENSOR_I2C_9V or BrickPi.SensorType[port] == TYPE_SENSOR_ULTRASONIC_CONT:
-            #######################
-                BrickPi.Sensor[port] = GetBits(1,0, BrickPi.SensorI2CDevices[port])
-                for device in range(BrickPi.SensorI2CDevices[port]):
-                    if (BrickPi.Sensor[port] & ( 0x01 << device)) :
-                        for in_byte in range(BrickPi.SensorI2CRead[port][device]):
-                            BrickPi.SensorI2CIn[port][device][in_byte] = GetBits(1,0,8)
-            elif BrickPi.SensorType[port] in [ TYPE_SENSOR_EV3_COLOR_M2, TYPE_SENSOR_EV3_GYRO_M3 ]:
-                BrickPi.Sensor[port] = GetBits(1,0,32)
-            elif BrickPi.SensorType[port] in [ TYPE_SENSOR_EV3_INFRARED_M2 ]:
-                BrickPi.Sensor[port] = GetBits(1,0,32)
-                ###############################################################################################################################################
-                # print "Raw returned: "+str(BrickPi.Sensor[port])
-                if 'DEBUG' in globals():
-                    if BrickPi.Sensor[port] > 4278190080:
-                        print ("IR SENSOR RETURNED ERROR")
-            elif BrickPi.SensorType[port] in range(TYPE_SENSOR_EV3_US_M0,TYPE_SENSOR_EV3_INFRARED_M5+1):
-                BrickPi.Sensor[port] = GetBits(1,0,16)
-            else:   #For all the light, color and raw sensors
-                BrickPi.Sensor[ii + (i * 2)] = GetBits(1,0,10)
-
-            #Jan's US fix##########
-            if BrickPi.SensorType[port] == TYPE_SENSOR_ULTRASONIC_CONT :
-                if(BrickPi.Sensor[port] & ( 0x01 << US_I2C_IDX)) :
-                    BrickPi.Sensor[port] = BrickPi.SensorI2CIn[port][US_I2C_IDX][0]
-                else:
-                    BrickPi.Sensor[port] = -1
-      #######################
-
-      #######################
-      # EV3 Gyro Mode 0, Adjust sign
-            if BrickPi.SensorType[port] == TYPE_SENSOR_EV3_GYRO_M0 :
-                if BrickPi.Sensor[port] >= 32767:       # Negative number.  This seems to return a 2 byte number.
-                    BrickPi.Sensor[port] = BrickPi.Sensor[port] - 65535
-      # else:                   # Positive Number print str(gyro)
-      #######################
-      # EV3 Gyro Mode 1, Adjust sign
-            elif BrickPi.SensorType[port] == TYPE_SENSOR_EV3_GYRO_M1 :
-                # print "Gyro m1!"
-                if BrickPi.Sensor[port] >= 32767:       # Negative number.  This seems to return a 2 byte number.
-                    BrickPi.Sensor[port] = BrickPi.Sensor[port] - 65535
-      # else:                   # Positive Number print str(gyro)
-
-            # print BrickPi.SensorType[port]
-        i += 1
-    return 0
+def BrickPiRxCheck(InBytes):
+    return BrickPi.RxCheck(InBytes)
 
+def BitsReset():
+    return BrickPi.BitsReset()
 
-def BrickPiSetup():
-    """
-    Open Serial port for communication
-    
-    Returns either 0 upon completion or -1
-    -1 could either mean 
-    a) port is already open
-    b) port cannot be opened
-    """
+def BitsLoad(InArray, byte_count):
+    return BrickPi.BitsLoad(InArray, byte_count)
 
-    debugprint("BrickPiSetup")
-    if ser.isOpen():
-        return -1
-    ser.open()
-    if not ser.isOpen():
-        return -1
-    return 0
+def BitsFlush(byte_offset, OutArray=None):
+    return BrickPi.BitsFlush(byte_offset, OutArray)
 
+def GetBits(byte_offset, bit_offset, bits):
+    return BrickPi.GetBits(byte_offset, bit_offset, bits)
 
-def BrickPiTx(dest, ByteCount, OutArray):
-    """
-    Transmits a string on the serial comms 
+def AddBits(byte_offset, bit_offset, bits, value):
+    return BrickPi.AddBits(byte_offset, bit_offset, bits, value)
 
-    Inputs:
-    ByteCount *must* be castable to an int; code will fail otherwise
-    """
+def BrickPiChangeAddress(OldAddr, NewAddr):
+    return BrickPi.ChangeAddress(OldAddr, NewAddr)
 
-    if p_version==2:
-        # print ('a',p_version)
-        tx_buffer = ''
-        tx_buffer+=chr(dest)
-        tx_buffer+=chr((dest+ByteCount+sum(OutArray[:ByteCount]))%256)
-        tx_buffer+=chr(ByteCount)
-        for i in OutArray[:ByteCount]:
-            tx_buffer+=chr(i)
-        ser.write(tx_buffer)
-    else:
-        # print (p_version,'b')
-        intByteCount = int(ByteCount)
-        tx_buffer = ''
-        tx_buffer+=chr(dest)
-        tx_buffer+=chr((dest+intByteCount+sum(OutArray[:intByteCount]))%256)
-        tx_buffer+=chr(intByteCount)
-        
-        for i in OutArray[:intByteCount]:
-            tx_buffer+=chr(i)
-        
-        byte_tx_buffer = bytes(tx_buffer, 'iso-8859-1')
-        print "Transmit buffer:",byte_tx_buffer
-        ser.write(byte_tx_buffer)   
+def BrickPiSetTimeout():
+    return BrickPi.SetTimeout()
 
+def BrickPiCompileDecodePlan(i):
+    return BrickPi.CompileDecodePlan(i)
 
-def BrickPiRx(timeout):
-    rx_buffer = ''
-    ser.timeout=0
-    ot = time.time()
+def BrickPiSetupSensors(force=False):
+    return BrickPi.SetupSensors(force)
 
-    while( ser.inWaiting() <= 0):
-        if time.time() - ot >= timeout :
-            return -2, 0 , []
+def BrickPiSetupSensorsOneChip(i, force=False):
+    return BrickPi.SetupSensorsOneChip(i, force)
 
-    if not ser.isOpen():
-        return -1, 0 , []
+def BrickPiSendSensorSetup(i, force=False):
+    return BrickPi.SendSensorSetup(i, force)
 
-    if p_version==2:
-        try:
-            while ser.inWaiting():
-                rx_buffer += ( ser.read(ser.inWaiting()) )
-                #time.sleep(.000075)
-        except:
-            print ("Unexpected error: ", sys.exc_info()[0])
-            return -1, 0 , []
-    else:
-        buff_in = 0
-        try:
-            while ser.inWaiting():
-                buff_in = ser.inWaiting()
-                buff_read = bytes((ser.read(buff_in)))
-                string_in = ''
-                for i in buff_read:
-                    # print(chr(i))
-                    string_in+=chr(i)
-
-                rx_buffer += (string_in)
-        except:
-            # print ("Unexpected error: ", sys.exc_info()[0])
-            return -1, 0 , []
+def BrickPiSensorSetupDone(i, config, result, BytesReceived, InArray):
+    return BrickPi.SensorSetupDone(i, config, result, BytesReceived, InArray)
+
+def BrickPiEncodeSensorTypes(i):
+    return BrickPi.EncodeSensorTypes(i)
+
+def BrickPiEncodeValues(i, OutArray):
+    return BrickPi.EncodeValues(i, OutArray)
+
+def BrickPiDecodeValues(i, InArray, BytesReceived, now=None):
+    return BrickPi.DecodeValues(i, InArray, BytesReceived, now)
+
+def BrickPiClearEncoderOffsets(i):
+    return BrickPi.ClearEncoderOffsets(i)
+
+def BrickPiUpdateValues():
+    return BrickPi.UpdateValues()
+
+def BrickPiStartUpdate():
+    return BrickPi.StartUpdate()
+
+def BrickPiCheckUpdateReply(i, result, InArray):
+    return BrickPi.CheckUpdateReply(i, result, InArray)
+
+def BrickPiFinishUpdateReply(i, InArray, BytesReceived):
+    return BrickPi.FinishUpdateReply(i, InArray, BytesReceived)
+
+def BrickPiProtocolStats():
+    return BrickPi.ProtocolStats()
+
+def BrickPiResetProtocolStats():
+    return BrickPi.ResetProtocolStats()
+
+def BrickPiRunMotorEstimators(i, now):
+    return BrickPi.RunMotorEstimators(i, now)
+
+def BrickPiRunSpeedControl(port, dt):
+    return BrickPi.RunSpeedControl(port, dt)
+
+def BrickPiRunPositionControl(i, now):
+    return BrickPi.RunPositionControl(i, now)
+
+def BrickPiEnableCapture(path, max_bytes=16*1024*1024, backups=3, flush_interval=0.5):
+    return BrickPi.EnableCapture(path, max_bytes, backups, flush_interval)
+
+def BrickPiDisableCapture():
+    return BrickPi.DisableCapture()
+
+def BrickPiEnableHistory(capacity=1000, i2c=False):
+    global BrickPiHistory
+    BrickPiHistory = BrickPi.EnableHistory(capacity, i2c)
+    return BrickPiHistory
+
+def BrickPiDisableHistory():
+    global BrickPiHistory
+    BrickPi.DisableHistory()
+    BrickPiHistory = None
+
+def BrickPiRecordSamples(i, timestamp):
+    return BrickPi.RecordSamples(i, timestamp)
+
+def BrickPiSubscribe(port, test, callback=None, source="Sensor", once=False):
+    return BrickPi.Subscribe(port, test, callback, source, once)
+
+def BrickPiOnChange(port, callback=None, source="Sensor", once=False):
+    return BrickPi.OnChange(port, callback, source, once)
+
+def TouchPressed(port):
+    return BrickPi.TouchPressed(port)
+
+def BrickPiOnPress(port, callback=None, once=False):
+    return BrickPi.OnPress(port, callback, once)
+
+def BrickPiOnRelease(port, callback=None, once=False):
+    return BrickPi.OnRelease(port, callback, once)
+
+def BrickPiOnBelow(port, threshold, callback=None, once=False):
+    return BrickPi.OnBelow(port, threshold, callback, once)
+
+def BrickPiOnEncoderCrossing(port, position, callback=None, once=False):
+    return BrickPi.OnEncoderCrossing(port, position, callback, once)
 
-        # print("Buffer: " + rx_buffer)
-        # print("Buffer Type: " + str(type(rx_buffer)))
-    
-    RxBytes=len(rx_buffer)
+def BrickPiWaitFor(port, predicate, timeout=None, source="Sensor"):
+    return BrickPi.WaitFor(port, predicate, timeout, source)
 
-    if RxBytes < 2 :
-        return -4, 0 , []
+def BrickPiCheckSubscriptions(i):
+    return BrickPi.CheckSubscriptions(i)
 
-    if RxBytes < ord(rx_buffer[1])+2 :
-        return -6, 0 , []
+def BrickPiI2CTransfer(port, address, out, read=0):
+    return BrickPi.I2CTransfer(port, address, out, read)
 
-    CheckSum = 0
-    for i in rx_buffer[1:]:
-        CheckSum += ord(i)
+def BrickPiI2CRead(port, address, register, count):
+    return BrickPi.I2CRead(port, address, register, count)
 
-    InArray = []
-    for i in rx_buffer[2:]:
-        InArray.append(ord(i))
-    if (CheckSum % 256) != ord(rx_buffer[0]) : #Checksum equals sum(InArray)+len(InArray)
-        return -5, 0 , []
+def BrickPiI2CWrite(port, address, register, data):
+    return BrickPi.I2CWrite(port, address, register, data)
 
-    InBytes = RxBytes - 2
+def BrickPiI2CTransfers(port, transfers):
+    return BrickPi.I2CTransfers(port, transfers)
 
-    return 0, InBytes, InArray
+def BrickPiI2CSlotsFor(port, address):
+    return BrickPi.I2CSlotsFor(port, address)
+
+def BrickPiSetupI2C(port, addresses, speed=0, settings=0, sensor_type=TYPE_SENSOR_I2C):
+    return BrickPi.SetupI2C(port, addresses, speed, settings, sensor_type)
+
+def BrickPiStartI2CTransactions(i):
+    return BrickPi.StartI2CTransactions(i)
+
+def BrickPiFinishI2CTransactions(i, failed=False):
+    return BrickPi.FinishI2CTransactions(i, failed)
+
+def BrickPiRotateTo(ports, positions, power=255, **options):
+    return BrickPi.RotateTo(ports, positions, power, **options)
+
+def BrickPiRotate(ports, degrees, power=255, **options):
+    return BrickPi.Rotate(ports, degrees, power, **options)
+
+
+def motorRotateDegree(power,deg,port,sampling_time=.01,delay_when_stopping=.05):
+    """Rotate the selected motors by specified degree
+
+    Args:
+      power    : an array of the power values at which to rotate the motors (0-255)
+      deg      : an array of the angle's (in degrees) by which to rotate each of the motor
+      port     : an array of the port's on which the motor is connected
+      sampling_time  : (optional) the time (in seconds) between updates, the position controller runs once per update
+      delay_when_stopping:  (optional) no longer used, the position controller brakes the motors itself
+
+    Returns:
+      0 on success, -1 if a motor didn't reach its position
+
+    Usage:
+      Pass the arguments in a list. if a single motor has to be controlled then the arguments should be
+      passed like elements of an array,e.g, motorRotateDegree([255],[360],[PORT_A]) or
+      motorRotateDegree([255,255],[360,360],[PORT_A,PORT_B])
+
+    This blocks and runs the updates itself; see BrickPiRotate for a move that
+    runs in the background, on a BrickPiUpdateThread.
+    """
+    return BrickPi.MotorRotateDegree(power, deg, port, sampling_time, delay_when_stopping)
+
+
+#######################
+# Background updates
+#######################
+
+class BrickPiUpdateThread(threading.Thread):
+    """
+    Thread that calls BrickPiUpdateValues() at a fixed rate (in updates per second)
+
+    The thread updates the default device, BrickPi, unless it is given another
+    BrickPiDevice.  Each device should have its own thread; threads updating
+    different devices run concurrently.
+
+    Each update is started on a deadline taken from the monotonic clock, one
+    period after the previous one, so the time spent on the serial line doesn't
+    add up into drift. An update that takes longer than its period is logged as
+    an overrun and the missed slots are skipped rather than run back to back.
+    Failed updates and exceptions are counted and logged, not swallowed.
+
+    pause() and resume() suspend the updates without leaving the thread
+    spinning; a resumed thread updates straight away. Changes made inside a
+    "with updater.changes():" block reach the BrickPi in the same update.
+
+    Subclasses can override update() to do work of their own every period;
+    listeners added with add_listener() are called after every update.
+
+    Usage:
+      updater = BrickPiUpdateThread(rate=20)
+      updater.start()
+      with updater.changes():
+          BrickPi.MotorSpeed[PORT_A] = 200
+          BrickPi.MotorSpeed[PORT_D] = 200
+      ...
+      print(updater.stats())
+      updater.stop()
+    """
+    STATS_WINDOW = 100  # number of recent updates rate and jitter are measured over
+
+    def __init__(self, rate=20, name="BrickPiUpdateThread", brickpi=None):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.brickpi = brickpi if brickpi is not None else BrickPi
+        self.rate = rate
+        self.updates = 0
+        self.failures = 0
+        self.overruns = 0
+        self._paused = False
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._update_lock = threading.RLock()
+        self._starts = deque(maxlen=self.STATS_WINDOW)
+        self._starts_lock = threading.Lock()
+        self._listeners = []    # replaced, never modified in place, like the subscriptions
+
+    @property
+    def rate(self):
+        return 1.0 / self.period
+
+    @rate.setter
+    def rate(self, rate):
+        if rate <= 0:
+            raise ValueError("Update rate must be positive: {}".format(rate))
+        self.period = 1.0 / rate
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def update(self):
+        """
+        Called once every period. Returns 0 on success, like BrickPiUpdateValues()
+        """
+        return self.brickpi.UpdateValues()
+
+    def run(self):
+        deadline = monotonic()
+        while True:
+            with self._condition:
+                if self._paused and not self._stopping:
+                    while self._paused and not self._stopping:
+                        self._condition.wait()
+                    deadline = monotonic()
+                    with self._starts_lock:
+                        self._starts.clear()    # the pause isn't part of the measured period
+                if self._stopping:
+                    break
+
+            with self._update_lock:
+                if self._paused or self._stopping:
+                    continue    # paused (or stopped) since the check above, pause() may already have returned
+                start = monotonic()
+                with self._starts_lock:
+                    self._starts.append(start)
+                try:
+                    if self.update():
+                        self.failures += 1
+                        log.debug("BrickPi update failed")
+                except Exception:
+                    self.failures += 1
+                    log.exception("BrickPi update raised an exception")
+                self.updates += 1
+                for listener in self._listeners:
+                    try:
+                        listener(self)
+                    except Exception:
+                        log.exception("BrickPi update listener raised an exception")
+
+            period = self.period
+            deadline += period
+            now = monotonic()
+            if now > deadline:
+                self.overruns += 1
+                log.warning("BrickPi update overran its %.1f ms period by %.1f ms",
+                            period * 1000, (now - deadline) * 1000)
+                deadline += (int((now - deadline) / period) + 1) * period
+            with self._condition:
+                if not (self._paused or self._stopping):
+                    self._condition.wait(deadline - now)
+
+    def pause(self):
+        """
+        Suspend the updates. Returns once the update in progress, if any, has finished
+        """
+        with self._condition:
+            self._paused = True
+            self._condition.notify_all()
+        with self._update_lock:
+            pass
+
+    def resume(self):
+        """
+        Resume the updates, starting with one right away
+        """
+        with self._condition:
+            self._paused = False
+            self._condition.notify_all()
+
+    def add_listener(self, listener):
+        """
+        Call listener(updater) after every update, on this thread, failed updates included
+        """
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        self._listeners = [l for l in self._listeners if l is not listener]
+
+    def changes(self):
+        """
+        Context manager that keeps updates out while a group of changes is made
+
+        The loop keeps its schedule; an update that falls due inside the block
+        waits for it to end, so it sends either none or all of the changes.
+        Also gives the block exclusive use of the serial port, for example to
+        call BrickPiSetupSensors() while the thread is running.
+        """
+        return self._update_lock
+
+    def stop(self, timeout=None):
+        """
+        Stop updating and wait (at most timeout seconds) for the update in progress to finish
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(timeout)
+
+    def stats(self):
+        """
+        Returns a dict with the measured update rate (per second), the jitter of
+        the update period (standard deviation, in seconds) over the last
+        STATS_WINDOW updates, and the update, failure and overrun counts
+        """
+        with self._starts_lock:
+            starts = list(self._starts)
+        intervals = [b - a for a, b in zip(starts, starts[1:])]
+        rate = jitter = 0.0
+        if intervals:
+            mean = sum(intervals) / len(intervals)
+            rate = 1.0 / mean if mean else 0.0
+            jitter = (sum((x - mean) ** 2 for x in intervals) / len(intervals)) ** 0.5
+        return {
+            "target_rate": self.rate,
+            "rate": rate,
+            "jitter": jitter,
+            "updates": self.updates,
+            "failures": self.failures,
+            "overruns": self.overruns,
+        }
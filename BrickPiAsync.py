@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# BrickPiAsync.py
+#
+# These files have been made available online through a Creative Commons Attribution-ShareAlike 3.0  license.
+# (http://creativecommons.org/licenses/by-sa/3.0/)
+#
+# asyncio interface to the BrickPi (Python 3.5 and later).
+#
+# Usage:
+#   async with BrickPiAsync() as brickpi:
+#       BrickPi.SensorType[PORT_1] = TYPE_SENSOR_TOUCH
+#       await brickpi.setup_sensors()
+#       while True:
+#           await brickpi.update()
+#           print(BrickPi.Sensor[PORT_1])
+#
+# Messages are encoded and decoded by BrickPi.py and use the same BrickPi structure, but the serial
+# port is watched with loop.add_reader(), so waiting for a reply never blocks the event loop.
+# BrickPiAsync(device) drives another BrickPiDevice than the default one.
+# update() calls made while an update is in flight all wait for that same update.
+# Transactions are serialized, so setup_sensors() waits for a running update to finish.
+#
+# Don't call the blocking BrickPiUpdateValues() or BrickPiSetupSensors() from another
+# thread while this is in use.
+
+import asyncio
+import serial
+
+from BrickPi import *
+
+
+class BrickPiAsync:
+    '''
+    Non-blocking BrickPi driver for asyncio event loops
+    '''
+    def __init__(self, brickpi=None):
+        self.brickpi = brickpi if brickpi is not None else BrickPi
+        self._loop = None
+        self._lock = None
+        self._update = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def open(self):
+        '''
+        Open the serial port, like BrickPiSetup()
+
+        Returns 0 on success, -1 if the port was already open or couldn't be opened
+        '''
+        self._loop = asyncio.get_event_loop()
+        self._lock = asyncio.Lock()
+        return self.brickpi.Setup()
+
+    def close(self):
+        if self.brickpi.ser is not None:
+            self.brickpi.ser.close()
+
+    async def update(self):
+        '''
+        Send the motor settings and read back the encoders and sensors, like BrickPiUpdateValues()
+
+        Joins the update in flight if there is one.
+        Returns 0 on success, -1 if a chip could not be reached
+        '''
+        if self._update is None:
+            self._update = asyncio.ensure_future(self._update_values())
+            self._update.add_done_callback(self._update_done)
+        # One awaiter giving up must not cancel the update for the others
+        return await asyncio.shield(self._update)
+
+    async def setup_sensors(self, force=False):
+        '''
+        Configure the sensors set in BrickPi.SensorType, like BrickPiSetupSensors()
+
+        Chips that already have this configuration are skipped unless force is set.
+        Returns 0 on success, -1 on failure
+        '''
+        brickpi = self.brickpi
+        result = 0
+        async with self._lock:
+            for i in range(2):
+                config = brickpi.SendSensorSetup(i, force)
+                if config is None:
+                    continue
+                res, BytesReceived, InArray = await self._receive(5) # EV3 sensors take a while to set up
+                if brickpi.SensorSetupDone(i, config, res, BytesReceived, InArray):
+                    result = -1
+        return result
+
+    def _update_done(self, task):
+        if self._update is task:
+            self._update = None
+
+    async def _update_values(self):
+        # Same exchange as BrickPiUpdateValues(), waiting on the event loop instead of select()
+        brickpi = self.brickpi
+        async with self._lock:
+            brickpi.StartUpdate()
+            i = 0
+            while i < 2:
+                result, BytesReceived, InArray = await self._receive(0.007500)
+                status = brickpi.CheckUpdateReply(i, result, InArray)
+                if status > 0:
+                    continue
+                if status < 0:
+                    return -1
+                brickpi.FinishUpdateReply(i, InArray, BytesReceived)
+                i += 1
+            return 0
+
+    #################################################
+    # Receiving
+    #################################################
+    async def _receive(self, timeout):
+        # BrickPiRx() for the event loop
+        deadline = self._loop.time() + timeout
+
+        brickpi = self.brickpi
+        if brickpi.ser is None or not brickpi.ser.isOpen():
+            return brickpi.RecordReply((-1, 0, []))
+
+        try:
+            RxBytes = await self._read(brickpi.Rx_Header, 2, deadline)
+            if RxBytes == 0:
+                return brickpi.RecordReply((-2, 0, []))
+            if RxBytes < 2:
+                return brickpi.RecordReply((-4, 0, []))
+            InBytes = await self._read(brickpi.Rx_Buffer, brickpi.Rx_Header[1], deadline)
+        except (OSError, serial.SerialException):
+            return brickpi.RecordReply((-1, 0, []))
+
+        return brickpi.RecordReply(brickpi.RxCheck(InBytes))
+
+    async def _read(self, InArray, ByteCount, deadline):
+        ser = self.brickpi.ser
+        count = 0
+        while count < ByteCount:
+            waiting = ser.inWaiting()
+            if waiting <= 0:
+                if not await self._readable(deadline):
+                    break
+                continue
+            data = ser.read(min(waiting, ByteCount - count))
+            InArray[count:count + len(data)] = data
+            count += len(data)
+        self.brickpi.CountReceived(count)
+        return count
+
+    async def _readable(self, deadline):
+        remaining = deadline - self._loop.time()
+        if remaining <= 0:
+            return False
+        readable = self._loop.create_future()
+        fd = self.brickpi.ser.fileno()
+        self._loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, remaining)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._loop.remove_reader(fd)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# BrickPiBenchmark.py
+#
+# These files have been made available online through a Creative Commons Attribution-ShareAlike 3.0  license.
+# (http://creativecommons.org/licenses/by-sa/3.0/)
+#
+# Benchmarks for the protocol hot path of BrickPi.py.
+#
+# Microbenchmarks time the message encoder and decoder, BrickPiTx (framing and checksum) against a
+# transport that discards everything, and BrickPiRx (parsing and checksum) against a transport that
+# hands back a recorded reply.
+# Round trip benchmarks run against BrickPiEmulator and time each phase of one chip's exchange
+# (encode, BrickPiTx, waiting for the reply, BrickPiRx, decode) as well as complete BrickPiUpdateValues() calls.
+#
+# Every benchmark reports p50 and p99 latency and the rate that latency allows.
+#
+# Usage:
+#   python BrickPiBenchmark.py                    # all sensor configurations
+#   python BrickPiBenchmark.py --config i2c --count 5000 --latency 0.0005
+
+import argparse
+import time
+
+from BrickPi import *
+from BrickPiEmulator import BrickPiEmulator
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+#################################################
+# Transports
+#################################################
+class NullTransport:
+    '''
+    Accepts and discards every frame
+    '''
+    def isOpen(self):
+        return True
+
+    def write(self, data):
+        return len(data)
+
+    def inWaiting(self):
+        return 0
+
+    def flushInput(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplayTransport(NullTransport):
+    '''
+    Answers every frame with the same recorded reply
+    '''
+    def __init__(self, reply):
+        self.reply = bytes(reply)
+        self.pending = b''
+
+    def write(self, data):
+        self.pending = self.reply
+        return len(data)
+
+    def inWaiting(self):
+        return len(self.pending)
+
+    def read(self, size=1):
+        data = self.pending[:size]
+        self.pending = self.pending[size:]
+        return data
+
+    def flushInput(self):
+        self.pending = b''
+
+
+#################################################
+# Sensor configurations
+#################################################
+def configure_touch(emulator):
+    for port in range(4):
+        BrickPi.SensorType[port] = TYPE_SENSOR_TOUCH
+        emulator.Sensor[port] = port & 1
+
+
+def configure_i2c(emulator):
+    for port in range(4):
+        BrickPi.SensorType[port] = TYPE_SENSOR_I2C
+        BrickPi.SensorI2CSpeed[port] = 0
+        BrickPi.SensorI2CDevices[port] = 8
+        for device in range(8):
+            address = 0x10 + device * 2
+            BrickPi.SensorI2CAddr[port][device] = address
+            BrickPi.SensorSettings[port][device] = 0
+            BrickPi.SensorI2CWrite[port][device] = 1
+            BrickPi.SensorI2CRead[port][device] = 2
+            BrickPi.SensorI2COut[port][device][0] = 0x42
+            emulator.add_i2c_device(port, address).set_register(0x42, [device, port])
+
+
+def configure_ev3(emulator):
+    BrickPi.SensorType[PORT_1] = TYPE_SENSOR_EV3_COLOR_M2
+    BrickPi.SensorType[PORT_2] = TYPE_SENSOR_EV3_GYRO_M3
+    BrickPi.SensorType[PORT_3] = TYPE_SENSOR_EV3_INFRARED_M2
+    BrickPi.SensorType[PORT_4] = TYPE_SENSOR_EV3_GYRO_M3
+    for port in range(4):
+        emulator.Sensor[port] = 0x12345678
+
+CONFIGS = {
+    "touch": configure_touch,
+    "i2c": configure_i2c,
+    "ev3": configure_ev3,
+}
+
+
+#################################################
+# Measurement
+#################################################
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p50 = percentile(samples, 0.50)
+    p99 = percentile(samples, 0.99)
+    rate = len(samples) / sum(samples) if sum(samples) else float('inf')
+    print("  {:<28}{:>10.1f}{:>10.1f}{:>12.0f}".format(name, p50 * 1e6, p99 * 1e6, rate))
+
+
+def measure(function, count):
+    samples = []
+    for i in range(count):
+        start = timer()
+        function()
+        samples.append(timer() - start)
+    return samples
+
+
+def benchmark(name, count, latency):
+    emulator = BrickPiEmulator(latency=latency)
+    emulator.start()
+    Values_Array = BrickPi.Values_Array
+    try:
+        BrickPiUseTransport(emulator.port)
+        BrickPiSetup()
+        CONFIGS[name](emulator)
+        if BrickPiSetupSensors():
+            print("BrickPiSetupSensors failed for " + name)
+            return
+        BrickPiUpdateValues()
+
+        # record chip 1's reply for the decode and BrickPiRx microbenchmarks
+        tx_bytes = BrickPiEncodeValues(0, Values_Array[0])
+        BrickPiTx(BrickPi.Address[0], tx_bytes, Values_Array[0])
+        result, reply_bytes, reply = BrickPiRx(0.1)
+        if result:
+            print("No reply from the emulator for " + name)
+            return
+        reply = bytearray(reply[:reply_bytes])
+        frame = bytearray([(reply_bytes + sum(reply)) % 256, reply_bytes]) + reply
+
+        print("")
+        print("{} ({} message bytes, {} reply bytes)".format(name, tx_bytes, reply_bytes))
+        print("  {:<28}{:>10}{:>10}{:>12}".format("", "p50 us", "p99 us", "per second"))
+
+        report("encode", measure(lambda: BrickPiEncodeValues(0, Values_Array[0]), count))
+        report("decode", measure(lambda: BrickPiDecodeValues(0, reply, reply_bytes), count))
+
+        emulated = BrickPi.ser
+        BrickPiUseTransport(NullTransport())
+        report("BrickPiTx (no I/O)", measure(lambda: BrickPiTx(BrickPi.Address[0], tx_bytes, Values_Array[0]), count))
+        BrickPiUseTransport(ReplayTransport(frame))
+        report("BrickPiRx (no I/O)", measure(lambda: (BrickPiTx(BrickPi.Address[0], tx_bytes, Values_Array[0]),
+                                                       BrickPiRx(0.1)), count))
+        BrickPiUseTransport(emulated)
+
+        phases = dict((phase, []) for phase in ("encode", "tx", "wait", "rx", "decode"))
+        for i in range(count):
+            t0 = timer()
+            tx_bytes = BrickPiEncodeValues(0, Values_Array[0])
+            t1 = timer()
+            BrickPiTx(BrickPi.Address[0], tx_bytes, Values_Array[0])
+            t2 = timer()
+            BrickPiRxWait(monotonic() + 0.1)
+            t3 = timer()
+            result, BytesReceived, InArray = BrickPiRx(0.1)
+            t4 = timer()
+            BrickPiDecodeValues(0, InArray, BytesReceived)
+            t5 = timer()
+            for phase, start, end in (("encode", t0, t1), ("tx", t1, t2), ("wait", t2, t3),
+                                      ("rx", t3, t4), ("decode", t4, t5)):
+                phases[phase].append(end - start)
+        for phase in ("encode", "tx", "wait", "rx", "decode"):
+            report("round trip: " + phase, phases[phase])
+
+        failures = [0]
+        def update():
+            if BrickPiUpdateValues():
+                failures[0] += 1
+        report("BrickPiUpdateValues", measure(update, count))
+        if failures[0]:
+            print("  {} of {} updates failed".format(failures[0], count))
+    finally:
+        BrickPi.ser.close()
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the BrickPi protocol hot path")
+    parser.add_argument("--config", choices=sorted(CONFIGS) + ["all"], default="all",
+                        help="sensor configuration to benchmark")
+    parser.add_argument("--count", type=int, default=2000, help="iterations per benchmark")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="reply latency of the emulated firmware, in seconds")
+    args = parser.parse_args()
+
+    for name in sorted(CONFIGS) if args.config == "all" else [args.config]:
+        benchmark(name, args.count, args.latency)
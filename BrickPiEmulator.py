@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# BrickPiEmulator.py
+#
+# These files have been made available online through a Creative Commons Attribution-ShareAlike 3.0  license.
+# (http://creativecommons.org/licenses/by-sa/3.0/)
+#
+# Emulates the firmware of the two BrickPi microcontrollers on a Linux pseudo terminal,
+# so BrickPi.py can be run, tested and benchmarked without a BrickPi attached.
+#
+# Usage:
+#   from BrickPiEmulator import BrickPiEmulator
+#   emulator = BrickPiEmulator(latency=0.0005)
+#   emulator.start()
+#   BrickPiUseTransport(emulator.port)
+#   BrickPiSetup()
+#   ...
+#   emulator.stop()
+#
+# What is emulated:
+# - MSG_TYPE_CHANGE_ADDR, MSG_TYPE_SENSOR_TYPE, MSG_TYPE_VALUES, MSG_TYPE_E_STOP and MSG_TYPE_TIMEOUT_SETTINGS
+# - motors, whose encoders advance with the motor speed (ENCODER_COUNTS_PER_SECOND at full power)
+# - sensor values, set through emulator.Sensor[port] (and emulator.SensorArray[port] for TYPE_SENSOR_COLOR_FULL)
+# - I2C devices with a register file, attached with emulator.add_i2c_device(port, address)
+# - the motor timeout set by BrickPiSetTimeout
+#
+# Faults can be injected on the replies: latency (seconds before each reply), drop_rate (chance of
+# losing one byte of a reply) and corrupt_rate (chance of a bad checksum).
+
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+from BrickPi import *
+
+ENCODER_COUNTS_PER_SECOND = 2000    # encoder counts (half degrees) per second at power 255
+
+
+class EmulatedI2CDevice:
+    '''
+    An I2C device with a 256 byte register file
+
+    Writes set the register pointer (first byte) and store the remaining
+    bytes from there on; reads return bytes from the register pointer on.
+    '''
+    def __init__(self, registers=None):
+        self.registers = bytearray(256)
+        if registers:
+            for reg in registers:
+                self.set_register(reg, registers[reg])
+        self.pointer = 0
+
+    def set_register(self, reg, value):
+        '''
+        value is either a byte or a sequence of bytes stored from reg on
+        '''
+        if isinstance(value, int):
+            value = [value]
+        for i in range(len(value)):
+            self.registers[(reg + i) & 0xFF] = value[i] & 0xFF
+
+    def transfer(self, out_bytes, read_count):
+        if out_bytes:
+            self.pointer = out_bytes[0]
+            for b in out_bytes[1:]:
+                self.registers[self.pointer] = b
+                self.pointer = (self.pointer + 1) & 0xFF
+        data = [self.registers[(self.pointer + i) & 0xFF] for i in range(read_count)]
+        return data
+
+
+class _BitReader:
+    def __init__(self, data, byte_offset):
+        self.value = 0
+        for b in reversed(data[byte_offset:]):
+            self.value = (self.value << 8) | b
+        self.offset = 0
+
+    def get(self, bits):
+        result = (self.value >> self.offset) & ((1 << bits) - 1)
+        self.offset += bits
+        return result
+
+
+class _BitWriter:
+    def __init__(self):
+        self.value = 0
+        self.offset = 0
+
+    def add(self, bits, value):
+        self.value |= (int(value) & ((1 << bits) - 1)) << self.offset
+        self.offset += bits
+
+    def to_bytes(self):
+        return [(self.value >> (8 * i)) & 0xFF for i in range((self.offset + 7) // 8)]
+
+
+class _Chip:
+    def __init__(self, address):
+        self.address = address
+        self.sensor_type = [0, 0]
+        self.i2c_devices = [[], []]     # per port: list of [address, settings, write, read, out]
+        self.timeout = 0
+        self.last_values = time.time()
+
+
+class BrickPiEmulator:
+    '''
+    Firmware emulator for both BrickPi chips, served on a pseudo terminal
+
+    The name of the terminal to hand to BrickPiUseTransport() is in self.port.
+    All state is per BrickPi port (0-3), like in BrickPi.BrickPi.
+    '''
+    def __init__(self, latency=0.0, drop_rate=0.0, corrupt_rate=0.0, seed=None, addresses=(1, 2)):
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.random = random.Random(seed)
+
+        self.chips = [_Chip(addresses[0]), _Chip(addresses[1])]
+
+        self.Sensor = [0] * 4
+        self.SensorArray = [[0] * 4 for i in range(4)]
+        self.Encoder = [0.0] * 4
+        self.MotorSpeed = [0] * 4
+        self.MotorEnable = [0] * 4
+        self.i2c = [{} for i in range(4)]   # per port: 8 bit address -> EmulatedI2CDevice
+
+        self.frames = 0          # frames answered
+        self.dropped = 0         # replies with a dropped byte
+        self.corrupted = 0       # replies with a bad checksum
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._wake_r, self._wake_w = os.pipe()
+        self._running = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._motor_time = time.time()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="BrickPiEmulator")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        os.write(self._wake_w, b'x')
+        if self._thread is not None:
+            self._thread.join()
+        for fd in (self._master, self._slave, self._wake_r, self._wake_w):
+            os.close(fd)
+
+    def add_i2c_device(self, port, address, device=None):
+        '''
+        Attach an I2C device (an EmulatedI2CDevice unless given) at the 8 bit address on port
+
+        Returns the device
+        '''
+        if device is None:
+            device = EmulatedI2CDevice()
+        self.i2c[port][address] = device
+        return device
+
+    #################################################
+    # Serial side
+    #################################################
+    def _run(self):
+        pending = bytearray()
+        while self._running:
+            ready = select.select([self._master, self._wake_r], [], [])[0]
+            if self._master not in ready:
+                continue
+            try:
+                pending += bytearray(os.read(self._master, 4096))
+            except OSError:
+                # nobody has the terminal open
+                time.sleep(0.01)
+                continue
+            while len(pending) >= 3 and len(pending) >= pending[2] + 3:
+                count = pending[2]
+                dest, checksum = pending[0], pending[1]
+                message = pending[3:count + 3]
+                del pending[:count + 3]
+                if (dest + count + sum(message)) % 256 != checksum:
+                    # The firmware throws away messages that don't add up
+                    pending = bytearray()
+                    break
+                for chip in self.chips:
+                    if chip.address == dest:
+                        reply = self._handle(chip, message)
+                        if reply is not None:
+                            self._send(reply)
+
+    def _send(self, message):
+        frame = bytearray([(len(message) + sum(message)) % 256, len(message)]) + bytearray(message)
+        if self.corrupt_rate and self.random.random() < self.corrupt_rate:
+            frame[0] = (frame[0] + 1) % 256
+            self.corrupted += 1
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            del frame[self.random.randrange(len(frame))]
+            self.dropped += 1
+        if self.latency:
+            time.sleep(self.latency)
+        self.frames += 1
+        os.write(self._master, bytes(frame))
+
+    #################################################
+    # Firmware
+    #################################################
+    def _handle(self, chip, message):
+        if not message:
+            return None
+        msg_type = message[BYTE_MSG_TYPE]
+        with self._lock:
+            self._run_motors()
+            if msg_type == MSG_TYPE_CHANGE_ADDR:
+                chip.address = message[BYTE_NEW_ADDRESS]
+                return [MSG_TYPE_CHANGE_ADDR]
+            elif msg_type == MSG_TYPE_SENSOR_TYPE:
+                self._sensor_type(chip, message)
+                return [MSG_TYPE_SENSOR_TYPE]
+            elif msg_type == MSG_TYPE_TIMEOUT_SETTINGS:
+                chip.timeout = 0
+                for i in range(4):
+                    chip.timeout |= message[BYTE_TIMEOUT + i] << (8 * i)
+                chip.last_values = time.time()
+                return [MSG_TYPE_TIMEOUT_SETTINGS]
+            elif msg_type == MSG_TYPE_E_STOP:
+                for port in self._ports(chip):
+                    self.MotorEnable[port] = 0
+                return [MSG_TYPE_E_STOP]
+            elif msg_type == MSG_TYPE_VALUES:
+                return self._values(chip, message)
+        return None
+
+    def _ports(self, chip):
+        i = self.chips.index(chip)
+        return (i * 2, i * 2 + 1)
+
+    def _run_motors(self):
+        now = time.time()
+        dt = now - self._motor_time
+        self._motor_time = now
+        for i in range(2):
+            chip = self.chips[i]
+            if chip.timeout and (now - chip.last_values) * 1000 > chip.timeout:
+                for port in self._ports(chip):
+                    self.MotorEnable[port] = 0
+        for port in range(4):
+            if self.MotorEnable[port]:
+                self.Encoder[port] += self.MotorSpeed[port] * ENCODER_COUNTS_PER_SECOND / 255.0 * dt
+
+    def _sensor_type(self, chip, message):
+        bits = _BitReader(message, 3)
+        for ii in range(2):
+            sensor_type = message[BYTE_SENSOR_1_TYPE + ii]
+            chip.sensor_type[ii] = sensor_type
+            chip.i2c_devices[ii] = []
+            if sensor_type in (TYPE_SENSOR_I2C, TYPE_SENSOR_I2C_9V):
+                bits.get(8)     # I2C speed
+                for device in range(bits.get(3) + 1):
+                    address = bits.get(7) << 1
+                    settings = bits.get(2)
+                    write = read = 0
+                    out = []
+                    if settings & BIT_I2C_SAME:
+                        write = bits.get(4)
+                        read = bits.get(4)
+                        out = [bits.get(8) for b in range(write)]
+                    chip.i2c_devices[ii].append([address, settings, write, read, out])
+
+    def _values(self, chip, message):
+        chip.last_values = time.time()
+        ports = self._ports(chip)
+        bits = _BitReader(message, 1)
+        for port in ports:
+            if bits.get(1):
+                value = bits.get(bits.get(5))
+                offset = value >> 1
+                if value & 0x01:
+                    offset = -offset
+                self.Encoder[port] -= offset
+        for port in ports:
+            value = bits.get(10)
+            self.MotorEnable[port] = value & 0x01
+            self.MotorSpeed[port] = (value >> 2) * (-1 if value & 0x02 else 1)
+        for ii in range(2):
+            for device in chip.i2c_devices[ii]:
+                if not (device[1] & BIT_I2C_SAME):
+                    device[2] = bits.get(4)
+                    device[3] = bits.get(4)
+                    device[4] = [bits.get(8) for b in range(device[2])]
+
+        reply = _BitWriter()
+        encoders = []
+        for port in ports:
+            value = int(self.Encoder[port])
+            encoders.append(((-value) << 1) | 1 if value < 0 else value << 1)
+        for value in encoders:
+            reply.add(5, value.bit_length())
+        for value in encoders:
+            reply.add(value.bit_length(), value)
+        for ii in range(2):
+            self._sensor_value(reply, chip, ii, ports[ii])
+        return [MSG_TYPE_VALUES] + reply.to_bytes()
+
+    def _sensor_value(self, reply, chip, ii, port):
+        sensor_type = chip.sensor_type[ii]
+        if sensor_type in (TYPE_SENSOR_I2C, TYPE_SENSOR_I2C_9V):
+            success = 0
+            data = []
+            for index in range(len(chip.i2c_devices[ii])):
+                address, settings, write, read, out = chip.i2c_devices[ii][index]
+                device = self.i2c[port].get(address)
+                if device is not None:
+                    success |= 1 << index
+                    data.extend(device.transfer(out[:write], read))
+            reply.add(len(chip.i2c_devices[ii]), success)
+            for b in data:
+                reply.add(8, b)
+        elif sensor_type == TYPE_SENSOR_COLOR_FULL:
+            reply.add(3, self.Sensor[port])
+            for index in (INDEX_BLANK, INDEX_RED, INDEX_GREEN, INDEX_BLUE):
+                reply.add(10, self.SensorArray[port][index])
+        else:
+            reply.add(_value_bits(sensor_type), self.Sensor[port])
+
+
+def _value_bits(sensor_type):
+    if sensor_type in (TYPE_SENSOR_TOUCH, ):
+        return 1
+    elif sensor_type == TYPE_SENSOR_ULTRASONIC_SS:
+        return 8
+    elif sensor_type in (TYPE_SENSOR_EV3_COLOR_M2, TYPE_SENSOR_EV3_GYRO_M3, TYPE_SENSOR_EV3_INFRARED_M2):
+        return 32
+    elif TYPE_SENSOR_EV3_US_M0 <= sensor_type <= TYPE_SENSOR_EV3_INFRARED_M5:
+        return 16
+    return 10
+
+
+if __name__ == "__main__":
+    # Serve an emulated BrickPi until interrupted, e.g. for running the examples against it
+    emulator = BrickPiEmulator()
+    emulator.start()
+    print("Emulated BrickPi on " + emulator.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
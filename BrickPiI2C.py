@@ -0,0 +1,540 @@
+#!/usr/bin/env python
+# BrickPiI2C.py
+#
+# These files have been made available online through a Creative Commons Attribution-ShareAlike 3.0  license.
+# (http://creativecommons.org/licenses/by-sa/3.0/)
+#
+# Declarative drivers for I2C sensors, on top of the I2C transactions of BrickPi.py.
+#
+# A device is declared as its address, its registers (BrickPiI2CField: name,
+# register, struct format, scale and offset) and the writes that set it up.
+# The fields to read are grouped into bursts of contiguous registers, each
+# read with one transaction and decoded with one precompiled struct format.
+# All the bursts of a sample are queued together, and BrickPiSetupI2CDevices
+# gives each device a device slot for each of its bursts, so a whole sample
+# normally comes back with a single update.
+#
+# Usage:
+#   gyro = DexterIMUGyro(PORT_1)
+#   accel = DexterIMUAccel(PORT_1)
+#   BrickPiSetupI2CDevices([gyro, accel])   # both on one port, then their init writes
+#   BrickPiUpdateThread(rate=50).start()
+#   while True:
+#       rates, acceleration = [reading.result(1) for reading in BrickPiI2CReadDevices([gyro, accel])]
+#       print(rates["x"], acceleration["z"])
+#
+#   compass = DexterCompass(PORT_3)
+#   compass.setup()
+#   print(compass.sample())                 # {'x': ..., 'y': ..., 'z': ...}
+#
+# A new device only needs a class:
+#   class MyThermometer(BrickPiI2CDevice):
+#       ADDRESS = 0x90
+#       FIELDS = [BrickPiI2CField("temperature", 0x00, ">h", scale=1/256.0)]
+#
+# The analog Dexter sensors (dPress, dTemp) are TYPE_SENSOR_RAW sensors, not I2C devices.
+
+import re
+import struct
+import threading
+
+from BrickPi import *
+from BrickPi import monotonic
+
+MERGE_GAP = 3   # registers between two fields read along rather than starting another burst (what a burst costs)
+
+
+class BrickPiI2CField:
+    """
+    A value in the registers of an I2C device
+
+    fmt is the struct format of one value, byte order included (">h" is a
+    big endian signed 16 bit value), or "<u24", ">s24" and so on for the 24
+    bit integers struct has no code for. The value read is raw * scale + offset
+    """
+    def __init__(self, name, register, fmt, scale=None, offset=None):
+        self.name = name
+        self.register = register
+        self.fmt = fmt
+        self.scale = scale
+        self.offset = offset
+        match = re.match(r"([<>]?)([us])(\d+)$", fmt)
+        if match:
+            self.order = match.group(1) or ">"
+            self.code = None
+            self.signed = match.group(2) == "s"
+            self.size = int(match.group(3)) // 8
+        else:
+            self.order = fmt[0] if fmt[0] in "<>!=@" else ">"
+            self.code = fmt.lstrip("<>!=@")
+            self.signed = None
+            self.size = struct.calcsize(self.order + self.code)
+        self.end = register + self.size
+
+    def convert(self, raw):
+        if self.scale is not None:
+            raw = raw * self.scale
+        if self.offset is not None:
+            raw = raw + self.offset
+        return raw
+
+    def unpack_from(self, data, offset):
+        if self.code is not None:
+            return struct.unpack_from(self.order + self.code, data, offset)[0]
+        value = 0
+        raw = data[offset:offset + self.size]
+        for b in (raw if self.order != "<" else reversed(raw)):
+            value = (value << 8) | b
+        if self.signed and value >= 1 << (8 * self.size - 1):
+            value -= 1 << (8 * self.size)
+        return value
+
+    def pack(self, value):
+        if self.offset is not None:
+            value = value - self.offset
+        if self.scale is not None:
+            value = value / self.scale
+        if self.code is not None:
+            if self.code not in "efd":
+                value = int(round(value))
+            return bytearray(struct.pack(self.order + self.code, value))
+        value = int(round(value)) & ((1 << (8 * self.size)) - 1)
+        data = bytearray((value >> (8 * i)) & 0xFF for i in range(self.size))
+        if self.order != "<":
+            data.reverse()
+        return data
+
+
+class BrickPiI2CBurst:
+    """
+    A read of the contiguous registers register to register + size, decoding the fields in them
+    """
+    def __init__(self, register, size, fields):
+        self.register = register
+        self.size = size
+        self.fields = fields
+        self.names = [field.name for field in fields]
+        self.convert = [field.convert if (field.scale is not None or field.offset is not None) else None
+                        for field in fields]
+        # one struct format for the whole burst when the fields allow it, padding over the gaps
+        orders = set(field.order for field in fields if field.size > 1)
+        self.struct = None
+        if len(orders) <= 1 and all(field.code is not None for field in fields):
+            fmt = orders.pop() if orders else ">"
+            position = register
+            for field in fields:
+                if field.register < position:
+                    break   # overlapping fields
+                fmt += "x" * (field.register - position) + field.code
+                position = field.end
+            else:
+                self.struct = struct.Struct(fmt)
+
+    def decode(self, data, values):
+        if self.struct is not None:
+            raw = self.struct.unpack_from(data)
+        else:
+            raw = [field.unpack_from(data, field.register - self.register) for field in self.fields]
+        for name, convert, value in zip(self.names, self.convert, raw):
+            values[name] = convert(value) if convert is not None else value
+
+
+class BrickPiI2CReading:
+    """
+    Handle on the reads queued by BrickPiI2CDevice.read, with the interface of a BrickPiI2CTransaction
+
+    result() returns the values read, as a dict of field name to value, or None if a read failed
+    """
+    def __init__(self, device, bursts, transactions):
+        self.device = device
+        self.bursts = bursts
+        self.transactions = transactions
+        self.values = None
+
+    def done(self):
+        return all(transaction.done() for transaction in self.transactions)
+
+    def wait(self, timeout=None):
+        """
+        Block until every read has ended. Returns False if one still hasn't after timeout seconds
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        for transaction in self.transactions:
+            if not transaction.wait(None if deadline is None else max(0, deadline - monotonic())):
+                return False
+        return True
+
+    def result(self, timeout=None):
+        if not self.wait(timeout):
+            return None
+        if self.values is None:
+            values = {}
+            for burst, transaction in zip(self.bursts, self.transactions):
+                data = transaction.result()
+                if data is None:
+                    return None
+                burst.decode(data, values)
+            self.values = values
+        return self.values
+
+    def add_done_callback(self, callback):
+        """
+        Call callback(reading) once every read has ended. Runs on the updating thread
+        """
+        remaining = [len(self.transactions)]
+        lock = threading.Lock()
+
+        def ended(transaction):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                callback(self)
+        for transaction in self.transactions:
+            transaction.add_done_callback(ended)
+
+
+class BrickPiI2CDevice:
+    """
+    Base class of the I2C device drivers, see the top of this file
+
+    Class attributes:
+      ADDRESS     : the 8 bit I2C address
+      FIELDS      : the BrickPiI2CFields that can be read
+      INIT        : what to write when the device is set up, each a list of bytes (register first),
+                    or an (out, read) tuple for a write followed by a read
+      SETTINGS    : BIT_I2C_MID if the device needs it
+      SPEED       : the I2C bus delay it needs, see BrickPi.SensorI2CSpeed
+      SENSOR_TYPE : TYPE_SENSOR_I2C, or TYPE_SENSOR_I2C_9V for devices powered from pin 1
+      BURST       : or'ed into the register of reads of more than one byte, to make the device auto increment
+      CONTIGUOUS  : False for devices whose "registers" are commands, each read on its own
+    """
+    ADDRESS = None
+    FIELDS = ()
+    INIT = ()
+    SETTINGS = 0
+    SPEED = 0
+    SENSOR_TYPE = TYPE_SENSOR_I2C
+    BURST = 0
+    CONTIGUOUS = True
+
+    def __init__(self, port, brickpi=None, address=None):
+        self.port = port
+        self.brickpi = brickpi if brickpi is not None else BrickPi
+        self.address = address if address is not None else self.ADDRESS
+        self.fields = dict((field.name, field) for field in self.FIELDS)
+        self.init_transactions = []
+
+    @classmethod
+    def plan(cls, names=()):
+        """
+        The bursts that read the fields named (all of them if none are), compiled once per class
+        """
+        plans = cls.__dict__.get("_plans")
+        if plans is None:
+            plans = {}
+            setattr(cls, "_plans", plans)
+        key = tuple(sorted(names))
+        if key not in plans:
+            unknown = [name for name in key if name not in [field.name for field in cls.FIELDS]]
+            if unknown:
+                raise ValueError("{} has no field {}".format(cls.__name__, ", ".join(unknown)))
+            fields = [field for field in cls.FIELDS if not key or field.name in key]
+            fields.sort(key=lambda field: (field.register, field.end))
+            groups = []
+            for field in fields:
+                if groups and cls.CONTIGUOUS:
+                    start = groups[-1][0].register
+                    end = max(f.end for f in groups[-1])
+                    if field.register <= end + MERGE_GAP and max(end, field.end) - start <= I2C_MAX_BYTES:
+                        groups[-1].append(field)
+                        continue
+                groups.append([field])
+            plans[key] = [BrickPiI2CBurst(group[0].register, max(f.end for f in group) - group[0].register, group)
+                          for group in groups]
+        return plans[key]
+
+    def slots(self):
+        """
+        The device slots the device can use, one for each burst of a full sample
+        """
+        return max(1, min(8, len(self.plan())))
+
+    def transfers(self, names=()):
+        """
+        The (address, out, read) transfers that read the fields named, and their bursts
+        """
+        bursts = self.plan(names)
+        transfers = [(self.address, [burst.register | (self.BURST if burst.size > 1 else 0)], burst.size)
+                     for burst in bursts]
+        return transfers, bursts
+
+    def setup(self):
+        """
+        Set up the port for this device alone and queue its init writes, see BrickPiSetupI2CDevices
+        """
+        return BrickPiSetupI2CDevices([self])
+
+    def init(self):
+        """
+        Queue the INIT writes. Returns their BrickPiI2CTransactions
+        """
+        transfers = []
+        for entry in self.INIT:
+            out, read = entry if isinstance(entry, tuple) else (entry, 0)
+            transfers.append((self.address, list(out), read))
+        self.init_transactions = self.brickpi.I2CTransfers(self.port, transfers) if transfers else []
+        return self.init_transactions
+
+    def read(self, *names):
+        """
+        Queue the reads of the fields named (all of them if none are). Returns a BrickPiI2CReading
+        """
+        transfers, bursts = self.transfers(names)
+        return BrickPiI2CReading(self, bursts, self.brickpi.I2CTransfers(self.port, transfers))
+
+    def sample(self, *names, **options):
+        """
+        Read the fields named and wait for them, at most timeout (default 1) seconds
+
+        Returns a dict of field name to value, or None if the read failed or timed out.
+        An update thread must be running, or BrickPiUpdateValues() be called from another thread
+        """
+        return self.read(*names).result(options.get("timeout", 1.0))
+
+    def write(self, **values):
+        """
+        Queue writes of the fields given, one transaction for each run of contiguous registers
+
+        Returns the BrickPiI2CTransactions
+        """
+        fields = sorted((self.fields[name] for name in values), key=lambda field: field.register)
+        runs = []
+        for field in fields:
+            data = field.pack(values[field.name])
+            if runs and runs[-1][0] + len(runs[-1][1]) == field.register and len(runs[-1][1]) + len(data) < I2C_MAX_BYTES:
+                runs[-1][1].extend(data)
+            else:
+                runs.append((field.register, bytearray(data)))
+        transfers = [(self.address, [register] + list(data), 0) for register, data in runs]
+        return self.brickpi.I2CTransfers(self.port, transfers)
+
+
+def BrickPiSetupI2CDevices(devices):
+    """
+    Set up the ports of devices (BrickPiI2CDevices) for them and queue their init writes
+
+    Devices on the same port share it, each getting a device slot for each of
+    its bursts as long as the 8 slots of the port go round.  The port runs at
+    the slowest SPEED of its devices.  Changes to BrickPi.SensorType and the
+    I2C settings of other ports are sent along.
+
+    Returns 0 on success, -1 if the setup did not reach the BrickPi
+    """
+    brickpi = devices[0].brickpi
+    ports = {}
+    for device in devices:
+        ports.setdefault(device.port, []).append(device)
+    for port, on_port in ports.items():
+        if len(on_port) > 8:
+            raise ValueError("At most 8 I2C devices fit on port {}".format(port))
+        slots = [device.slots() for device in on_port]
+        while sum(slots) > 8:
+            slots[slots.index(max(slots))] -= 1
+        addresses, settings = [], []
+        for device, count in zip(on_port, slots):
+            addresses += [device.address] * count
+            settings += [device.SETTINGS] * count
+        sensor_type = TYPE_SENSOR_I2C_9V if any(device.SENSOR_TYPE == TYPE_SENSOR_I2C_9V for device in on_port) else TYPE_SENSOR_I2C
+        brickpi.SetupI2C(port, addresses, max(device.SPEED for device in on_port), settings, sensor_type)
+    result = brickpi.SetupSensors()
+    if result == 0:
+        for device in devices:
+            device.init()
+    return result
+
+
+def BrickPiI2CReadDevices(devices, *names):
+    """
+    Queue a read of the fields named (all of them if none are) on each of devices
+
+    The reads of devices on the same port are queued back to back, so they go
+    with the same update when their slots allow.
+    Returns a BrickPiI2CReading for each device
+    """
+    readings = [None] * len(devices)
+    ports = {}
+    for index in range(len(devices)):
+        ports.setdefault((id(devices[index].brickpi), devices[index].port), []).append(index)
+    for indexes in ports.values():
+        planned = []
+        transfers = []
+        for index in indexes:
+            device_transfers, bursts = devices[index].transfers(names)
+            planned.append((index, bursts, len(device_transfers)))
+            transfers += device_transfers
+        device = devices[indexes[0]]
+        transactions = device.brickpi.I2CTransfers(device.port, transfers)
+        for index, bursts, count in planned:
+            readings[index] = BrickPiI2CReading(devices[index], bursts, transactions[:count])
+            transactions = transactions[count:]
+    return readings
+
+
+#######################
+# Dexter Industries
+#######################
+
+class DexterGPS(BrickPiI2CDevice):
+    """
+    dGPS, each value is read with its own command. Latitude and longitude in degrees, velocity in cm/s
+    """
+    ADDRESS = 0x06
+    SETTINGS = BIT_I2C_MID
+    CONTIGUOUS = False
+    INIT = [([0x0D], 3)]    # switch to the extended firmware
+    FIELDS = [
+        BrickPiI2CField("utc", 0x00, ">I"),
+        BrickPiI2CField("status", 0x01, "B"),
+        BrickPiI2CField("latitude", 0x02, ">i", scale=0.000001),
+        BrickPiI2CField("longitude", 0x04, ">i", scale=0.000001),
+        BrickPiI2CField("velocity", 0x06, ">u24"),
+        BrickPiI2CField("heading", 0x07, ">H"),
+        BrickPiI2CField("distance", 0x08, ">I"),
+        BrickPiI2CField("angle_to_destination", 0x09, ">H"),
+        BrickPiI2CField("angle_travelled", 0x0A, ">H"),
+        BrickPiI2CField("altitude", 0x0E, ">I"),
+        BrickPiI2CField("hdop", 0x0F, ">I"),
+        BrickPiI2CField("satellites", 0x10, ">I"),
+    ]
+
+
+class DexterCompass(BrickPiI2CDevice):
+    """
+    dCompass (HMC5883L), raw field strength on each axis
+    """
+    ADDRESS = 0x3C
+    INIT = [[0x00, 0x70], [0x01, 0xA0], [0x02, 0x00]]    # 8 samples averaged at 15 Hz, gain 5, continuous
+    FIELDS = [
+        BrickPiI2CField("x", 0x03, ">h"),
+        BrickPiI2CField("z", 0x05, ">h"),
+        BrickPiI2CField("y", 0x07, ">h"),
+    ]
+
+
+class DexterIMUGyro(BrickPiI2CDevice):
+    """
+    The gyro of the dIMU (L3G4200D) at 500 degrees per second full scale, in degrees per second
+    """
+    ADDRESS = 0xD2
+    BURST = 0x80
+    INIT = [[0x21, 0x00], [0x22, 0x08], [0x23, 0x90], [0x24, 0x02], [0x20, 0x0F]]
+    FIELDS = [
+        BrickPiI2CField("y", 0x28, "<h", scale=1 / 57.142857),
+        BrickPiI2CField("x", 0x2A, "<h", scale=1 / 57.142857),
+        BrickPiI2CField("z", 0x2C, "<h", scale=1 / 57.142857),
+    ]
+
+
+class DexterIMUAccel(BrickPiI2CDevice):
+    """
+    The accelerometer of the dIMU (MMA7455) in its 2 g range, 8 bit values in g
+    """
+    ADDRESS = 0x3A
+    INIT = [[0x16, 0x05]]   # 2 g range, measurement mode
+    FIELDS = [
+        BrickPiI2CField("x", 0x06, "b", scale=1 / 64.0),
+        BrickPiI2CField("y", 0x07, "b", scale=1 / 64.0),
+        BrickPiI2CField("z", 0x08, "b", scale=1 / 64.0),
+    ]
+
+
+class DexterThermalIR(BrickPiI2CDevice):
+    """
+    dTIR, temperatures in degrees Celsius
+    """
+    ADDRESS = 0x0E
+    CONTIGUOUS = False
+    FIELDS = [
+        BrickPiI2CField("ambient", 0x00, "<H", scale=0.02, offset=-273.16),
+        BrickPiI2CField("object", 0x01, "<H", scale=0.02, offset=-273.16),
+        BrickPiI2CField("emissivity", 0x03, "<H"),
+    ]
+
+
+class DexterLight(BrickPiI2CDevice):
+    """
+    dLight, write red, green, blue and external (0-255) to set the LEDs
+    """
+    ADDRESS = 0x04          # 0x14, 0x24 and 0x34 for the second to fourth dLight, 0xE0 for all of them
+    INIT = [[0x80, 0x01, 0x25], [0x88, 0xAA]]     # auto increment, no blinking
+    FIELDS = [
+        BrickPiI2CField("red", 0x82, "B"),
+        BrickPiI2CField("green", 0x83, "B"),
+        BrickPiI2CField("blue", 0x84, "B"),
+        BrickPiI2CField("external", 0x85, "B"),
+        BrickPiI2CField("blink_duty", 0x86, "B"),
+        BrickPiI2CField("blink_frequency", 0x87, "B"),
+        BrickPiI2CField("led_output", 0x88, "B"),
+    ]
+
+
+#######################
+# MINDSENSORS
+#######################
+
+class MindsensorsAbsoluteIMU(BrickPiI2CDevice):
+    """
+    AbsoluteIMU-ACG in its 2 g and 250 degrees per second range
+
+    Acceleration in milli g, heading in degrees, gyro rates in degrees per second
+    """
+    ADDRESS = 0x22
+    INIT = [[0x41, 0x31]]   # AIMU_CMD_RANGE_2G_250
+    FIELDS = [
+        BrickPiI2CField("tilt_x", 0x42, "B"),
+        BrickPiI2CField("tilt_y", 0x43, "B"),
+        BrickPiI2CField("tilt_z", 0x44, "B"),
+        BrickPiI2CField("acc_x", 0x45, "<h"),
+        BrickPiI2CField("acc_y", 0x47, "<h"),
+        BrickPiI2CField("acc_z", 0x49, "<h"),
+        BrickPiI2CField("heading", 0x4B, "<H"),
+        BrickPiI2CField("mag_x", 0x4D, "<h"),
+        BrickPiI2CField("mag_y", 0x4F, "<h"),
+        BrickPiI2CField("mag_z", 0x51, "<h"),
+        BrickPiI2CField("gyro_x", 0x53, "<h", scale=0.00875),
+        BrickPiI2CField("gyro_y", 0x55, "<h", scale=0.00875),
+        BrickPiI2CField("gyro_z", 0x57, "<h", scale=0.00875),
+    ]
+
+
+class MindsensorsPSP(BrickPiI2CDevice):
+    """
+    PSP-Nx controller; buttons_1 and buttons_2 hold the buttons, 0 when pressed (see the button class)
+
+    Joysticks go from -127 to 127
+    """
+    ADDRESS = 0x02
+    SPEED = 1
+    FIELDS = [
+        BrickPiI2CField("buttons_1", 0x42, "B"),
+        BrickPiI2CField("buttons_2", 0x43, "B"),
+        BrickPiI2CField("left_x", 0x44, "B", offset=-128),
+        BrickPiI2CField("left_y", 0x45, "B", scale=-1, offset=128),
+        BrickPiI2CField("right_x", 0x46, "B", offset=-128),
+        BrickPiI2CField("right_y", 0x47, "B", scale=-1, offset=128),
+    ]
+
+
+#######################
+# LEGO
+#######################
+
+class LegoUltrasonic(BrickPiI2CDevice):
+    """
+    NXT ultrasonic sensor, distance in cm. Same setup as TYPE_SENSOR_ULTRASONIC_CONT
+    """
+    ADDRESS = LEGO_US_I2C_ADDR
+    SETTINGS = BIT_I2C_MID
+    SPEED = US_I2C_SPEED
+    FIELDS = [BrickPiI2CField("distance", LEGO_US_I2C_DATA_REG, "B")]
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# BrickPiMetrics.py
+#
+# These files have been made available online through a Creative Commons Attribution-ShareAlike 3.0  license.
+# (http://creativecommons.org/licenses/by-sa/3.0/)
+#
+# Exports the update loop's counters and the motor and sensor values in the
+# Prometheus text format, for scraping into fleet dashboards.
+#
+# Usage:
+#   updater = BrickPiUpdateThread(rate=20)
+#   metrics = BrickPiMetrics(updater)
+#   metrics.serve(9110)             # http://127.0.0.1:9110/metrics
+#   updater.start()
+#
+# In a Tornado server, a handler can return metrics.render() instead:
+#   class MetricsHandler(tornado.web.RequestHandler):
+#       def get(self):
+#           self.set_header("Content-Type", CONTENT_TYPE)
+#           self.write(metrics.render())
+#
+# Every metric is registered up front, with all its label values.  After each
+# update the update thread copies the values into them (see
+# BrickPiUpdateThread.add_listener), replacing whole values without taking a
+# lock.  A scrape only reads those copies, so it never touches the serial port
+# or waits for an update.
+
+import math
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:     # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from BrickPi import *
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+RATE_SMOOTHING = 0.05   # weight of the newest interval in the measured update rate and jitter
+
+MOTOR_PORTS = ("A", "B", "C", "D")
+SENSOR_PORTS = ("1", "2", "3", "4")
+CHIPS = ("1", "2")
+
+
+def format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    """
+    A counter or gauge, with one value for each combination of its label values
+    """
+    def __init__(self, name, kind, help, labels=(), values=((),)):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.keys = list(values)
+        self.samples = dict((key, 0) for key in self.keys)
+
+    def set(self, key, value):
+        self.samples[key] = value
+
+    def render(self, lines):
+        lines.append("# HELP {} {}".format(self.name, self.help))
+        lines.append("# TYPE {} {}".format(self.name, self.kind))
+        for key in self.keys:
+            lines.append("{}{} {}".format(self.name, format_labels(self.labels, key),
+                                          format_value(self.samples[key])))
+
+
+class HistogramMetric(Metric):
+    """
+    A histogram; each value is a (bucket counts, sum, count) tuple, the counts not cumulative
+    """
+    def __init__(self, name, help, bounds, labels=(), values=((),)):
+        Metric.__init__(self, name, "histogram", help, labels, values)
+        self.bounds = tuple(bounds) + (float('inf'),)
+        empty = ([0] * len(self.bounds), 0.0, 0)
+        self.samples = dict((key, empty) for key in self.keys)
+
+    def render(self, lines):
+        lines.append("# HELP {} {}".format(self.name, self.help))
+        lines.append("# TYPE {} {}".format(self.name, self.kind))
+        names = self.labels + ("le",)
+        for key in self.keys:
+            counts, total, count = self.samples[key]
+            cumulative = 0
+            for bound, bucket in zip(self.bounds, counts):
+                cumulative += bucket
+                lines.append("{}_bucket{} {}".format(self.name, format_labels(names, key + (format_value(bound),)),
+                                                     cumulative))
+            labels = format_labels(self.labels, key)
+            lines.append("{}_sum{} {}".format(self.name, labels, format_value(total)))
+            lines.append("{}_count{} {}".format(self.name, labels, count))
+
+
+class BrickPiMetrics:
+    """
+    Prometheus metrics of one BrickPiUpdateThread and the BrickPiDevice it updates
+    """
+    def __init__(self, updater):
+        self.updater = updater
+        self.brickpi = updater.brickpi
+        self.server = None
+        self._last_start = None
+        self._interval = None
+        self._variance = 0.0
+
+        chips = [(chip,) for chip in CHIPS]
+        motors = [(port,) for port in MOTOR_PORTS]
+        sensors = [(port,) for port in SENSOR_PORTS]
+        errors = [(chip, str(code)) for chip in CHIPS for code in RX_ERRORS]
+        self.metrics = [
+            Metric("brickpi_updates_total", "counter", "Updates run by the update thread"),
+            Metric("brickpi_update_failures_total", "counter", "Updates that failed or raised an exception"),
+            Metric("brickpi_update_overruns_total", "counter", "Updates that took longer than their period"),
+            Metric("brickpi_update_target_rate", "gauge", "Updates per second the update thread aims for"),
+            Metric("brickpi_update_rate", "gauge", "Measured updates per second"),
+            Metric("brickpi_update_jitter_seconds", "gauge", "Standard deviation of the update period"),
+            Metric("brickpi_transactions_total", "counter", "Messages sent to the chip", ("chip",), chips),
+            Metric("brickpi_retries_total", "counter", "Messages sent again after a bad or missing reply", ("chip",), chips),
+            Metric("brickpi_chip_failures_total", "counter", "Updates given up after the retries", ("chip",), chips),
+            Metric("brickpi_rx_errors_total", "counter", "Bad or missing replies by BrickPiRx error code (-2 is a timeout)",
+                   ("chip", "code"), errors),
+            Metric("brickpi_bytes_sent_total", "counter", "Bytes sent to the chip", ("chip",), chips),
+            Metric("brickpi_bytes_received_total", "counter", "Bytes received from the chip", ("chip",), chips),
+            HistogramMetric("brickpi_reply_latency_seconds", "Time from sending a message to its reply",
+                            LATENCY_BUCKETS, ("chip",), chips),
+            Metric("brickpi_motor_power", "gauge", "Motor power, -255 to 255", ("port",), motors),
+            Metric("brickpi_motor_enabled", "gauge", "1 if the motor is enabled", ("port",), motors),
+            Metric("brickpi_encoder", "gauge", "Encoder position, in half degrees", ("port",), motors),
+            Metric("brickpi_encoder_velocity", "gauge", "Motor speed, in degrees per second", ("port",), motors),
+            Metric("brickpi_sensor", "gauge", "Sensor value", ("port",), sensors),
+        ]
+        self.by_name = dict((metric.name, metric) for metric in self.metrics)
+        updater.add_listener(self.observe)
+
+    def observe(self, updater):
+        """
+        Copy the current values into the metrics. Called by the update thread after every update
+        """
+        metric = self.by_name
+        brickpi = self.brickpi
+        metric["brickpi_updates_total"].set((), updater.updates)
+        metric["brickpi_update_failures_total"].set((), updater.failures)
+        metric["brickpi_update_overruns_total"].set((), updater.overruns)
+        metric["brickpi_update_target_rate"].set((), updater.rate)
+
+        now = monotonic()
+        if self._last_start is not None and now > self._last_start:
+            interval = now - self._last_start
+            if self._interval is None:
+                self._interval = interval
+            deviation = interval - self._interval
+            self._interval += RATE_SMOOTHING * deviation
+            self._variance = (1 - RATE_SMOOTHING) * (self._variance + RATE_SMOOTHING * deviation * deviation)
+            metric["brickpi_update_rate"].set((), 1.0 / self._interval)
+            metric["brickpi_update_jitter_seconds"].set((), self._variance ** 0.5)
+        self._last_start = now
+
+        for chip, stats in zip(CHIPS, brickpi.Stats):
+            key = (chip,)
+            metric["brickpi_transactions_total"].set(key, stats.transactions)
+            metric["brickpi_retries_total"].set(key, stats.retries)
+            metric["brickpi_chip_failures_total"].set(key, stats.failures)
+            metric["brickpi_bytes_sent_total"].set(key, stats.bytes_sent)
+            metric["brickpi_bytes_received_total"].set(key, stats.bytes_received)
+            for code in RX_ERRORS:
+                metric["brickpi_rx_errors_total"].set((chip, str(code)), stats.errors[code])
+            latency = list(stats.latency)
+            metric["brickpi_reply_latency_seconds"].set(key, (latency, stats.latency_sum, sum(latency)))
+
+        for port, name in enumerate(MOTOR_PORTS):
+            key = (name,)
+            metric["brickpi_motor_power"].set(key, brickpi.MotorSpeed[port])
+            metric["brickpi_motor_enabled"].set(key, brickpi.MotorEnable[port])
+            metric["brickpi_encoder"].set(key, brickpi.Encoder[port])
+            metric["brickpi_encoder_velocity"].set(key, brickpi.EncoderVelocity[port])
+        for port, name in enumerate(SENSOR_PORTS):
+            metric["brickpi_sensor"].set((name,), brickpi.Sensor[port])
+
+    def render(self):
+        """
+        Returns all the metrics in the Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics:
+            metric.render(lines)
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9110, address="127.0.0.1"):
+        """
+        Serve the metrics at http://address:port/metrics from a background thread
+
+        Returns the HTTPServer
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer((address, port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, name="BrickPiMetrics")
+        thread.daemon = True
+        thread.start()
+        return self.server
+
+    def stop(self):
+        """
+        Stop serving and stop observing the update thread
+        """
+        self.updater.remove_listener(self.observe)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
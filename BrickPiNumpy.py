@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# BrickPiNumpy.py
+#
+# These files have been made available online through a Creative Commons Attribution-ShareAlike 3.0  license.
+# (http://creativecommons.org/licenses/by-sa/3.0/)
+#
+# Exports encoder and sensor timelines as columns of NumPy arrays, from the
+# sample history of a running BrickPi or straight from a captured trace.
+# Requires NumPy.
+#
+# Usage:
+#   columns = BrickPiColumns(BrickPiHistory)                # or a BrickPiDevice with history enabled
+#   columns = BrickPiColumns("/home/pi/brickpi.trace")      # a trace from BrickPiEnableCapture()
+#   print(columns["time_1"], columns["encoder_A"])
+#   BrickPiSaveColumns("run.npy", columns)                  # or "run.npz"
+#   run = BrickPiLoadColumns("run.npy")                     # memory mapped
+#   print(run["sensor_1"].mean())
+#
+# There is one row per update: a row holds the update number ("cycle"), the
+# monotonic() time each chip's reply came in ("time_1", "time_2") and the
+# encoders ("encoder_A" to "encoder_D"), sensor values ("sensor_1" to
+# "sensor_4"), sensor arrays ("sensor_array_1_0" to "sensor_array_4_3", see
+# INDEX_RED and friends) and, with i2c=True, the I2C input bytes
+# ("i2c_<port>_<device>_<byte>") decoded from those replies.  All the columns
+# are float64 except cycle; a value that wasn't known, or a chip that didn't
+# reply in that update, is NaN.
+#
+# A history is converted without a loop over its samples.  A trace is decoded
+# in bulk: the replies that share a sensor configuration are unpacked into one
+# bit matrix and every field is read for all of them at once.  Only I2C
+# devices without BIT_I2C_SAME, whose read counts can change with every
+# update, are decoded one reply at a time, by BrickPiReplay.
+
+from collections import OrderedDict
+
+import numpy as np
+
+from BrickPi import *
+from BrickPiReplay import BrickPiReplay
+
+MOTOR_NAMES = ("A", "B", "C", "D")
+SENSOR_NAMES = ("1", "2", "3", "4")
+NAN = float('nan')
+
+
+def column_names(i2c=False):
+    names = ["cycle", "time_1", "time_2"]
+    names += ["encoder_" + name for name in MOTOR_NAMES]
+    names += ["sensor_" + name for name in SENSOR_NAMES]
+    names += ["sensor_array_{}_{}".format(name, index) for name in SENSOR_NAMES for index in range(4)]
+    if i2c:
+        names += ["i2c_{}_{}_{}".format(name, device, in_byte)
+                  for name in SENSOR_NAMES for device in range(8) for in_byte in range(16)]
+    return names
+
+
+def empty_table(n, i2c):
+    """
+    The values of one chip's two ports for n replies
+    """
+    table = {
+        "cycle": np.zeros(n, np.int64),
+        "time": np.zeros(n),
+        "encoder": np.full((n, 2), NAN),
+        "sensor": np.full((n, 2), NAN),
+        "sensor_array": np.full((n, 2, 4), NAN),
+    }
+    if i2c:
+        table["i2c"] = np.full((n, 2, 8, 16), NAN)
+    return table
+
+
+def join_tables(tables, i2c):
+    if not tables:
+        return empty_table(0, i2c)
+    return dict((key, np.concatenate([table[key] for table in tables])) for key in tables[0])
+
+
+def align_tables(tables, i2c):
+    """
+    Merge the tables of the two chips into columns, one row per update
+    """
+    cycles = np.union1d(tables[0]["cycle"], tables[1]["cycle"]).astype(np.int64)
+    n = len(cycles)
+    columns = {"cycle": cycles}
+    for i, table in enumerate(tables):
+        rows = np.searchsorted(cycles, table["cycle"])
+
+        def column(values):
+            result = np.full(n, NAN)
+            result[rows] = values
+            return result
+
+        columns["time_{}".format(i + 1)] = column(table["time"])
+        for ii in range(2):
+            port = i*2 + ii
+            columns["encoder_" + MOTOR_NAMES[port]] = column(table["encoder"][:, ii])
+            columns["sensor_" + SENSOR_NAMES[port]] = column(table["sensor"][:, ii])
+            for index in range(4):
+                columns["sensor_array_{}_{}".format(SENSOR_NAMES[port], index)] = column(table["sensor_array"][:, ii, index])
+            if i2c:
+                for device in range(8):
+                    for in_byte in range(16):
+                        columns["i2c_{}_{}_{}".format(SENSOR_NAMES[port], device, in_byte)] = \
+                            column(table["i2c"][:, ii, device, in_byte])
+    return OrderedDict((name, columns[name]) for name in column_names(i2c))
+
+
+#######################
+# History
+#######################
+
+def history_tables(history, i2c):
+    tables = []
+    with history.lock:
+        for i in range(2):
+            first = history.Encoder[i*2]
+            n = len(first)
+            times, cycles, values = first._last(n)
+            table = empty_table(0, i2c)
+            table["time"] = np.frombuffer(times, np.float64).copy()
+            table["cycle"] = np.frombuffer(cycles, np.dtype(cycles.typecode)).astype(np.int64)
+            table["encoder"] = np.stack([np.frombuffer(history.Encoder[port]._last(n)[2], np.float64)
+                                         for port in (i*2, i*2 + 1)], axis=1)
+            table["sensor"] = np.stack([np.frombuffer(history.Sensor[port]._last(n)[2], np.float64)
+                                        for port in (i*2, i*2 + 1)], axis=1)
+            table["sensor_array"] = np.stack([np.frombuffer(history.SensorArray[port]._last(n)[2], np.float64).reshape(n, 4)
+                                              for port in (i*2, i*2 + 1)], axis=1)
+            if i2c:
+                if history.SensorI2CIn is None:
+                    table["i2c"] = np.full((n, 2, 8, 16), NAN)
+                else:
+                    table["i2c"] = np.stack([np.frombuffer(history.SensorI2CIn[port]._last(n)[2], np.float64).reshape(n, 8, 16)
+                                             for port in (i*2, i*2 + 1)], axis=1)
+            tables.append(table)
+    return tables
+
+
+#######################
+# Traces
+#######################
+
+class BitColumns:
+    """
+    Reads the same bit field from many messages at once
+
+    Each message has its own position, as fields before it may have had
+    different widths.
+    """
+    def __init__(self, messages):
+        n = len(messages)
+        lengths = np.array([len(message) for message in messages], np.int64)
+        width = int(lengths.max()) if n else 0
+        data = np.frombuffer(b"".join(bytes(message) for message in messages), np.uint8)
+        matrix = np.zeros((n, width), np.uint8)
+        starts = np.cumsum(lengths) - lengths
+        matrix[np.repeat(np.arange(n), lengths), np.arange(len(data)) - np.repeat(starts, lengths)] = data
+        # LSB first, like GetBits
+        self.bits = np.unpackbits(matrix, axis=1).reshape(n, width, 8)[:, :, ::-1].reshape(n, width * 8)
+        self.rows = np.arange(n)[:, None]
+        self.pos = np.full(n, 8, np.int64)  # after the message type
+        self.n = n
+
+    def take(self, width, present=None):
+        """
+        Read width bits (a number, or one for each message) from every message
+
+        With present, only the messages where it is 1 move on to the next field.
+        """
+        widest = int(np.max(width)) if np.size(width) and self.n else 0
+        if widest <= 0:
+            return np.zeros(self.n, np.int64)
+        offsets = np.arange(widest)
+        index = self.pos[:, None] + offsets
+        valid = index < self.bits.shape[1]     # past the end of a message GetBits reads zeros
+        if np.ndim(width):
+            valid &= offsets < width[:, None]
+        bits = np.where(valid, self.bits[self.rows, np.minimum(index, self.bits.shape[1] - 1)], 0)
+        values = (bits.astype(np.int64) << offsets).sum(axis=1)
+        self.pos += width if present is None else width * present
+        return values
+
+
+def carry_forward(values, present, initial):
+    """
+    values where present is set, else the last value before that (initial before the first)
+    """
+    last = np.where(present.astype(bool), np.arange(len(values)), -1)
+    np.maximum.accumulate(last, out=last)
+    return np.where(last >= 0, values[np.maximum(last, 0)], NAN if initial is None else initial)
+
+
+class BrickPiBulkDecoder(BrickPiReplay):
+    """
+    Decodes a trace into a table per chip, many replies at a time
+    """
+    def __init__(self, trace, i2c=False, sensor_types=None, addresses=(1, 2)):
+        BrickPiReplay.__init__(self, trace, sensor_types, addresses)
+        self.i2c = i2c
+        self.tables = [[], []]
+        self.segments = [self.new_segment(0), self.new_segment(1)]
+
+    def columns(self):
+        self.run()
+        for i in range(2):
+            self.close_segment(i)
+        return align_tables([join_tables(tables, self.i2c) for tables in self.tables], self.i2c)
+
+    def new_segment(self, i):
+        return {"layout": self.layout(i), "cycle": [], "time": [], "messages": [], "rows": []}
+
+    def layout(self, i):
+        """
+        Returns the fields each port of chip i decodes into, or None if they
+        change from one update to the next
+        """
+        brickpi = self.brickpi
+        layout = []
+        for port in (i*2, i*2 + 1):
+            decoder = SensorDecoder(brickpi.SensorType[port])
+            reads = None
+            if decoder is DecodeUltrasonicI2C:
+                if brickpi.SensorI2CDevices[port] != 1:
+                    return None
+                reads = [1]     # BrickPiEncodeSensorTypes always reads the one distance byte
+            elif decoder is DecodeI2C:
+                reads = []
+                for device in range(brickpi.SensorI2CDevices[port]):
+                    if not (brickpi.SensorSettings[port][device] & BIT_I2C_SAME):
+                        return None
+                    reads.append(brickpi.SensorI2CRead[port][device])
+            layout.append((port, decoder, reads))
+        return layout
+
+    def close_segment(self, i):
+        segment = self.segments[i]
+        if segment["layout"] is not None and segment["messages"]:
+            self.tables[i].append(self.decode_bulk(i, segment))
+        elif segment["rows"]:
+            self.tables[i].append(self.slow_table(segment))
+
+    def sensor_setup(self, i, message):
+        self.close_segment(i)
+        BrickPiReplay.sensor_setup(self, i, message)
+        self.segments[i] = self.new_segment(i)
+
+    def values_message(self, i, message):
+        if self.segments[i]["layout"] is None:
+            BrickPiReplay.values_message(self, i, message)
+
+    def decode(self, i, message, timestamp):
+        segment = self.segments[i]
+        segment["cycle"].append(self.brickpi.UpdateCycle)
+        segment["time"].append(timestamp)
+        if segment["layout"] is not None:
+            segment["messages"].append(bytes(message))
+            return
+        BrickPiReplay.decode(self, i, message, timestamp)
+        brickpi = self.brickpi
+        ports = (i*2, i*2 + 1)
+        segment["rows"].append((
+            [brickpi.Encoder[port] for port in ports],
+            [brickpi.Sensor[port] for port in ports],
+            [list(brickpi.SensorArray[port]) for port in ports],
+            [[list(device) for device in brickpi.SensorI2CIn[port]] for port in ports] if self.i2c else None,
+        ))
+
+    def slow_table(self, segment):
+        rows = segment["rows"]
+        table = empty_table(len(rows), self.i2c)
+        table["cycle"] = np.array(segment["cycle"], np.int64)
+        table["time"] = np.array(segment["time"], np.float64)
+        table["encoder"] = np.array([row[0] for row in rows], np.float64)
+        table["sensor"] = np.array([row[1] for row in rows], np.float64)
+        table["sensor_array"] = np.array([row[2] for row in rows], np.float64)
+        if self.i2c:
+            table["i2c"] = np.array([row[3] for row in rows], np.float64)
+        return table
+
+    def decode_bulk(self, i, segment):
+        """
+        Decode all the replies of a segment at once, like DecodeValues does one by one
+        """
+        brickpi = self.brickpi
+        messages = segment["messages"]
+        n = len(messages)
+        table = empty_table(n, self.i2c)
+        table["cycle"] = np.array(segment["cycle"], np.int64)
+        table["time"] = np.array(segment["time"], np.float64)
+        fields = BitColumns(messages)
+
+        used = [fields.take(5), fields.take(5)]
+        for ii in range(2):
+            value = fields.take(used[ii])
+            table["encoder"][:, ii] = np.where(value & 0x01, -(value // 2), value // 2)
+
+        for ii, (port, decoder, reads) in enumerate(segment["layout"]):
+            table["sensor_array"][:, ii] = [NAN if value is None else value for value in brickpi.SensorArray[port]]
+            i2c_in = np.array([[NAN if value is None else value for value in device]
+                               for device in brickpi.SensorI2CIn[port]], np.float64)
+            if decoder is DecodeColorFull:
+                table["sensor"][:, ii] = fields.take(3)
+                for index in (INDEX_BLANK, INDEX_RED, INDEX_GREEN, INDEX_BLUE):
+                    table["sensor_array"][:, ii, index] = fields.take(10)
+            elif decoder is DecodeGyro:
+                value = fields.take(16)
+                table["sensor"][:, ii] = np.where(value >= 32767, value - 65535, value)
+            elif decoder is DecodeInfraredRemote:
+                table["sensor"][:, ii] = fields.take(32)
+            elif reads is not None:     # DecodeI2C and DecodeUltrasonicI2C
+                mask = fields.take(len(reads))
+                in_bytes = np.empty((n, 8, 16))
+                in_bytes[:] = i2c_in
+                for device, count in enumerate(reads):
+                    present = (mask >> device) & 0x01
+                    for in_byte in range(count):
+                        value = fields.take(8, present).astype(np.float64)
+                        in_bytes[:, device, in_byte] = carry_forward(value, present, i2c_in[device, in_byte])
+                if decoder is DecodeUltrasonicI2C:
+                    table["sensor"][:, ii] = np.where(mask & (0x01 << US_I2C_IDX), in_bytes[:, US_I2C_IDX, 0], -1)
+                else:
+                    table["sensor"][:, ii] = mask
+                if self.i2c:
+                    table["i2c"][:, ii] = in_bytes
+                i2c_in = in_bytes[-1]
+            else:
+                table["sensor"][:, ii] = fields.take(decoder.bits)
+            if self.i2c and reads is None:
+                table["i2c"][:, ii] = i2c_in
+
+            # leave the device as DecodeValues would have, for the replies after this segment
+            brickpi.Encoder[port] = last(table["encoder"][-1, ii])
+            brickpi.Sensor[port] = last(table["sensor"][-1, ii])
+            brickpi.SensorArray[port][:] = [last(value) for value in table["sensor_array"][-1, ii]]
+            for device in range(8):
+                brickpi.SensorI2CIn[port][device][:] = [last(value) for value in i2c_in[device]]
+        return table
+
+
+def last(value):
+    return None if np.isnan(value) else int(value)
+
+
+def BrickPiColumns(source, i2c=False):
+    """
+    Returns the timeline of source as an OrderedDict of NumPy columns
+
+    source is a BrickPiHistoryStruct, a BrickPiDevice with history enabled,
+    or a trace (a file name or a list of records, see BrickPiReadTrace)
+    """
+    if isinstance(source, BrickPiDevice):
+        if source.History is None:
+            raise ValueError("History is not enabled on this BrickPiDevice")
+        source = source.History
+    if isinstance(source, BrickPiHistoryStruct):
+        return align_tables(history_tables(source, i2c), i2c)
+    return BrickPiBulkDecoder(source, i2c).columns()
+
+
+def BrickPiSaveColumns(path, columns):
+    """
+    Save columns to path
+
+    A .npz file holds one array per column. Any other name gets a single .npy
+    structured array, which BrickPiLoadColumns memory maps.
+    """
+    if path.endswith(".npz"):
+        np.savez(path, **columns)
+        return
+    table = np.empty(len(columns["cycle"]), [(name, column.dtype) for name, column in columns.items()])
+    for name, column in columns.items():
+        table[name] = column
+    np.save(path, table)
+
+
+def BrickPiLoadColumns(path):
+    """
+    Load columns saved by BrickPiSaveColumns; a .npy file is memory mapped, not read in
+    """
+    if path.endswith(".npz"):
+        return np.load(path)
+    try:
+        # with the I2C columns the header is longer than NumPy accepts by default
+        return np.load(path, mmap_mode='r', max_header_size=1 << 20)
+    except TypeError:   # NumPy before 1.24 has no limit
+        return np.load(path, mmap_mode='r')
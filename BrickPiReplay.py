@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# BrickPiReplay.py
+#
+# These files have been made available online through a Creative Commons Attribution-ShareAlike 3.0  license.
+# (http://creativecommons.org/licenses/by-sa/3.0/)
+#
+# Replays a trace captured with BrickPiEnableCapture() offline, without a BrickPi.
+#
+# The sent frames are read back the way the firmware reads them: MSG_TYPE_SENSOR_TYPE
+# messages give the sensor types and I2C settings, MSG_TYPE_VALUES messages the motor
+# settings and the per-update I2C transfers.  Each good MSG_TYPE_VALUES reply is then
+# decoded by BrickPiDevice.DecodeValues, the decoder BrickPiUpdateValues() uses, at the
+# time it was captured.  So the replay device goes through the same Sensor, Encoder
+# and SensorI2CIn states as the robot did, as fast as the decoder can go.
+#
+# Usage:
+#   replay = BrickPiReplay("/home/pi/brickpi.trace")
+#   for timestamp, chip in replay:
+#       print(timestamp, replay.brickpi.Encoder, replay.brickpi.Sensor)
+#
+#   history = BrickPiReplay("/home/pi/brickpi.trace").timeline()
+#   times, cycles, values = history.Sensor[PORT_1].last(len(history.Sensor[PORT_1]))
+#
+#   python BrickPiReplay.py brickpi.trace       # summary and frames decoded per second
+#
+# A TYPE_SENSOR_ULTRASONIC_CONT sensor is sent as the I2C device BrickPiSetupSensors()
+# turns it into; such a port is taken to be an ultrasonic sensor again. Pass
+# sensor_types to set the types of the ports explicitly instead.
+#
+# Every trace file starts with the sensor setup of each chip.  A trace from a
+# chip whose setup it doesn't have (captured before the setup was written into
+# each file) can only be replayed with sensor_types, otherwise BrickPiReplay
+# raises a ValueError rather than decode it with the wrong sensor types.
+
+import argparse
+import time
+
+from BrickPi import *
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class BrickPiReplay:
+    '''
+    Decodes the frames of a trace into a BrickPiDevice
+    '''
+    def __init__(self, trace, sensor_types=None, addresses=(1, 2)):
+        '''
+        trace is the name of a trace file or a sequence of (timestamp, kind, address, result, frame) records
+        '''
+        self.trace = trace
+        self.sensor_types = sensor_types
+        self.addresses = list(addresses)
+        self.brickpi = BrickPiDevice(None)
+        self.brickpi.Address = list(addresses)
+        self.setup = [False, False]     # whether the sensor setup of each chip is known
+        if sensor_types is not None:
+            self.assume_setup(sensor_types)
+        self.frames = 0         # replies decoded
+        self.errors = 0         # replies that came back bad or not at all
+        self.skipped = 0        # records that aren't replies to MSG_TYPE_VALUES or are from unknown chips
+        self._failed = [0, 0]   # bad replies in a row from each chip, BrickPiUpdateValues retries twice
+
+    def records(self):
+        if isinstance(self.trace, str):
+            return BrickPiReadTrace(self.trace)
+        return iter(self.trace)
+
+    def __iter__(self):
+        '''
+        Replay the trace, yielding (timestamp, chip) after each reply is decoded into brickpi
+        '''
+        brickpi = self.brickpi
+        sent = [None, None]     # message type of the last message to each chip
+        for timestamp, kind, address, result, frame in self.records():
+            if address not in self.addresses:
+                self.skipped += 1
+                continue
+            i = self.addresses.index(address)
+            if kind == TRACE_TX:
+                message = frame[3:]
+                if not message:
+                    continue
+                sent[i] = message[BYTE_MSG_TYPE]
+                if sent[i] == MSG_TYPE_SENSOR_TYPE:
+                    self.sensor_setup(i, message)
+                elif sent[i] == MSG_TYPE_VALUES:
+                    if i == 0 and not 0 < self._failed[0] < 3:
+                        brickpi.UpdateCycle += 1    # a new update rather than a retry
+                    if self._failed[i] >= 3:
+                        self._failed[i] = 0
+                    self.values_message(i, message)
+                continue
+            if result:
+                self.errors += 1
+                self._failed[i] += 1
+                continue
+            self._failed[i] = 0
+            message = frame[2:]
+            if sent[i] != MSG_TYPE_VALUES or not message or message[BYTE_MSG_TYPE] != MSG_TYPE_VALUES:
+                self.skipped += 1
+                continue
+            if not self.setup[i]:
+                raise ValueError("The trace has no sensor setup for the chip at address {} before its first reply, "
+                                 "pass sensor_types to replay it".format(address))
+            self.decode(i, message, timestamp)
+            self.frames += 1
+            yield timestamp, i
+
+    def run(self):
+        '''
+        Replay the whole trace. Returns the number of replies decoded
+        '''
+        for timestamp, chip in self:
+            pass
+        return self.frames
+
+    def timeline(self, i2c=False):
+        '''
+        Replay the whole trace into the history of brickpi, see BrickPiEnableHistory
+
+        The history is made large enough to keep every reply. Returns it
+        '''
+        replies = [0, 0]
+        for timestamp, kind, address, result, frame in self.records():
+            if kind == TRACE_RX and not result and address in self.addresses:
+                replies[self.addresses.index(address)] += 1
+        history = self.brickpi.EnableHistory(max(1, max(replies)), i2c)
+        self.run()
+        return history
+
+    def decode(self, i, message, timestamp):
+        '''
+        Decode the MSG_TYPE_VALUES reply message of chip i, received at timestamp
+        '''
+        self.brickpi.DecodeValues(i, message, len(message), timestamp)
+
+    def sensor_setup(self, i, message):
+        '''
+        Set the sensor types and I2C settings of chip i from a MSG_TYPE_SENSOR_TYPE message
+        '''
+        brickpi = self.brickpi
+        GetBits = brickpi.GetBits
+        brickpi.BitsLoad(message, len(message))
+        for ii in range(2):
+            port = i*2 + ii
+            sensor_type = message[BYTE_SENSOR_1_TYPE + ii]
+            brickpi.SensorType[port] = sensor_type
+            if sensor_type == TYPE_SENSOR_I2C or sensor_type == TYPE_SENSOR_I2C_9V:
+                brickpi.SensorI2CSpeed[port] = GetBits(3,0,8)
+                brickpi.SensorI2CDevices[port] = GetBits(3,0,3) + 1
+                for device in range(brickpi.SensorI2CDevices[port]):
+                    brickpi.SensorI2CAddr[port][device] = GetBits(3,0,7) << 1
+                    brickpi.SensorSettings[port][device] = GetBits(3,0,2)
+                    if brickpi.SensorSettings[port][device] & BIT_I2C_SAME:
+                        brickpi.SensorI2CWrite[port][device] = GetBits(3,0,4)
+                        brickpi.SensorI2CRead[port][device] = GetBits(3,0,4)
+                        for out_byte in range(brickpi.SensorI2CWrite[port][device]):
+                            brickpi.SensorI2COut[port][device][out_byte] = GetBits(3,0,8)
+                if self.ultrasonic(port):
+                    brickpi.SensorType[port] = TYPE_SENSOR_ULTRASONIC_CONT
+            if self.sensor_types is not None:
+                brickpi.SensorType[port] = self.sensor_types[port]
+        brickpi.CompileDecodePlan(i)
+        self.setup[i] = True
+
+    def assume_setup(self, sensor_types):
+        '''
+        Set the sensor types of the ports for a trace that may not have their setup
+
+        An ultrasonic sensor gets the I2C setup BrickPiSetupSensors() gives it;
+        a chip with another I2C sensor still needs its setup from the trace.
+        '''
+        brickpi = self.brickpi
+        brickpi.SensorType = list(sensor_types)
+        for port in range(4):
+            if sensor_types[port] == TYPE_SENSOR_ULTRASONIC_CONT:
+                brickpi.SensorI2CDevices[port] = 1
+                brickpi.SensorSettings[port][US_I2C_IDX] = 0
+        for i in range(2):
+            brickpi.CompileDecodePlan(i)
+            self.setup[i] = all(sensor_types[port] not in (TYPE_SENSOR_I2C, TYPE_SENSOR_I2C_9V) for port in (i*2, i*2 + 1))
+
+    def ultrasonic(self, port):
+        # the I2C setup BrickPiEncodeSensorTypes sends for TYPE_SENSOR_ULTRASONIC_CONT
+        brickpi = self.brickpi
+        return (brickpi.SensorI2CDevices[port] == 1 and
+                brickpi.SensorI2CSpeed[port] == US_I2C_SPEED and
+                brickpi.SensorI2CAddr[port][US_I2C_IDX] == LEGO_US_I2C_ADDR)
+
+    def values_message(self, i, message):
+        '''
+        Set the motor settings and I2C transfers of chip i from a MSG_TYPE_VALUES message
+        '''
+        brickpi = self.brickpi
+        GetBits = brickpi.GetBits
+        brickpi.BitsLoad(message, len(message))
+        for ii in range(2):
+            if GetBits(1,0,1):
+                GetBits(1,0, GetBits(1,0,5))   # encoder offset
+        for ii in range(2):
+            port = i*2 + ii
+            motor = GetBits(1,0,10)
+            speed = (motor >> 2) & 0xFF
+            brickpi.MotorSpeed[port] = -speed if motor & 0x02 else speed
+            brickpi.MotorEnable[port] = motor & 0x01
+        for ii in range(2):
+            port = i*2 + ii
+            if brickpi.SensorType[port] in (TYPE_SENSOR_I2C, TYPE_SENSOR_I2C_9V, TYPE_SENSOR_ULTRASONIC_CONT):
+                for device in range(brickpi.SensorI2CDevices[port]):
+                    if not (brickpi.SensorSettings[port][device] & BIT_I2C_SAME):
+                        brickpi.SensorI2CWrite[port][device] = GetBits(1,0,4)
+                        brickpi.SensorI2CRead[port][device] = GetBits(1,0,4)
+                        for out_byte in range(brickpi.SensorI2CWrite[port][device]):
+                            brickpi.SensorI2COut[port][device][out_byte] = GetBits(1,0,8)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a BrickPi trace and measure the decoding rate")
+    parser.add_argument("trace", help="trace file written by BrickPiEnableCapture()")
+    args = parser.parse_args()
+
+    records = list(BrickPiReadTrace(args.trace))    # read up front so only decoding is timed
+    replay = BrickPiReplay(records)
+    start = timer()
+    replay.run()
+    elapsed = timer() - start
+    brickpi = replay.brickpi
+
+    if records:
+        print("{} records over {:.1f} s".format(len(records), records[-1][0] - records[0][0]))
+    print("{} replies decoded, {} bad or missing, {} skipped".format(replay.frames, replay.errors, replay.skipped))
+    print("{} updates, sensor types {}".format(brickpi.UpdateCycle, brickpi.SensorType))
+    print("last Encoder {} Sensor {}".format(brickpi.Encoder, brickpi.Sensor))
+    if elapsed > 0:
+        print("{:.0f} frames decoded per second".format(replay.frames / elapsed))
@@ -1,5 +1,4 @@
 import time
-from threading import Thread
 from BrickPi import *
 
 def debug(in_str):
@@ -24,29 +23,16 @@ class BrickPiSensor():
     #################################################
     # Threading class
     #################################################
-    class BrickPiThread(Thread):
+    class BrickPiThread(BrickPiUpdateThread):
         '''
-        Run one Thread that keeps updating the sensors
+        Run one Thread that keeps updating the sensors, 5 times a second
         '''
         def __init__(self, threadID, name, counter):
-            Thread.__init__(self)
+            BrickPiUpdateThread.__init__(self, rate=5, name=name)
             debug("getting thread started")
             self.threadID = threadID
-            self.name = name
             self.counter = counter
 
-        def run(self):
-            debug ("starting run")
-            while True:
-                if self.threading_is_needed:
-                    try:
-                        BrickPiUpdateValues()       # Ask BrickPi to update values for sensors/motors
-                        time.sleep(.2)              # sleep for 200 ms
-                    except:
-                        pass
-                else:
-                    debug("suspended")
-
         # def __enter__(self):
         #     return self
 
@@ -54,20 +40,9 @@ class BrickPiSensor():
         #     BrickPiUpdateValues()
 
     sensor_type = ["NXT","EV3"]
-    start_thread = False
-    threading_is_needed = True
-
-    if start_thread is False:
-        debug("starting thread")
-        update_thread = BrickPiThread(1, "SensorThread",1)
-        # let's assume that we run the updating thread by default
-        update_thread.threading_is_needed = True
 
-        # and let's start the thread now!
-        update_thread.setDaemon(True)
-        update_thread.start()
-        # only one thread is needed.
-        start_thread = True
+    # only one thread is needed, the first sensor starts it once the port is open
+    update_thread = BrickPiThread(1, "SensorThread",1)
 
     def __init__(self,in_type,in_port):
         """
@@ -85,6 +60,9 @@ class BrickPiSensor():
         raises a ValueError if in_port is not between 0 and 3
         """
         BrickPiSetup()
+        if BrickPi.ser is not None and BrickPi.ser.isOpen() and self.update_thread.ident is None:
+            debug("starting thread")
+            self.update_thread.start()
 
         self.descriptor = "unknown sensor"
 
@@ -110,22 +88,30 @@ class BrickPiSensor():
         return str(self.type)+" "+self.descriptor+" sensor on "+str(self.port+1)
 
     def suspend_updates(self):
-        self.update_thread.threading_is_needed  = False
+        '''
+        pauses the updating thread, once the update in progress is done
+        '''
+        self.update_thread.pause()
         debug("suspend udpates")
 
     def restart_updates(self):
-        self.update_thread.threading_is_needed = True
+        '''
+        resumes the updating thread, the next update is sent right away
+        '''
+        self.update_thread.resume()
         debug("restart updates")
 
     def set_mode(self,in_mode):
         '''
         NOTA: set_mode makes a call to BrickPiSetupSensors() which may have 
-        a long delay (up to 5 seconds)
+        a long delay (up to 5 seconds) when the mode changes
         DO NOT ABUSE
         '''
         self.mode = in_mode
-        BrickPi.SensorType[self.port] = in_mode
-        BrickPiSetupSensors()
+        # keep the updating thread off the serial port during the setup
+        with self.update_thread.changes():
+            BrickPi.SensorType[self.port] = in_mode
+            BrickPiSetupSensors()
 
 #################################################
 # BrickPiMotor
@@ -200,7 +186,8 @@ class BrickPiMotor(BrickPiSensor):
     def stop(self,coast=False):
         BrickPi.MotorSpeed[self.port]=0
         if coast is False:
-            BrickPiUpdateValues()
+            with self.update_thread.changes():
+                BrickPiUpdateValues()
 
     def coast(self):
         self.stop(coast=True)
@@ -231,11 +218,10 @@ class BrickPiMotors():
         in_stop = what kind of stopping is requested, 
                   True is hard stop, False is coasting
         '''
-        self.motors[0].suspend_updates()
-        time.sleep(1)
-        for i in range(len(self.motors)):
-            self.motors[i].go_forward()
-        self.motors[0].restart_updates()
+        # all motors start in the same update
+        with BrickPiSensor.update_thread.changes():
+            for i in range(len(self.motors)):
+                self.motors[i].go_forward()
         if in_secs > 0:
             time.sleep(in_secs)
             debug ("done with sleep")
@@ -249,10 +235,11 @@ class BrickPiMotors():
         in_stop = what kind of stopping is requested, 
                   True is hard stop, False is coasting
         '''
-        for i in range(len(self.motors)):
-            self.motors[i].go_backward()
+        with BrickPiSensor.update_thread.changes():
+            for i in range(len(self.motors)):
+                self.motors[i].go_backward()
         if in_secs > 0:
-            time.sleep(secs)
+            time.sleep(in_secs)
         self.stop(in_coast)
 
     def stop(self,in_coast=False):
@@ -331,7 +318,8 @@ class BrickPiColorSensor(BrickPiSensor):
 
     def __exit__(self,exc_type,exc_value,traceback):
         self.set_mode(TYPE_SENSOR_COLOR_NONE)
-        BrickPiUpdateValues()
+        with self.update_thread.changes():
+            BrickPiUpdateValues()
 
     def read():
         '''
@@ -430,8 +418,22 @@ class BrickPiColorSensor(BrickPiSensor):
         else:
             raise ValueError("Not an NXT color sensor")
 
-    def wait_for_color(self,color):
-        pass
+    def wait_for_color(self,color,timeout=None):
+        """
+        Blocks until the sensor sees color
+
+        args:
+        color: a name from colors ("Red", "Blue"...) or its index
+        timeout: (optional) how long to wait, in seconds
+
+        returns True once the color is seen, False after timeout seconds
+
+        usage:
+        the sensor must be in color mode (see set_color_mode)
+        """
+        if color in self.colors:
+            color = self.colors.index(color)
+        return BrickPiWaitFor(self.port, lambda value: value == color, timeout) is not None
 
 
 
@@ -12,6 +12,7 @@
 #You may use this code as you wish, provided you give credit where it's due.
 # Requires the Raspberry Pi Camera to be attached and enabled.
 # The touch should be connected on Port 2 of the BrickPi.
+# Uses the installed BrickPi module (see the README), which has the update thread and events.
 ###################################################################################
 import time
 from subprocess import call
@@ -25,7 +26,6 @@ BrickPiSetup()
 BrickPi.SensorType[PORT_2] = TYPE_SENSOR_EV3_TOUCH_0  	#Set the type of sensor at PORT_4.  M0 is proximity, 0 to 100. 
 BrickPiSetupSensors()   								#Send the properties of sensors to BrickPi.  Set up the BrickPi.
 
-t=.5
 picture_number = 0										# Lets us take multiple pictures.
 
 def take_picture():
@@ -36,14 +36,11 @@ def take_picture():
 	call (call_string, shell=True)
 	print "Image taken"
 
+BrickPiUpdateThread(rate=20).start()					# Ask BrickPi to update values for sensors/motors every 50 ms
+pressed = BrickPiOnPress(PORT_2)						# Wakes up as soon as an update sees the button pressed (reads over 1000)
+
 while True:
 	print "RUN"
-	result = BrickPiUpdateValues()  # Ask BrickPi to update values for sensors/motors 
-	if not result :
-		button_value = BrickPi.Sensor[PORT_2]
-		if button_value > 1000:
-			print "Button reads: "+str(button_value)
-			take_picture()
-		
-	time.sleep(t)     # sleep for 10 ms
-
+	pressed.wait()
+	print "Button reads: "+str(pressed.value)
+	take_picture()
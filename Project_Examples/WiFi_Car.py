@@ -20,7 +20,6 @@
 
 
 from BrickPi import *   #import BrickPi.py file to use BrickPi operations
-import threading
 
 BrickPiSetup()  # setup the serial port for communication
 
@@ -31,25 +30,15 @@ BrickPi.SensorType[PORT_4] = TYPE_SENSOR_ULTRASONIC_CONT	#Setting the type of se
 
 BrickPiSetupSensors()   #Send the properties of sensors to BrickPi
 
-running = True
-
-class myThread (threading.Thread):		#This thread is used for keeping the motor running while the main thread waits for user input
-    def __init__(self, threadID, name, counter):
-        threading.Thread.__init__(self)
-        self.threadID = threadID
-        self.name = name
-        self.counter = counter
-    def run(self):
-        while running:
-            if BrickPi.Sensor[PORT_4] < 20 :		#Lesser value means more close
-                print "Car Stopped due to very close object"
-                BrickPi.MotorSpeed[PORT_A] = 0		# Set Speed=0 which means stop
-                BrickPi.MotorSpeed[PORT_D] = 0
-            BrickPiUpdateValues()       # Ask BrickPi to update values for sensors/motors
-            time.sleep(.2)              # sleep for 200 ms
+class myThread (BrickPiUpdateThread):		#This thread is used for keeping the motor running while the main thread waits for user input
+    def update(self):
+        if BrickPi.Sensor[PORT_4] < 20 :		#Lesser value means more close
+            print "Car Stopped due to very close object"
+            BrickPi.MotorSpeed[PORT_A] = 0		# Set Speed=0 which means stop
+            BrickPi.MotorSpeed[PORT_D] = 0
+        return BrickPiUpdateValues()       # Ask BrickPi to update values for sensors/motors
 
-thread1 = myThread(1, "Thread-1", 1)		#Setup and start the thread
-thread1.setDaemon(True)
+thread1 = myThread(rate=5)		#Setup and start the thread, updating every 200 ms
 thread1.start()  
 
 while True:
@@ -76,6 +65,6 @@ while True:
             BrickPi.MotorSpeed[PORT_A] = 0	#Stop the motor
             BrickPi.MotorSpeed[PORT_D] = 0
     except KeyboardInterrupt:			#Triggered by pressing Ctrl+C
-        running = False				#Stop theread1
+        thread1.stop()				#Stop theread1
         print "Bye"
         break					#Exit
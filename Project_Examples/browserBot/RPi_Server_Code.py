@@ -36,7 +36,6 @@
 #	If the error does not go away, try changin the port number '9093' both in the client and server code
 
 from BrickPi import *   #import BrickPi.py file to use BrickPi operations
-import threading
 import tornado.ioloop
 import tornado.web
 import tornado.websocket
@@ -100,26 +99,17 @@ application = tornado.web.Application([
   (r"/(.*)", tornado.web.StaticFileHandler, {"path": "./resources"}),
 ])
 
-class myThread (threading.Thread):
-    def __init__(self, threadID, name, counter):
-        threading.Thread.__init__(self)
-        self.threadID = threadID
-        self.name = name
-        self.counter = counter
+class myThread (BrickPiUpdateThread):
     def run(self):
         print "Ready"
-        while running:
-            BrickPiUpdateValues()       # Ask BrickPi to update values for sensors/motors
-            time.sleep(.2)              # sleep for 200 ms
+        BrickPiUpdateThread.run(self)       # Ask BrickPi to update values for sensors/motors every 200 ms
 
 if __name__ == "__main__":
 	BrickPiSetup()  						# setup the serial port for communication
 	BrickPi.MotorEnable[PORT_A] = 1 		#Enable the Motor A
 	BrickPi.MotorEnable[PORT_D] = 1 		#Enable the Motor D
 	BrickPiSetupSensors()   				#Send the properties of sensors to BrickPi
-	running = True
-	thread1 = myThread(1, "Thread-1", 1)
-	thread1.setDaemon(True)
+	thread1 = myThread(rate=5)
 	thread1.start()  
 	application.listen(9093)          	#starts the websockets connection
 	tornado.ioloop.IOLoop.instance().start()
@@ -23,19 +23,27 @@ angle=360 for the motor connected at Port A
 power=[255]
 deg=[360]
 port=[PORT_A]
-motorRotateDegree(power,deg,port)		#This read the encoder values every 100 ms (default). Not that accurate but not very processor intensive
-#motorRotateDegree(power,deg,port,.05)	#This read the encoder values every 50 ms. A little more accurate 
-#motorRotateDegree(power,deg,port,0)	#This read the encoder values without any delay. Most accurate but take a lot of processing power
-#motorRotateDegree(power,deg,port,0,.04)	#This read the encoder values without any delay. The time to rotate the motors in the opposite direction when stopping is specified in the last argument. Useful when free running the motors
+motorRotateDegree(power,deg,port)		#A position controller runs on every update, 100 times a second (default)
+#motorRotateDegree(power,deg,port,.02)	#Updates every 20 ms. Less processing power, a little less accurate
 
 """
 If multiple motors have to be controlled then the parameters for running each motor must be passed
 as the elements of an array,e.g, motorRotateDegree([255,100],[360,30],[PORT_A,PORT_B]) where 
 power=255 and angle=30 are for motor at PORT_A and power=100 and angle=30 are for motor at PORT_B.
-It can be used similarly for any number of motors.
+It can be used similarly for any number of motors. The motors finish their rotation together.
 """
 time.sleep(1)
 power=[255,30]
 deg=[360,-180]
 port=[PORT_A,PORT_B]
 motorRotateDegree(power,deg,port)
+
+"""
+BrickPiRotate starts the same kind of move without waiting for it. The update thread
+carries it out, and the returned move can be waited for later.
+"""
+time.sleep(1)
+BrickPiUpdateThread(rate=100).start()
+move=BrickPiRotate([PORT_A,PORT_B],[-360,180],power=[255,30])
+move.wait()
+print("Move " + move.status + ", motors at " + str(move.result()))
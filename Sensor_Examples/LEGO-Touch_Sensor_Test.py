@@ -3,7 +3,7 @@
 ############################################
 # This example will show you how to use the LEGO touch sensor with the BrickPi.  
 # The Touch sensor is attached to Port 4.
-# When the touch sensor is pressed, the output should read "1"
+# When the touch sensor is pressed, the output should read "1", and "0" when it is released
 # 
 # Original Author: Jaikrishna
 # Initial Date: June 24, 2013
@@ -21,9 +21,9 @@ BrickPi.SensorType[PORT_4] = TYPE_SENSOR_TOUCH   #Set the type of sensor at PORT
 
 BrickPiSetupSensors()   #Send the properties of sensors to BrickPi
 
-while True:
-    result = BrickPiUpdateValues()  # Ask BrickPi to update values for sensors/motors 
-    if not result :
-        print BrickPi.Sensor[PORT_4]     #BrickPi.Sensor[PORT] stores the value obtained from sensor
-    time.sleep(.01)     # sleep for 10 ms
+BrickPiUpdateThread(rate=100).start()  # Ask BrickPi to update values for sensors/motors every 10 ms
 
+changed = BrickPiOnChange(PORT_4)    # Wakes up as soon as an update sees a new value
+while True:
+    changed.wait()
+    print changed.value     #BrickPi.Sensor[PORT] stores the value obtained from sensor
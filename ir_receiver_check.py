@@ -5,32 +5,32 @@ def send_command(bashCommand):
 	output = process.communicate()[0]
 	return output
 	
+# The lines that give the IR receiver the pins of the BrickPi's serial port
+IR_LINES = [('/etc/modules', 'lirc_dev'),
+	('/etc/modules', 'lirc_rpi gpio_in_pin=15'),
+	('/etc/modules', 'lirc_rpi gpio_in_pin=14'),
+	('/boot/config.txt', 'dtoverlay=lirc-rpi,gpio_in_pin=14'),
+	('/boot/config.txt', 'dtoverlay=lirc-rpi,gpio_in_pin=15')]
+
+file_cache = {}
+
+def read_file(filename):
+	# Each file is read once; a file that doesn't exist reads as empty
+	if filename not in file_cache:
+		try:
+			with open(filename) as f:
+				file_cache[filename] = f.read()
+		except IOError:
+			file_cache[filename] = ''
+	return file_cache[filename]
+
 def check_ir():
 	flag=0
-	if 'lirc_dev' in open('/etc/modules').read():
-		flag=1
-		if debug:
-			print "lirc_dev in /etc/modules"
-	
-	if 'lirc_rpi gpio_in_pin=15' in open('/etc/modules').read():
-		flag=1
-		if debug:
-			print "lirc_rpi gpio_in_pin=15 in /etc/modules"
-			
-	if 'lirc_rpi gpio_in_pin=14' in open('/etc/modules').read():
-		flag=1
-		if debug:
-			print "lirc_rpi gpio_in_pin=14 in /etc/modules"
-		
-	if 'dtoverlay=lirc-rpi,gpio_in_pin=14' in open('/boot/config.txt').read():
-		flag=1
-		if debug:
-			print "dtoverlay=lirc-rpi,gpio_in_pin=14 in /boot/config.txt"
-			
-	if 'dtoverlay=lirc-rpi,gpio_in_pin=15' in open('/boot/config.txt').read():
-		flag=1
-		if debug:
-			print "dtoverlay=lirc-rpi,gpio_in_pin=15 in /boot/config.txt"
+	for filename, line in IR_LINES:
+		if line in read_file(filename):
+			flag=1
+			if debug:
+				print(line + " in " + filename)
 			
 	if flag:
 		return True
@@ -46,11 +46,12 @@ def replace_in_file(filename,replace_from,replace_to):
 	f = open(filename,'w')
 	f.write(newdata)
 	f.close()
+	file_cache.pop(filename, None)
 		
 def disable_ir():
 	if check_ir()==True:
 		if debug:
-			print "Disabling IR"
+			print("Disabling IR")
 		replace_in_file('/etc/modules',"lirc_dev","")
 		replace_in_file('/etc/modules',"lirc_rpi gpio_in_pin=15","")
 		replace_in_file('/etc/modules',"lirc_rpi gpio_in_pin=14","")
@@ -58,41 +59,42 @@ def disable_ir():
 		replace_in_file('/boot/config.txt',"dtoverlay=lirc-rpi,gpio_in_pin=15","")
 	else:
 		if debug:
-			print "IR already disabled"
+			print("IR already disabled")
 
 def enable_ir():
 	if 'lirc_dev' in open('/etc/modules').read():
 		if debug:
-			print "lirc_dev already in /etc/modules"
+			print("lirc_dev already in /etc/modules")
 	else:
 		if debug:
-			print "lirc_dev added"
+			print("lirc_dev added")
 			
 		with open('/etc/modules', 'a') as file:
 			file.write('lirc_dev\n')
 			
 	if 'lirc_rpi gpio_in_pin=15' in open('/etc/modules').read():
 		if debug:
-			print "lirc_rpi gpio_in_pin=15 already in /etc/modules"
+			print("lirc_rpi gpio_in_pin=15 already in /etc/modules")
 	else:
 		if debug:
-			print "lirc_rpi gpio_in_pin=15 added"
+			print("lirc_rpi gpio_in_pin=15 added")
 			
 		with open('/etc/modules', 'a') as file:
 			file.write('lirc_rpi gpio_in_pin=15\n')
 	
 	if 'dtoverlay=lirc-rpi,gpio_in_pin=15' in open('/boot/config.txt').read():
 		if debug:
-			print "dtoverlay=lirc-rpi,gpio_in_pin=15 already in /boot/config.txt"
+			print("dtoverlay=lirc-rpi,gpio_in_pin=15 already in /boot/config.txt")
 	else:
 		if debug:
-			print "dtoverlay=lirc-rpi,gpio_in_pin=15 added"
+			print("dtoverlay=lirc-rpi,gpio_in_pin=15 added")
 			
 		with open('/boot/config.txt', 'a') as file:
 			file.write('dtoverlay=lirc-rpi,gpio_in_pin=15\n')
+	file_cache.clear()
 			
 			
 if __name__ == "__main__":
-	print check_ir()
+	print(check_ir())
 	#disable_ir()
 	#enable_ir()
\ No newline at end of file
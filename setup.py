@@ -10,6 +10,6 @@ setuptools.setup(
 	description="Drivers and examples for using the BrickPi in Python",
 	author="Dexter Industries",
 	url="http://www.dexterindustries.com/BrickPi/",
-	py_modules=['BrickPi','ir_receiver_check'],
+	py_modules=['BrickPi','BrickPiAsync','BrickPiEmulator','BrickPiMetrics','BrickPiReplay','BrickPiNumpy','BrickPiI2C','ir_receiver_check'],
 	install_requires=open('requirements.txt').readlines(),
 )